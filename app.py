@@ -17,9 +17,11 @@ from helper.text_transformation import text_transformation_inputs
 from helper.search_terms import search_terms_inputs
 from helper.entities import gen_entities
 from helper.top_words import gen_top_words
+from helper.top_phrases import gen_top_phrases
 from helper.sentiment import gen_sentiment
 from helper.summary_statistics import gen_summary_statistics
 from helper.similarity import gen_similarity
+from helper.topics import gen_topics
 
 ### page setup and authentication
 ui_tab()  # icon and page title
@@ -76,10 +78,12 @@ else:
         "Text transformation",
         "Search terms",
         "Top words",
+        "Top phrases",
         "Top entities",
         "Sentiment",
         "Summary statistics",
         "Text similarity",
+        "Topic modelling",
     ]
 
 st.pills(
@@ -129,13 +133,13 @@ Once `transformation_parameters.xlsx` has been uploaded and transformations have
 ### Search terms
 This section enable the searching of specific terms within the corpus, as well as returning the contexts where they appear. Upload the `search_terms.xlsx` file containing the desired search terms on the `search_terms` sheet. The sheet can have multiple columns for grouping the search terms, but only the rightmost columns' contents will be searched for.
 
-Under `Search parameters`, `Length of character buffer` tells the number of characters in either direction of the found term to return as context of the term. `Co-occurring n words limit` stipulates how many top co-occurring words to return. E.g., if "trade" is the search term, a value of 50 here will let you see the top 50 words that occur in the contexts that contain the term "trade".
+Under `Search parameters`, `Length of character buffer` tells the number of characters in either direction of the found term to return as context of the term. The buffer also sets the window of the sentiment of the contexts, the co-occurring words and the second-level counts, so after changing it, execute the search again for the downloads to use the new buffer. `Co-occurring n words limit` stipulates how many top co-occurring words to return. E.g., if "trade" is the search term, a value of 50 here will let you see the top 50 words that occur in the contexts that contain the term "trade". Check `Parallel search` to split the documents into shards and search them in several processes at once, which is much faster for large corpora on machines with several CPU cores.
 
-The `second_level_search_terms` sheet of the `search_terms.xlsx` file allows you to search for terms within the contexts of existing search terms. For instance, if you previously searched for "trade", you could then search for "tariff" and see how many times the word "tariff" occurs in the context where "trade" is mentioned.
+The `second_level_search_terms` sheet of the `search_terms.xlsx` file allows you to search for terms within the contexts of existing search terms. For instance, if you previously searched for "trade", you could then search for "tariff" and see how many times the word "tariff" occurs in the context where "trade" is mentioned. Write the second-level term as e.g. `NEAR/5 tariff` to only count "tariff" when it is within 5 words of "trade".
 
-Once the `search_terms.xlsx` file has been uploaded, click the `Execute search` button to perform the search. From the `Outputs` section, you can download the contexts of all the found search terms, the number of found terms, and the count of co-occurring words.
+Once the `search_terms.xlsx` file has been uploaded, click the `Execute search` button to perform the search. From the `Outputs` section, you can download the contexts of all the found search terms, the number of found terms, and the count of co-occurring words. The output can be downloaded as an Excel workbook, or for very large searches as a zip file of CSV or Parquet files. Excel sheets with more rows than Excel allows are continued on additional sheets, e.g. `all_occurrences_2`.
 
-In the `Individual search term` section you can perform and visualize the results of searching for a single term. Enter the term in the `Search term` field, then hit `Execute individual term search` to perform the search. You can group the results by a column in the metadata.
+In the `Individual search term` section you can perform and visualize the results of searching for a single term. Enter the term in the `Search term` field, then hit `Execute individual term search` to perform the search. You can search for several terms at once by separating them with commas, and count either of multiple words as one term by separating them with `|`, e.g. `shipping|trade`. The plot updates while the search runs. You can group the results by a column in the metadata.
 
 ### Top words
 Here, you can see the top occurring words in the corpus.
@@ -143,18 +147,22 @@ Here, you can see the top occurring words in the corpus.
 - `Top n words`: how many top words to display.
 - `List of text ids to consider in the count`: a comma-separated list of text ids to consider when calculating the top occurring words. E.g., if you want to only consider some documents, you can enter `1,4,6` in this field.
 - `Metadata column groupiong to consider in teh count`: you can also select a metadata column to gropu the results by. Say `year` is a column in the metadata, you could view the top words for all documents from e.g., 2024 and 2023.
-- `Generate top words`: push this button to run the calculation.
+- `Generate top words`: push this button to run the calculation. The words of each document are only counted the first time, or after the texts have been transformed again, so changing the number of words, the text ids or the grouping afterwards is instant.
 - `Download top words`: push this button to download the Excel file with the results.
 
 Once you click `Generate top words`, you will see a bar plot and word cloud of the most commonly occurring words.
 
+### Top phrases
+This section is the same as the top words section, but counts phrases of several words, e.g. "climate finance" or "least developed countries", rather than single words. Set `Number of words in a phrase` to choose the phrase length. Phrases do not run across the end of a sentence, and words on the `exclude` tab of the `transformation_parameters.xlsx` file break up phrases. The counts are exact, and memory use stays bounded however large the corpus is.
+
 ### Top entities
-This section is the same as the top words section, but searchs for entities rather than words. Entities include things like geographic locations, cardinal numbers, organizations, etc.
+This section is the same as the top words section, but searchs for entities rather than words. Entities include things like geographic locations, cardinal numbers, organizations, etc. Finding entities is slow, so the entities of each document are saved and only documents that are new or have changed are processed again. Check `Batched entity extraction` to split the documents into pieces and process them in batches across several processes, which is much faster for large corpora. The progress bar shows how many documents and characters are processed per second.
 
 ### Sentiment
 This section enables you to use the [VADER](https://pypi.org/project/vaderSentiment/) sentiment analysis tool. A phrase or sentence can have a score from -4 (most negative) to +4 (most positive). A score of 0 is a neutral sentence. The score for an individual document is calculated as the average of this number for all the sentences in the document. The sentiment scores generated here should be taken with a grain of salt, as the VADER algorithm is not perfect and you may find sentences whose sentiment scores you do not agree with.
 
-- `Generate sentiment scores`: push this button to generate the sentiment scores. Depending on the length and number of your documents, this step can take a while.
+- `Generate sentiment scores`: push this button to generate the sentiment scores. Depending on the length and number of your documents, this step can take a while the first time. The score of every sentence is saved, so later runs only score documents that are new or have changed, and the sentence-by-sentence report of a document is only calculated once.
+- `Parallel sentiment scoring`: check this before generating the scores to score the sentences in several processes at once, which is much faster for large corpora.
 - `Download sentiment scores`: push this button to download the sentiment score results. `avg_sentiment_w_neutral` shows the average sentiment of each document including neutral sentences.	`avg_sentiment_wo_neutral` shows the average sentiment excluding neutral sentences. `neutral_proportion` shows the proportion of the document that is neutral.
 - `Which column to plot in the sentiment bar analysis`: select which of the three columns to display in the bar plot.
 - `Metadata column to display on x axis`: which column from the metadata file to display on the x axis of the bar plot.
@@ -162,12 +170,23 @@ This section enables you to use the [VADER](https://pypi.org/project/vaderSentim
 You can get a sentence by sentence breakdown of the sentiment for a particular text id or of an entirely new string/text pasted directly into the `Text ID or string for full sentiment report` field.
 
 ### Summary statistics
-This section generates various summary statistics about the documents. Options are the same as on the `Sentiment` tab, and statistics generated are explained on the tab.
+This section generates various summary statistics about the documents. Options are the same as on the `Sentiment` tab, and statistics generated are explained on the tab. The statistics of every document are saved, so later runs only calculate documents that are new or whose text has changed. Check `Parallel summary statistics` to calculate the statistics of the documents in several processes at once.
 
 ### Text similarity
 This section calculates the similarity between the documents using the [TF-IDF](https://en.wikipedia.org/wiki/Tf%E2%80%93idf) algorithm. You can select which text ids to consider in the analysis and which metadata column to display on the axes and cluster plot.
 
-The heat map shows a similarity matrix between every document. The cluster plot condenses the similarity matrix to two dimensions then plots them, letting you see visually how close or far different documents are to each other.
+The heat map shows a similarity matrix between every document. The cluster plot condenses the TF-IDF vectors of the documents to two dimensions then plots them, letting you see visually how close or far different documents are to each other. The two dimensions are calculated once for the whole corpus, so changing the selected text ids or the label column only redraws the plot. The word counts of every document are stored the first time they are needed, so after documents are added or changed only those documents are read again, and any selection of text ids is calculated from the stored counts.
+
+The full similarity matrix grows with the square of the number of documents, so `Full matrix` is only offered for selections of up to a few thousand documents. It is calculated a piece at a time into a file on disk and reused until the selection or its documents change. The Excel download is made for small selections, larger ones can be downloaded as CSV. The heat map is interactive. For selections of more than 500 documents it shows blocks of documents with the highest similarity between two different documents in each block, and clicking a block, or choosing it under `Heat map view`, zooms into its documents. Choose `Top neighbours` under `Similarity output` to instead list the most similar documents of each document, which works for corpora of any size. `Number of neighbours per document` sets how many to list and `Minimum similarity` leaves out neighbours that are less similar.
+
+`Document clusters` groups the selected documents into the chosen number of clusters of similar documents with minibatch k-means on their TF-IDF vectors, which works a batch of documents at a time and scales to large corpora. The cluster summary lists the size and most characteristic words of each cluster, and the documents can be downloaded with their metadata and the cluster they belong to.
+
+`Near-duplicate documents` finds clusters of documents that are (nearly) the same text, such as the same report downloaded twice or a draft and its final version, from the runs of 5 words they share. `Minimum Jaccard similarity` sets how much two documents need to share to count as duplicates. The overlap is estimated with MinHash signatures, which are calculated once per version of the transformed texts, so the corpus is never compared document by document and changing the threshold is quick. Check `Exclude near-duplicates from other analyses` to leave all but the first document of each cluster out of top words, top phrases, entities and text similarity whenever no text ids are entered there.
+
+### Topic modelling
+This section finds the topics of the corpus with a topic model. A topic is a set of words that tend to occur together, and every document is a mix of topics. Choose `LDA` (latent Dirichlet allocation) or `NMF` (non-negative matrix factorization) under `Topic model` and how many topics to find under `Number of topics`. Words in the `exclude` sheet of the transformation parameters are left out.
+
+The model is trained on the word counts of the transformed documents a batch of documents at a time, so it works for large corpora. Each combination of model and number of topics is stored once trained. Running it again with unchanged documents reuses it, and if documents were only added to the corpus the stored model is updated with the new documents rather than trained again. The download contains the top words of each topic, the average topic proportions of the documents of each group of the `Metadata column grouping for the topic proportions` column, and the topic proportions of every document.
 """
     )
 elif st.session_state["selected_tab"] == "Corpus metadata":
@@ -198,6 +217,8 @@ elif st.session_state["selected_tab"] == "Search terms":
     search_terms_inputs()
 elif st.session_state["selected_tab"] == "Top words":
     gen_top_words()
+elif st.session_state["selected_tab"] == "Top phrases":
+    gen_top_phrases()
 elif st.session_state["selected_tab"] == "Top entities":
     gen_entities()
 elif st.session_state["selected_tab"] == "Sentiment":
@@ -206,3 +227,5 @@ elif st.session_state["selected_tab"] == "Summary statistics":
     gen_summary_statistics()
 elif st.session_state["selected_tab"] == "Text similarity":
     gen_similarity()
+elif st.session_state["selected_tab"] == "Topic modelling":
+    gen_topics()
@@ -0,0 +1,74 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+def cache_path(data_path):
+    "directory of the corpus's derived artifacts, created if it does not exist"
+    path = f"{data_path}cache/"
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def corpus_version(file_paths):
+    "fingerprint of a set of files from their names, sizes and modification times. Changes whenever a file is added, removed or rewritten, without reading any of them"
+    fingerprint = hashlib.md5()
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            fingerprint.update(
+                f"{file_path}:{stat.st_size}:{stat.st_mtime_ns};".encode()
+            )
+        except FileNotFoundError:
+            fingerprint.update(f"{file_path}:missing;".encode())
+    return fingerprint.hexdigest()
+
+
+def file_fingerprint(file_path):
+    "(size, modification time) of a file, (-1, -1) if it does not exist"
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return -1, -1
+    return stat.st_size, stat.st_mtime_ns
+
+
+def file_hash(file_path):
+    "md5 hash of a file's bytes, empty if it does not exist"
+    try:
+        with open(file_path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+    except FileNotFoundError:
+        return ""
+
+
+def save_artifact(file_path, version, **arrays):
+    "write numpy arrays with the corpus version they were built from. Written to a temporary file first so a half-written artifact is never read"
+    tmp_path = f"{file_path}.tmp.npz"
+    np.savez(tmp_path, version=np.array(version), **arrays)
+    os.replace(tmp_path, file_path)
+
+
+def load_artifact(file_path, version):
+    "arrays of an artifact written by save_artifact, or None if it does not exist or was built from a different corpus version"
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with np.load(file_path, allow_pickle=False) as artifact:
+            if str(artifact["version"]) != version:
+                return None
+            return {key: artifact[key] for key in artifact.files if key != "version"}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_artifact(file_path):
+    "all arrays of an artifact written by save_artifact including its `version`, whatever the version, or None if it does not exist"
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with np.load(file_path, allow_pickle=False) as artifact:
+            return {key: artifact[key] for key in artifact.files}
+    except (OSError, ValueError):
+        return None
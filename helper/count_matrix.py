@@ -0,0 +1,299 @@
+import ast
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from helper.corpus_cache import cache_path, corpus_version, load_artifact, save_artifact
+from helper.token_store import gen_token_store
+
+
+def parse_count_dict(stringx):
+    "a count dictionary stored as a string by nlp_pipeline. Counts written as numpy scalars, e.g. `np.int64(3)`, are read as plain numbers"
+    return ast.literal_eval(re.sub(r"np\.\w+\(([^()]*)\)", r"\1", stringx))
+
+
+def build_count_matrix(count_dicts):
+    """document x term CSR matrix from one count dictionary per document
+    parameters:
+        :count_dicts: iterable[dict]: term counts of each document, in row order
+    output:
+        :sparse.csr_matrix: counts, columns in the alphabetical order of the vocabulary
+        :np.ndarray: vocabulary
+    """
+    vocab_index = {}
+    indptr = [0]
+    indices = []
+    data = []
+    for counts in count_dicts:
+        for term, count in counts.items():
+            indices.append(vocab_index.setdefault(term, len(vocab_index)))
+            data.append(count)
+        indptr.append(len(indices))
+
+    vocab = np.array(list(vocab_index.keys()), dtype=str)
+    matrix = sparse.csr_matrix(
+        (
+            np.array(data, dtype=np.int64),
+            np.array(indices, dtype=np.int64),
+            np.array(indptr, dtype=np.int64),
+        ),
+        shape=(len(indptr) - 1, len(vocab)),
+    )
+
+    # alphabetical columns, so ties in counts sort alphabetically for free
+    order = np.argsort(vocab, kind="stable")
+    return matrix[:, order].tocsr(), vocab[order]
+
+
+def store_count_matrix(store, block_tokens=10000000):
+    """document x word count matrix from a token store, counting words like nlp_pipeline's gen_word_count_dict (more than 1 character, not numeric). Documents are counted in blocks of about block_tokens tokens
+    parameters:
+        :store: dict: token store from gen_token_store
+        :block_tokens: int: number of tokens counted at once
+    output:
+        :sparse.csr_matrix: counts, columns in the alphabetical order of the vocabulary
+        :np.ndarray: vocabulary
+    """
+    vocab = store["vocab"]
+    doc_offsets = store["doc_offsets"]
+    n_docs = len(doc_offsets) - 1
+    valid = (store["token_lengths"] > 1) & ~np.fromiter(
+        (x.isnumeric() for x in vocab), dtype=bool, count=len(vocab)
+    )
+
+    blocks = []
+    start = 0
+    while start < n_docs:
+        end = max(
+            int(np.searchsorted(doc_offsets, doc_offsets[start] + block_tokens)),
+            start + 1,
+        )
+        end = min(end, n_docs)
+        tokens = np.asarray(store["tokens"][doc_offsets[start] : doc_offsets[end]])
+        rows = np.repeat(np.arange(end - start), np.diff(doc_offsets[start : end + 1]))
+        keep = valid[tokens]
+        blocks.append(
+            sparse.csr_matrix(
+                (
+                    np.ones(int(keep.sum()), dtype=np.int64),
+                    (rows[keep], tokens[keep]),
+                ),
+                shape=(end - start, len(vocab)),
+            )
+        )
+        start = end
+
+    matrix = (
+        sparse.vstack(blocks, format="csr")
+        if blocks
+        else sparse.csr_matrix((0, len(vocab)), dtype=np.int64)
+    )
+
+    # alphabetical columns, so ties in counts sort alphabetically for free
+    columns = np.flatnonzero(valid)
+    columns = columns[np.argsort(vocab[columns], kind="stable")]
+    return matrix[:, columns].tocsr(), vocab[columns].astype(str)
+
+
+def save_count_matrix(artifact_path, version, matrix, vocab, text_ids):
+    "store a count matrix with its vocabulary and row text ids"
+    save_artifact(
+        artifact_path,
+        version,
+        data=matrix.data,
+        indices=matrix.indices,
+        indptr=matrix.indptr,
+        shape=np.array(matrix.shape),
+        vocab=vocab,
+        text_ids=np.array(text_ids),
+    )
+
+
+def load_count_matrix(artifact_path, version):
+    "(matrix, vocab, text_ids) stored by save_count_matrix, or None if missing or out of date"
+    artifact = load_artifact(artifact_path, version)
+    if artifact is None:
+        return None
+    matrix = sparse.csr_matrix(
+        (artifact["data"], artifact["indices"], artifact["indptr"]),
+        shape=tuple(artifact["shape"]),
+    )
+    return matrix, artifact["vocab"], artifact["text_ids"]
+
+
+def transformed_paths(data_path, text_ids, path_prefix="transformed"):
+    "paths of the transformed texts"
+    return [
+        f"{data_path}transformed_txt_files/{path_prefix}_{text_id}.txt"
+        for text_id in text_ids
+    ]
+
+
+def word_count_version(data_path, text_ids, path_prefix="transformed"):
+    "version of the word counts of the transformed texts, changes whenever gen_word_count_matrix would recount"
+    return corpus_version(transformed_paths(data_path, text_ids, path_prefix))
+
+
+def gen_word_count_matrix(data_path, text_ids, path_prefix="transformed"):
+    """document x word count matrix of the transformed texts, counted from the corpus's token store, stored in the corpus's cache/ directory and only rebuilt when a transformed text changes
+    parameters:
+        :data_path: str: processor.data_path of the corpus
+        :text_ids: list[int]: text ids of the corpus, one row each
+        :path_prefix: str: prefix of the files in the transformed_txt_files/ directory
+    output:
+        :sparse.csr_matrix: word counts, one row per text id
+        :np.ndarray: vocabulary, one entry per column
+        :np.ndarray: text id of each row
+    """
+    text_paths = transformed_paths(data_path, text_ids, path_prefix)
+    version = corpus_version(text_paths)
+    artifact_path = f"{cache_path(data_path)}{path_prefix}_word_count_matrix.npz"
+
+    cached = load_count_matrix(artifact_path, version)
+    if cached is not None:
+        return cached
+
+    store = gen_token_store(data_path, text_ids, path_prefix)
+    matrix, vocab = store_count_matrix(store)
+    save_count_matrix(artifact_path, version, matrix, vocab, text_ids)
+
+    return matrix, vocab, np.array(text_ids)
+
+
+def top_terms(matrix, vocab, row_text_ids, text_ids, n_words, exclude_words=None):
+    """top n terms summed over a subset of documents. Ties are broken alphabetically
+    parameters:
+        :matrix: sparse.csr_matrix: document x term counts
+        :vocab: np.ndarray: term of each column
+        :row_text_ids: np.ndarray: text id of each row
+        :text_ids: list[int]: text ids to sum over
+        :n_words: int: how many terms to return
+        :exclude_words: list[str]: terms to leave out
+    output:
+        :pd.DataFrame: `word` and `count` columns, sorted by descending count
+    """
+    rows = pd.Index(row_text_ids).get_indexer(text_ids)
+    totals = np.asarray(matrix[rows[rows >= 0], :].sum(axis=0)).ravel()
+    if exclude_words:
+        totals[pd.Index(vocab).isin(exclude_words)] = 0
+
+    candidates = np.flatnonzero(totals)
+    if len(candidates) > n_words:
+        # everything tied with the n-th largest count, so the alphabetical tie break is exact
+        threshold = np.partition(totals[candidates], -n_words)[-n_words]
+        candidates = candidates[totals[candidates] >= threshold]
+    top = candidates[np.argsort(-totals[candidates], kind="stable")][:n_words]
+
+    return pd.DataFrame({"word": vocab[top], "count": totals[top]})
+
+
+def merge_terms(matrix, terms):
+    """sum the columns of a document x term matrix that map to the same term, e.g. an entity under its different labels
+    parameters:
+        :matrix: sparse.csr_matrix: document x term counts
+        :terms: list[str]: term each column is counted as
+    output:
+        :sparse.csr_matrix: counts, columns in the alphabetical order of the merged vocabulary
+        :np.ndarray: merged vocabulary
+    """
+    vocab, codes = np.unique(np.array(terms, dtype=str), return_inverse=True)
+    merge = sparse.csr_matrix(
+        (np.ones(len(codes), dtype=np.int64), (np.arange(len(codes)), codes.ravel())),
+        shape=(len(codes), len(vocab)),
+    )
+    return (matrix @ merge).tocsr(), vocab
+
+
+def gen_entity_count_matrix(data_path, text_ids):
+    """document x entity count matrix from nlp_pipeline's csv_outputs/entity_counts.csv, stored in the corpus's cache/ directory and only rebuilt when the CSV changes. Terms are `entity|label`
+    parameters:
+        :data_path: str: processor.data_path of the corpus
+        :text_ids: list[int]: text ids of the corpus, one row each
+    output:
+        :sparse.csr_matrix: entity counts, one row per text id
+        :np.ndarray: vocabulary, one entry per column
+        :np.ndarray: text id of each row
+    """
+    csv_path = f"{data_path}csv_outputs/entity_counts.csv"
+    version = corpus_version([csv_path]) + str(list(text_ids))
+    artifact_path = f"{cache_path(data_path)}entity_count_matrix.npz"
+
+    cached = load_count_matrix(artifact_path, version)
+    if cached is not None:
+        return cached
+
+    if os.path.exists(csv_path):
+        csv = pd.read_csv(csv_path)
+        entity_dicts = dict(zip(csv.text_id, csv.entity_count_dict))
+    else:
+        entity_dicts = {}
+
+    def count_dicts():
+        for text_id in text_ids:
+            entity_dict = entity_dicts.get(text_id, "")
+            if str(entity_dict) in ["", "nan"]:
+                yield {}
+            else:
+                yield parse_count_dict(entity_dict)
+
+    matrix, vocab = build_count_matrix(count_dicts())
+    save_count_matrix(artifact_path, version, matrix, vocab, text_ids)
+
+    return matrix, vocab, np.array(text_ids)
+
+
+def grouped_top_terms(
+    matrix, vocab, row_text_ids, metadata, group_column, n_words, exclude_words=None
+):
+    """top n terms of every group of documents at once. A group x document indicator matrix times the document x term counts gives the totals of all groups, and one sort ranks the terms within each group. Ties are broken alphabetically
+    parameters:
+        :matrix: sparse.csr_matrix: document x term counts
+        :vocab: np.ndarray: term of each column
+        :row_text_ids: np.ndarray: text id of each row
+        :metadata: pd.DataFrame: metadata with `text_id` and the grouping column
+        :group_column: str: metadata column to group the documents by
+        :n_words: int: how many terms to return per group
+        :exclude_words: list[str]: terms to leave out
+    output:
+        :pd.DataFrame: the grouping column, `word` and `count`, groups in order of first appearance in the metadata and terms by descending count
+    """
+    codes, groups = pd.factorize(metadata[group_column])
+    row_codes = (
+        pd.Series(codes, index=metadata.text_id.values)
+        .groupby(level=0)
+        .first()
+        .reindex(row_text_ids)
+        .fillna(-1)
+        .astype(int)
+        .values
+    )
+    rows = np.flatnonzero(row_codes >= 0)
+
+    indicator = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int64), (row_codes[rows], rows)),
+        shape=(len(groups), matrix.shape[0]),
+    )
+    totals = (indicator @ matrix).tocoo()
+    if exclude_words:
+        keep = ~pd.Index(vocab).isin(exclude_words)[totals.col]
+        totals = sparse.coo_matrix(
+            (totals.data[keep], (totals.row[keep], totals.col[keep])),
+            shape=totals.shape,
+        )
+
+    # by group, then descending count, then alphabetically
+    order = np.lexsort((totals.col, -totals.data, totals.row))
+    group_row = totals.row[order]
+    rank = np.arange(len(order)) - np.searchsorted(group_row, group_row)
+    order = order[(rank < n_words) & (totals.data[order] > 0)]
+
+    return pd.DataFrame(
+        {
+            group_column: groups.take(totals.row[order]),
+            "word": vocab[totals.col[order]],
+            "count": totals.data[order],
+        }
+    )
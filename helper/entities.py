@@ -4,6 +4,14 @@ import plotly.express as px
 import streamlit as st
 import sys
 
+from helper.count_matrix import (
+    gen_entity_count_matrix,
+    grouped_top_terms,
+    merge_terms,
+    top_terms,
+)
+from helper.entity_cache import gen_entity_counts_cached
+from helper.near_duplicates import excluded_text_ids
 from helper.text_transformation import initialize_processor
 from helper.progress_bar import Logger
 
@@ -44,13 +52,35 @@ def gen_entities():
         )
 
         # selection of text ids
+        # near-duplicates are left out of the default selection if excluded
+        excluded = excluded_text_ids(processor.data_path)
         if st.session_state["top_entities_text_ids"] == "":
-            text_ids = list(processor.metadata.text_id.values)
+            text_ids = [
+                x for x in processor.metadata.text_id.values if x not in excluded
+            ]
         else:
             text_ids = eval("[" + st.session_state["top_entities_text_ids"] + "]")
+            # text ids entered by hand are used as they are, in the groups too
+            excluded = []
 
             # group by column
 
+        st.session_state["batched_ner"] = st.checkbox(
+            "Batched entity extraction",
+            value=False,
+            help="Split the documents into pieces at sentence boundaries and run them through the entity model in batches across several processes. Much faster for large corpora, but entities that span two pieces may rarely be missed.",
+        )
+
+        if st.session_state["batched_ner"]:
+            st.session_state["ner_n_process"] = st.number_input(
+                "Number of entity extraction processes",
+                min_value=1,
+                value=max(1, (os.cpu_count() or 2) // 2),
+                help="How many processes to run the entity model in. Each process loads its own copy of the model, so this is limited by memory as well as CPU cores.",
+            )
+        else:
+            st.session_state["ner_n_process"] = 1
+
         # run button
         st.session_state["run_top_entities_button"] = st.button(
             "Generate top entities",
@@ -64,62 +94,45 @@ def gen_entities():
                 old_stdout = sys.stdout
                 sys.stdout = Logger(st.progress(0), st.empty())
 
-                # remove an existing word count file
-                if os.path.exists(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/transformed_entity_counts.csv"
-                ):
-                    os.remove(
-                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/transformed_entity_counts.csv"
-                    )
+                # only documents that are new or changed since the last run go through NER
+                gen_entity_counts_cached(
+                    processor,
+                    text_ids=list(processor.metadata.text_id.values),
+                    batched=st.session_state["batched_ner"],
+                    n_process=st.session_state["ner_n_process"],
+                )
 
-                processor.gen_entity_count_csv(
+                # entity counts of every document, only rebuilt when entity_counts.csv changes
+                matrix, vocab, row_text_ids = gen_entity_count_matrix(
+                    data_path=processor.data_path,
                     text_ids=list(processor.metadata.text_id.values),
                 )
 
+                # counted without the entity label, e.g. `paris|GPE` and `paris|ORG` are both `paris`
+                matrix, vocab = merge_terms(matrix, [x.split("|")[0] for x in vocab])
+
             # generate the CSV
             # no grouping
             if st.session_state["top_entities_groups"] == "NA":
-                p, df = processor.bar_plot_word_count(
+                df = top_terms(
+                    matrix,
+                    vocab,
+                    row_text_ids,
                     text_ids=text_ids,
-                    path_prefix="entity",
                     n_words=st.session_state["n_top_entities"],
-                    title="",
                 )
-            # grouping
+            # grouping, all groups at once
             else:
-                groups = list(
-                    st.session_state["metadata"][
-                        st.session_state["top_entities_groups"]
-                    ].unique()
+                df = grouped_top_terms(
+                    matrix,
+                    vocab,
+                    row_text_ids,
+                    metadata=st.session_state["metadata"].loc[
+                        lambda x: ~x.text_id.isin(excluded)
+                    ],
+                    group_column=st.session_state["top_entities_groups"],
+                    n_words=st.session_state["n_top_entities"],
                 )
-                for group in groups:
-                    tmp_ids = list(
-                        st.session_state["metadata"].loc[
-                            lambda x: x[st.session_state["top_entities_groups"]]
-                            == group,
-                            "text_id",
-                        ]
-                    )
-                    p, tmp_df = processor.bar_plot_word_count(
-                        text_ids=tmp_ids,
-                        path_prefix="entity",
-                        n_words=st.session_state["n_top_entities"],
-                        title="",
-                    )
-                    tmp_df[st.session_state["top_entities_groups"]] = group
-                    tmp_df = tmp_df.loc[
-                        :,
-                        [st.session_state["top_entities_groups"]]
-                        + [
-                            x
-                            for x in tmp_df.columns
-                            if x != st.session_state["top_entities_groups"]
-                        ],
-                    ]
-                    if group == groups[0]:
-                        df = tmp_df.copy()
-                    else:
-                        df = pd.concat([df, tmp_df], ignore_index=True)
 
             st.info("Top entities successfully calculated!")
 
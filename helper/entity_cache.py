@@ -0,0 +1,359 @@
+from collections import Counter
+from importlib.metadata import PackageNotFoundError, version
+import json
+import os
+import time
+
+import pandas as pd
+
+from helper.corpus_cache import cache_path, file_hash
+
+# spacy model of each language, the same models nlp_pipeline uses
+ner_models = {
+    "ca": "ca_core_news_lg",
+    "zh": "zh_core_web_lg",
+    "hr": "hr_core_news_lg",
+    "nl": "nl_core_news_lg",
+    "en": "en_core_web_lg",
+    "fi": "fi_core_news_lg",
+    "fr": "fr_core_news_lg",
+    "de": "de_core_news_lg",
+    "el": "el_core_news_lg",
+    "it": "it_core_news_lg",
+    "ja": "ja_core_news_lg",
+    "ko": "ko_core_news_lg",
+    "lt": "lt_core_news_lg",
+    "mk": "mk_core_news_lg",
+    "no": "nb_core_news_lg",
+    "pl": "pl_core_news_lg",
+    "pt": "pt_core_news_lg",
+    "ro": "ro_core_news_lg",
+    "ru": "ru_core_news_lg",
+    "es": "es_core_news_lg",
+    "sv": "sv_core_news_lg",
+    "uk": "uk_core_news_lg",
+}
+
+# spacy model of languages without one, and of languages whose model is not installed
+default_ner_model = "en_core_web_lg"
+
+
+def entity_cache_path(data_path):
+    "directory of the per-document entity caches"
+    path = f"{cache_path(data_path)}entities/"
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def ner_model_name(lang):
+    "name of the spacy model for a language, English if the language has no model"
+    return ner_models.get(lang, default_ner_model)
+
+
+def ner_model_version(model_name):
+    "installed version of a spacy model package"
+    try:
+        return version(model_name)
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def ner_text(stringx):
+    "text as it goes through the model, with line breaks and page markers replaced by spaces"
+    stringx = stringx.replace("\n", " ")
+    stringx = stringx.replace("[newpage]", " ")
+    return stringx
+
+
+def entity_counts(ner, stringx):
+    "counts of `entity|label` in a text, the same as nlp_pipeline's gen_entity_count_dict but with an already loaded model"
+    stringx = ner_text(stringx)
+
+    ner.max_length = max(ner.max_length, len(stringx))
+    text = ner(stringx)
+
+    tmp = pd.DataFrame(
+        {
+            "entity": [ent.text for ent in text.ents],
+            "label": [ent.label_ for ent in text.ents],
+        }
+    )
+    tmp = (
+        tmp.groupby(["entity", "label"])["entity"].count().sort_values(ascending=False)
+    )
+
+    return {x[0] + "|" + x[1]: int(count) for x, count in zip(tmp.index, tmp.values)}
+
+
+def read_cache_entry(cache_file):
+    "a document's cached entities, or None"
+    try:
+        with open(cache_file, "r", encoding="UTF-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache_entry(cache_file, entry):
+    "write a document's cached entities"
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, "w", encoding="UTF-8") as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(tmp_file, cache_file)
+
+
+def ner_pipes(ner):
+    "keep only the pipeline components needed for named entities, plus the shared tok2vec/transformer if the entity recognizer listens to it"
+    keep = {"ner", "entity_ruler"}
+    for name in ["tok2vec", "transformer"]:
+        if name in ner.pipe_names and any(
+            x in keep for x in getattr(ner.get_pipe(name), "listening_components", [])
+        ):
+            keep.add(name)
+    ner.select_pipes(disable=[x for x in ner.pipe_names if x not in keep])
+    return ner
+
+
+def sentence_chunks(stringx, chunk_chars=100000):
+    "split a text into pieces of at most chunk_chars characters, cutting after a sentence-ending period where possible, otherwise at a space"
+    chunks = []
+    start = 0
+    while len(stringx) - start > chunk_chars:
+        end = start + chunk_chars
+        cut = stringx.rfind(". ", start, end)
+        if cut == -1:
+            cut = stringx.rfind(" ", start, end)
+        else:
+            cut += 1
+        if cut <= start:
+            cut = end
+        chunks.append(stringx[start:cut])
+        start = cut
+    chunks.append(stringx[start:])
+    return chunks
+
+
+def read_texts(data_path, text_ids):
+    "(text_id, text) of original texts in txt_files/, read one at a time as they are needed"
+    for text_id in text_ids:
+        with open(f"{data_path}txt_files/{text_id}.txt", "r", encoding="UTF-8") as file:
+            yield text_id, file.read()
+
+
+def entity_counts_batched(ner, texts, n_process=1, batch_size=32, chunk_chars=100000):
+    """entity counts of several texts, streaming sentence-aligned chunks of them through the model with nlp.pipe. Texts are only read and split as the model asks for more chunks
+    parameters:
+        :ner: spacy.Language: loaded model
+        :texts: iterable[(text_id, str)]: texts to count entities in
+        :n_process: int: number of worker processes
+        :batch_size: int: number of chunks per batch
+        :chunk_chars: int: maximum length of a chunk in characters
+    output:
+        :iterator[(text_id, dict, int)]: counts of `entity|label` of each text and the number of characters of it that went through the model, as soon as all of its chunks are done
+    """
+    # number of chunks of each text still in the model, set before the text's first chunk is handed over
+    n_chunks = {}
+    n_chars = {}
+
+    def chunks():
+        for text_id, stringx in texts:
+            stringx = ner_text(stringx)
+            text_chunks = sentence_chunks(stringx, chunk_chars)
+            n_chunks[text_id] = len(text_chunks)
+            n_chars[text_id] = len(stringx)
+            for chunk in text_chunks:
+                yield chunk, text_id
+
+    ner.max_length = max(ner.max_length, chunk_chars)
+    counts = {}
+    for doc, text_id in ner.pipe(
+        chunks(), as_tuples=True, batch_size=batch_size, n_process=n_process
+    ):
+        text_counts = counts.setdefault(text_id, Counter())
+        text_counts.update(ent.text + "|" + ent.label_ for ent in doc.ents)
+        n_chunks[text_id] -= 1
+        if n_chunks[text_id] == 0:
+            text_counts = counts.pop(text_id)
+            yield text_id, dict(
+                sorted(text_counts.items(), key=lambda x: (-x[1], x[0]))
+            ), n_chars.pop(text_id)
+
+
+def gen_entity_counts_cached(
+    processor,
+    text_ids,
+    load_model=None,
+    batched=False,
+    n_process=1,
+    batch_size=32,
+    chunk_chars=100000,
+):
+    """entity counts of the original texts in txt_files/, cached per document and keyed by the text's hash and the NER model for its language and that model's version. Only new or changed documents go through NER, their texts are read as the model gets to them and each result is cached as soon as it arrives. The results are written to csv_outputs/entity_counts.csv in nlp_pipeline's format, and the CSV is only rewritten when a count changed
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+        :text_ids: list[int]: text ids to count entities for
+        :load_model: callable: function loading a spacy model by name, spacy.load by default
+        :batched: bool: split the documents into sentence-aligned chunks and stream them through the model in batches, rather than one whole document at a time
+        :n_process: int: number of worker processes in batched mode
+        :batch_size: int: number of chunks per batch in batched mode
+        :chunk_chars: int: maximum length of a chunk in characters in batched mode
+    output:
+        :dict: entity count dictionary of each text id
+    """
+    if load_model is None:
+        import spacy
+
+        load_model = spacy.load
+
+    cache_dir = entity_cache_path(processor.data_path)
+    models = {}
+    model_versions = {}
+    counts = {}
+    languages = dict(
+        zip(processor.metadata.text_id, processor.metadata.detected_language)
+    )
+
+    def get_model(model_name, lang):
+        "each model is only loaded once per run. A model that cannot be loaded is replaced by the English one, which must load"
+        if model_name not in models:
+            try:
+                ner = load_model(model_name)
+            except:
+                if model_name == default_ner_model:
+                    raise
+                print(f"language {lang} not found, performing with English")
+                models[model_name] = get_model(default_ner_model, "en")
+            else:
+                models[model_name] = ner_pipes(ner)
+        return models[model_name]
+
+    # documents whose cached entities are still valid
+    to_extract = {}
+    for text_id in text_ids:
+        text_path = f"{processor.data_path}txt_files/{text_id}.txt"
+        if not os.path.exists(text_path):
+            continue
+
+        model_name = ner_model_name(languages.get(text_id))
+        # each model's version is only looked up once per run
+        if model_name not in model_versions:
+            model_versions[model_name] = ner_model_version(model_name)
+        entry = read_cache_entry(f"{cache_dir}{text_id}.json")
+        stat = os.stat(text_path)
+        key = {
+            "model": model_name,
+            "model_version": model_versions[model_name],
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+        # unchanged file, not even re-read
+        if entry is not None and all(entry[k] == v for k, v in key.items()):
+            counts[text_id] = dict(entry["counts"])
+            continue
+
+        key["text_hash"] = file_hash(text_path)
+
+        # touched but identical file
+        if (
+            entry is not None
+            and entry["model"] == key["model"]
+            and entry["model_version"] == key["model_version"]
+            and entry["text_hash"] == key["text_hash"]
+        ):
+            counts[text_id] = dict(entry["counts"])
+            write_cache_entry(
+                f"{cache_dir}{text_id}.json",
+                {"text_id": str(text_id), **key, "counts": entry["counts"]},
+            )
+        else:
+            to_extract[text_id] = key
+
+    # named entity recognition of new and changed documents
+    start_time = time.time()
+    n_chars = 0
+    for counter, (text_id, text_counts, text_chars) in enumerate(
+        extract_entities(
+            processor.data_path,
+            to_extract,
+            get_model,
+            languages,
+            batched,
+            n_process,
+            batch_size,
+            chunk_chars,
+        ),
+        start=1,
+    ):
+        key = to_extract[text_id]
+        counts[text_id] = text_counts
+        write_cache_entry(
+            f"{cache_dir}{text_id}.json",
+            {"text_id": str(text_id), **key, "counts": list(text_counts.items())},
+        )
+
+        n_chars += text_chars
+        elapsed = max(time.time() - start_time, 1e-9)
+        print(
+            f"creating entity count dictionary: {counter}/{len(to_extract)} ({counter / elapsed:,.1f} docs/sec, {n_chars / elapsed:,.0f} characters/sec)"
+        )
+
+    write_entity_counts_csv(processor, counts)
+
+    return counts
+
+
+def extract_entities(
+    data_path,
+    to_extract,
+    get_model,
+    languages,
+    batched,
+    n_process,
+    batch_size,
+    chunk_chars,
+):
+    "(text_id, counts, number of characters through the model) of the documents to extract, one document at a time or batched per model. Texts are read one at a time"
+    if not batched:
+        for text_id, stringx in read_texts(data_path, to_extract):
+            stringx = ner_text(stringx)
+            yield text_id, entity_counts(
+                get_model(to_extract[text_id]["model"], languages.get(text_id)),
+                stringx,
+            ), len(stringx)
+        return
+
+    by_model = {}
+    for text_id, key in to_extract.items():
+        by_model.setdefault(key["model"], []).append(text_id)
+
+    for model_name, model_text_ids in by_model.items():
+        yield from entity_counts_batched(
+            get_model(model_name, languages.get(model_text_ids[0])),
+            read_texts(data_path, model_text_ids),
+            n_process=n_process,
+            batch_size=batch_size,
+            chunk_chars=chunk_chars,
+        )
+
+
+def write_entity_counts_csv(processor, counts):
+    "write entity counts to csv_outputs/entity_counts.csv in nlp_pipeline's format, leaving the file untouched if nothing changed so caches built from it stay valid"
+    csv_path = f"{processor.data_path}csv_outputs/entity_counts.csv"
+    csv = pd.DataFrame(
+        {
+            "text_id": processor.metadata.text_id.values,
+            "entity_count_dict": [
+                str(counts[text_id]) if text_id in counts else ""
+                for text_id in processor.metadata.text_id.values
+            ],
+        }
+    ).to_csv(index=False)
+
+    if os.path.exists(csv_path):
+        with open(csv_path, "r", encoding="UTF-8", newline="") as f:
+            if f.read() == csv:
+                return
+
+    with open(csv_path, "w", encoding="UTF-8", newline="") as f:
+        f.write(csv)
@@ -0,0 +1,129 @@
+import io
+import zipfile
+
+import pandas as pd
+import xlsxwriter
+
+try:
+    import pyarrow
+
+    parquet_available = True
+except ImportError:
+    parquet_available = False
+
+
+# maximum number of rows in an excel sheet, including the header
+excel_max_rows = 1048576
+
+# number of rows read into memory at once while exporting
+export_chunksize = 10000
+
+
+def csv_chunks(csv_path, encoding="latin1", chunksize=export_chunksize):
+    "iterator over a CSV in chunks of rows"
+    return pd.read_csv(csv_path, encoding=encoding, chunksize=chunksize)
+
+
+def sheet_name(name, part=1):
+    "excel-safe sheet name, with a suffix for the continuation sheets of a split sheet"
+    suffix = "" if part == 1 else f"_{part}"
+    return name[: 31 - len(suffix)] + suffix
+
+
+def write_excel_streaming(xlsx_path, sheets):
+    """write an excel workbook one row at a time with xlsxwriter's constant_memory mode. Sheets longer than excel's row limit continue on new sheets named e.g. `all_occurrences_2`
+    parameters:
+        :xlsx_path: str: where to write the workbook
+        :sheets: list[(str, callable)]: sheet names and functions returning an iterator of DataFrame chunks for that sheet
+    """
+    workbook = xlsxwriter.Workbook(
+        xlsx_path,
+        {
+            "constant_memory": True,
+            "nan_inf_to_errors": True,
+            "strings_to_urls": False,
+        },
+    )
+    header_format = workbook.add_format({"bold": True})
+
+    for name, chunks in sheets:
+        part = 1
+        worksheet = None
+        row = 0
+        for chunk in chunks():
+            if worksheet is None:
+                worksheet = workbook.add_worksheet(sheet_name(name, part))
+                worksheet.write_row(0, 0, list(chunk.columns), header_format)
+                row = 1
+            for values in chunk.astype(object).itertuples(index=False):
+                if row == excel_max_rows:
+                    part += 1
+                    worksheet = workbook.add_worksheet(sheet_name(name, part))
+                    worksheet.write_row(0, 0, list(chunk.columns), header_format)
+                    row = 1
+                for col, value in enumerate(values):
+                    if not pd.isna(value):
+                        worksheet.write(row, col, value)
+                row += 1
+
+        # empty CSV, write an empty sheet so the workbook layout stays the same
+        if worksheet is None:
+            workbook.add_worksheet(sheet_name(name))
+
+    workbook.close()
+
+
+def parquet_schema(columns, column_types):
+    """Arrow schema of a sheet from its columns and their known types, so every Parquet part file has the same column types without a pass over the sheet first
+    parameters:
+        :columns: list[str]: columns of the sheet
+        :column_types: dict: Arrow type alias of each numeric column, e.g. `int64`. The other columns are text
+    output:
+        :pyarrow.Schema: the schema
+    """
+    return pyarrow.schema(
+        [
+            pyarrow.field(x, pyarrow.type_for_alias(column_types.get(x, "string")))
+            for x in columns
+        ]
+    )
+
+
+def write_zip_bundle(zip_path, sheets, file_format="csv", column_types=None):
+    """write sheets as files in a zip archive, one chunk of rows at a time. CSV sheets are one file each, Parquet sheets are a directory of part files with one schema, readable with pd.read_parquet
+    parameters:
+        :zip_path: str: where to write the zip file
+        :sheets: list[(str, callable)]: sheet names and functions returning an iterator of DataFrame chunks for that sheet
+        :file_format: str: "csv" or "parquet"
+        :column_types: dict: Arrow type alias of each numeric column of the Parquet files, e.g. `int64`. The other columns are written as text
+    """
+    if file_format == "parquet" and not parquet_available:
+        raise ValueError("pyarrow must be installed to export Parquet files")
+
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for name, chunks in sheets:
+            if file_format == "csv":
+                with zipf.open(f"{name}.csv", "w", force_zip64=True) as f:
+                    with io.TextIOWrapper(f, encoding="utf-8", newline="") as text_f:
+                        header = True
+                        for chunk in chunks():
+                            chunk.to_csv(text_f, index=False, header=header)
+                            header = False
+            else:
+                # chunks are typed on their own when read, so the schema comes from the known column types
+                schema = None
+                for part, chunk in enumerate(chunks()):
+                    if schema is None:
+                        schema = parquet_schema(chunk.columns, column_types or {})
+                        text_columns = [
+                            x.name for x in schema if pyarrow.types.is_string(x.type)
+                        ]
+                    for column in text_columns:
+                        chunk[column] = (
+                            chunk[column]
+                            .astype(object)
+                            .map(lambda x: x if pd.isna(x) else str(x))
+                        )
+                    buffer = io.BytesIO()
+                    chunk.to_parquet(buffer, index=False, schema=schema)
+                    zipf.writestr(f"{name}/part-{part:05d}.parquet", buffer.getvalue())
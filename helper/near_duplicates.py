@@ -0,0 +1,179 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from helper.token_store import doc_tokens, gen_token_store
+
+# number of words in a shingle
+shingle_words = 5
+
+# number of hash functions of a MinHash signature, split into bands of rows for LSH
+n_permutations = 128
+n_bands = 16
+
+# number of documents in an LSH bucket up to which every pair of them is a candidate, larger buckets give linearly many candidates
+max_bucket_size = 50
+
+# number of shingles hashed at once
+shingle_batch_size = 8192
+
+# prime of the universal hash functions, below 2^32 so (a * x + b) never overflows 64 bits
+hash_prime = np.uint64(4294967291)
+
+
+def hash_functions(seed=42):
+    "coefficients a and b of the MinHash hash functions (a * x + b) mod hash_prime"
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(hash_prime), size=n_permutations, dtype=np.uint64)
+    b = rng.integers(0, int(hash_prime), size=n_permutations, dtype=np.uint64)
+    return a, b
+
+
+def shingle_hashes(tokens):
+    "distinct 32-bit hashes of the shingles (runs of shingle_words token ids) of a document, a document shorter than a shingle is one shingle"
+    tokens = np.asarray(tokens, dtype=np.uint64)
+    if len(tokens) == 0:
+        return np.array([], dtype=np.uint64)
+    if len(tokens) < shingle_words:
+        tokens = np.concatenate(
+            [tokens, np.full(shingle_words - len(tokens), 2**32 - 1, dtype=np.uint64)]
+        )
+    windows = np.lib.stride_tricks.sliding_window_view(tokens, shingle_words)
+    multipliers = np.uint64(1000003) ** np.arange(
+        shingle_words, dtype=np.uint64
+    )  # overflow wraps around, which is fine for hashing
+    hashes = (windows * multipliers).sum(axis=1, dtype=np.uint64)
+    return np.unique((hashes ^ (hashes >> np.uint64(32))) & np.uint64(0xFFFFFFFF))
+
+
+def minhash_signature(hashes, a, b):
+    "MinHash signature of a set of shingle hashes, n_permutations minimums"
+    signature = np.full(n_permutations, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(hashes), shingle_batch_size):
+        batch = hashes[start : start + shingle_batch_size, None]
+        signature = np.minimum(signature, ((a * batch + b) % hash_prime).min(axis=0))
+    return signature
+
+
+def gen_minhash_signatures(data_path, text_ids, path_prefix="transformed"):
+    """MinHash signatures of the shingles of the transformed texts, calculated from the corpus's token store and kept in its directory until the texts change
+    parameters:
+        :data_path: str: processor.data_path of the corpus
+        :text_ids: list[int]: text ids of the corpus, one row each
+        :path_prefix: str: prefix of the files in the transformed_txt_files/ directory
+    output:
+        :np.ndarray: number of documents x n_permutations signatures
+        :np.ndarray: whether each document has any text
+    """
+    store = gen_token_store(data_path, text_ids, path_prefix)
+    signature_path = f"{store['path']}minhash_{shingle_words}_{n_permutations}.npz"
+    if os.path.exists(signature_path):
+        with np.load(signature_path) as cached:
+            return cached["signatures"], cached["has_text"]
+
+    a, b = hash_functions()
+    signatures = np.zeros((len(text_ids), n_permutations), dtype=np.uint64)
+    has_text = np.zeros(len(text_ids), dtype=bool)
+    for i in range(len(text_ids)):
+        print(f"hashing documents: {i + 1}/{len(text_ids)}")
+        tokens = doc_tokens(store, i)
+        has_text[i] = store["token_lengths"][tokens].sum() > 0
+        if has_text[i]:
+            signatures[i] = minhash_signature(shingle_hashes(tokens), a, b)
+
+    np.savez(f"{signature_path}.tmp.npz", signatures=signatures, has_text=has_text)
+    os.replace(f"{signature_path}.tmp.npz", signature_path)
+    return signatures, has_text
+
+
+def candidate_pairs(signatures, rows):
+    "pairs of rows whose signatures are identical in at least one LSH band. In buckets of more than max_bucket_size rows, e.g. of boilerplate documents, each row is only paired with the first row of the bucket and the next one, which is enough to put rows that are duplicates of each other in one cluster without comparing every pair"
+    rows_per_band = n_permutations // n_bands
+    pairs = set()
+    for band in range(n_bands):
+        keys = np.ascontiguousarray(
+            signatures[rows, band * rows_per_band : (band + 1) * rows_per_band]
+        ).view(np.dtype((np.void, 8 * rows_per_band)))[:, 0]
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+
+        # only buckets holding more than one document
+        shared = np.flatnonzero(counts[inverse] > 1)
+        order = shared[np.argsort(inverse[shared], kind="stable")]
+        bucket_starts = np.flatnonzero(
+            np.diff(np.concatenate([[-1], inverse[order]])) != 0
+        )
+        for bucket in np.split(order, bucket_starts[1:]):
+            bucket = rows[bucket]
+            if len(bucket) > max_bucket_size:
+                pairs.update((int(bucket[0]), int(y)) for y in bucket[1:])
+                pairs.update((int(x), int(y)) for x, y in zip(bucket[1:], bucket[2:]))
+                continue
+            pairs.update(
+                (int(x), int(y)) for i, x in enumerate(bucket) for y in bucket[i + 1 :]
+            )
+    return pairs
+
+
+def near_duplicate_clusters(signatures, has_text, text_ids, threshold=0.8):
+    """clusters of near-duplicate documents. LSH banding of the MinHash signatures finds candidate pairs without comparing every pair of documents, candidates whose estimated Jaccard similarity is at least threshold are duplicates, and duplicates of duplicates join the same cluster
+    parameters:
+        :signatures: np.ndarray: MinHash signatures from gen_minhash_signatures
+        :has_text: np.ndarray: whether each document has any text
+        :text_ids: list[int]: text id of each row
+        :threshold: float: minimum estimated Jaccard similarity of the shingles of two duplicates
+    output:
+        :pd.DataFrame: with columns `cluster`, `text_id`, `kept` (the first document of each cluster, the others are its duplicates) and `estimated_jaccard` (with the kept document)
+    """
+    parents = list(range(len(text_ids)))
+
+    def find(x):
+        while parents[x] != x:
+            parents[x] = parents[parents[x]]
+            x = parents[x]
+        return x
+
+    for x, y in candidate_pairs(signatures, np.flatnonzero(has_text)):
+        if np.mean(signatures[x] == signatures[y]) >= threshold:
+            x, y = find(x), find(y)
+            parents[max(x, y)] = min(x, y)
+
+    roots = np.array([find(x) for x in range(len(text_ids))])
+    counts = np.bincount(roots, minlength=len(text_ids))
+    members = np.flatnonzero(counts[roots] > 1)
+    members = members[np.lexsort((members, roots[members]))]
+
+    return pd.DataFrame(
+        {
+            "cluster": pd.factorize(roots[members])[0] + 1,
+            "text_id": np.array(text_ids)[members],
+            "kept": members == roots[members],
+            "estimated_jaccard": (
+                signatures[members] == signatures[roots[members]]
+            ).mean(axis=1),
+        }
+    )
+
+
+def excluded_text_ids_path(data_path):
+    "file of the text ids left out of other analyses as near-duplicates"
+    return f"{data_path}excluded_text_ids.csv"
+
+
+def excluded_text_ids(data_path):
+    "text ids left out of other analyses as near-duplicates, empty if duplicates are not excluded"
+    try:
+        return set(pd.read_csv(excluded_text_ids_path(data_path)).text_id)
+    except (FileNotFoundError, ValueError, AttributeError):
+        return set()
+
+
+def set_excluded_text_ids(data_path, clusters_df=None):
+    "leave the duplicates of clusters_df, all but the kept document of each cluster, out of other analyses, or stop leaving any out if clusters_df is None"
+    if clusters_df is None:
+        if os.path.exists(excluded_text_ids_path(data_path)):
+            os.remove(excluded_text_ids_path(data_path))
+        return
+    clusters_df.loc[lambda x: ~x.kept, ["text_id"]].to_csv(
+        excluded_text_ids_path(data_path), index=False
+    )
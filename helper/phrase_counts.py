@@ -0,0 +1,248 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from helper.token_store import doc_tokens
+
+# number of phrases kept in memory while counting, per group
+phrase_capacity = 200000
+
+# number of phrase occurrences counted at once, documents are counted in batches of about this size
+phrase_batch_size = 1000000
+
+
+def phrase_keys(ids):
+    "phrases given as rows of token ids as one fixed-width key each, so they can be counted, sorted and compared as single values"
+    ids = np.ascontiguousarray(ids, dtype=np.int32)
+    return ids.view(np.dtype((np.void, 4 * ids.shape[1]))).ravel()
+
+
+def phrase_strings(keys, vocab, n):
+    "the phrases of keys as text"
+    ids = np.ascontiguousarray(keys).view(np.int32).reshape(-1, n)
+    return [" ".join(vocab[x]) for x in ids]
+
+
+def countable_words(vocab, exclude_words):
+    "whether each vocabulary entry is a word counted in top words, i.e. not a single character, a number or an excluded word. nlp_pipeline writes sentence delimiters as ` | ` tokens, which are single characters, a `|` inside a token (`end|start`, if the text was not spaced that way) also ends a sentence so it is not counted either"
+    return np.fromiter(
+        (
+            (len(x) > 1)
+            and not (x.isnumeric())
+            and not (x in exclude_words)
+            and ("|" not in x)
+            for x in vocab
+        ),
+        dtype=bool,
+        count=len(vocab),
+    )
+
+
+def excluded_phrase_keys(vocab, n, exclude_words):
+    "keys of the excluded phrases of n words, as far as all their words are in the vocabulary"
+    phrases = [x.split(" ") for x in exclude_words if x.count(" ") == n - 1]
+    if (n < 2) or (len(phrases) == 0):
+        return None
+    index = {x: i for i, x in enumerate(vocab)}
+    ids = [
+        [index[x] for x in words] for words in phrases if all(x in index for x in words)
+    ]
+    if len(ids) == 0:
+        return None
+    return np.unique(phrase_keys(np.array(ids, dtype=np.int32)))
+
+
+def doc_phrase_keys(tokens, n, countable, excluded=None):
+    """keys of the n-word phrases of a document's token ids. Phrases do not cross sentence boundaries (`|`) or words that are not counted in top words, and excluded phrases are dropped
+    parameters:
+        :tokens: np.ndarray: token ids of the document
+        :n: int: number of words in a phrase
+        :countable: np.ndarray: countable_words of the vocabulary
+        :excluded: np.ndarray: excluded_phrase_keys, None for none
+    output:
+        :np.ndarray: key of each phrase occurrence
+    """
+    tokens = np.asarray(tokens)
+    if len(tokens) < n:
+        return phrase_keys(np.empty((0, n), dtype=np.int32))
+
+    # a window is a phrase if none of its tokens is a break
+    breaks = np.concatenate([[0], np.cumsum(~countable[tokens])])
+    keys = phrase_keys(sliding_window_view(tokens, n)[(breaks[n:] - breaks[:-n]) == 0])
+    if excluded is not None:
+        keys = keys[~np.isin(keys, excluded)]
+    return keys
+
+
+def iter_phrase_counts(store, rows, n, countable, excluded, message):
+    "(keys, counts) of the distinct phrases of batches of documents of a token store, printing progress"
+    keys, size = [], 0
+    for counter, i in enumerate(rows, start=1):
+        print(f"{message}: {counter}/{len(rows)}")
+        keys.append(doc_phrase_keys(doc_tokens(store, i), n, countable, excluded))
+        size += len(keys[-1])
+        if (size >= phrase_batch_size) or (counter == len(rows)):
+            yield np.unique(np.concatenate(keys), return_counts=True)
+            keys, size = [], 0
+
+
+def merge_counts(keys, counts, batch_keys, batch_counts):
+    "sorted distinct keys and summed counts of two sets of phrase counts"
+    if keys is None:
+        return batch_keys, batch_counts.astype(np.int64)
+    keys, inverse = np.unique(np.concatenate([keys, batch_keys]), return_inverse=True)
+    counts = np.bincount(
+        inverse.ravel(),
+        weights=np.concatenate([counts, batch_counts]),
+        minlength=len(keys),
+    ).astype(np.int64)
+    return keys, counts
+
+
+def frequent_phrases(phrase_counts, capacity):
+    """Misra-Gries summary of streamed phrase counts. Whenever more than 2 x capacity phrases are held, every count is lowered by the (capacity + 1)-th largest and phrases at zero are dropped
+    parameters:
+        :phrase_counts: iterable[(np.ndarray, np.ndarray)]: distinct phrase keys and their counts of each batch of documents
+        :capacity: int: number of phrases kept after pruning
+    output:
+        :np.ndarray: the phrase keys kept, sorted
+        :np.ndarray: their counts, at most `decrement` below the true counts
+        :int: total decrement. No phrase that was dropped occurs more than this many times
+    """
+    keys, counts = None, None
+    decrement = 0
+    for batch_keys, batch_counts in phrase_counts:
+        keys, counts = merge_counts(keys, counts, batch_keys, batch_counts)
+
+        if len(keys) > 2 * capacity:
+            cut = int(np.partition(counts, -(capacity + 1))[-(capacity + 1)])
+            decrement += cut
+            keep = counts > cut
+            keys, counts = keys[keep], counts[keep] - cut
+
+    return keys, counts, decrement
+
+
+def phrase_partitions(keys, n, n_partitions):
+    "hash partition of each phrase key, from 0 to n_partitions - 1. A phrase of partition p of P partitions is in partition p or p + P of 2 x P partitions"
+    ids = np.ascontiguousarray(keys).view(np.int32).reshape(-1, n).astype(np.uint64)
+    multipliers = np.random.default_rng(0).integers(
+        1, 2**63, size=n, dtype=np.uint64
+    ) | np.uint64(1)
+    hashes = (ids * multipliers).sum(axis=1)
+    hashes ^= hashes >> np.uint64(29)
+    return hashes % np.uint64(n_partitions)
+
+
+def partition_counts(phrase_counts, n, n_partitions, partition, capacity):
+    """exact counts of the phrases of one hash partition of streamed phrase counts
+    parameters:
+        :phrase_counts: iterable[(np.ndarray, np.ndarray)]: distinct phrase keys and their counts of each batch of documents
+        :n: int: number of words in a phrase
+        :n_partitions: int: number of partitions
+        :partition: int: which partition to count
+        :capacity: int: the partition is given up on once it has more than 2 x capacity distinct phrases
+    output:
+        :np.ndarray: the phrase keys of the partition, sorted, None if it has too many
+        :np.ndarray: their counts
+    """
+    keys, counts = None, None
+    for batch_keys, batch_counts in phrase_counts:
+        keep = phrase_partitions(batch_keys, n, n_partitions) == partition
+        keys, counts = merge_counts(keys, counts, batch_keys[keep], batch_counts[keep])
+        if len(keys) > 2 * capacity:
+            return None, None
+    return keys, counts
+
+
+def top_phrases(store, rows, n, n_phrases, exclude_words=None, group_name="all"):
+    """exact top phrases of a set of transformed texts in bounded memory, counted on token ids and only the top phrases turned back into text. A first pass keeps a Misra-Gries summary of at most phrase_capacity phrases, a second pass counts the phrases of the summary exactly. If a phrase the summary dropped could still make the top n, every phrase is counted exactly one hash partition at a time, partitions with too many phrases for memory being split in two, and only phrases at least as frequent as the n-th count found so far are kept
+    parameters:
+        :store: dict: token store of the transformed texts from gen_token_store
+        :rows: list[int]: rows of the documents in the token store
+        :n: int: number of words in a phrase
+        :n_phrases: int: how many phrases to return
+        :exclude_words: list[str]: words and phrases to leave out
+        :group_name: str: name of the group in the progress messages
+    output:
+        :list[(str, int)]: phrases and their counts, by descending count and then alphabetically
+    """
+    exclude_words = {x for x in (exclude_words or []) if isinstance(x, str)}
+    countable = countable_words(store["vocab"], exclude_words)
+    excluded = excluded_phrase_keys(store["vocab"], n, exclude_words)
+    capacity = max(phrase_capacity, 4 * n_phrases)
+
+    def rank(keys, counts):
+        # only phrases that can make the top n are turned into text, ties are broken alphabetically
+        if len(counts) > n_phrases:
+            threshold = np.partition(counts, -n_phrases)[-n_phrases]
+            candidates = np.flatnonzero(counts >= threshold)
+        else:
+            candidates = np.arange(len(counts))
+        return sorted(
+            zip(
+                phrase_strings(keys[candidates], store["vocab"], n),
+                counts[candidates].tolist(),
+            ),
+            key=lambda x: (-x[1], x[0]),
+        )[:n_phrases]
+
+    def phrase_counts(message):
+        return iter_phrase_counts(store, rows, n, countable, excluded, message)
+
+    if len(rows) == 0:
+        return []
+
+    keys, counts, decrement = frequent_phrases(
+        phrase_counts(f"counting phrases for group {group_name}"), capacity
+    )
+
+    # nothing was ever dropped, the counts are exact
+    if decrement == 0:
+        return rank(keys, counts)
+
+    exact = np.zeros(len(keys), dtype=np.int64)
+    for batch_keys, batch_counts in phrase_counts(
+        f"verifying phrases for group {group_name}"
+    ):
+        positions = np.minimum(np.searchsorted(keys, batch_keys), len(keys) - 1)
+        found = keys[positions] == batch_keys
+        exact[positions[found]] += batch_counts[found]
+
+    # every phrase occurring more than `decrement` times is in the summary
+    top = rank(keys, exact)
+    if (len(top) == n_phrases) and (top[-1][1] > decrement):
+        return top
+
+    # the verified phrases give a lower bound of the n-th count, rarer phrases can't make the top n
+    threshold = top[-1][1] if len(top) == n_phrases else 1
+    top_keys, top_counts = keys[:0], exact[:0]
+    partitions = [(2, 1), (2, 0)]
+    while len(partitions) > 0:
+        n_partitions, partition = partitions.pop()
+        part_keys, part_counts = partition_counts(
+            phrase_counts(
+                f"counting phrases for group {group_name}, part {partition + 1} of {n_partitions}"
+            ),
+            n,
+            n_partitions,
+            partition,
+            capacity,
+        )
+        if part_keys is None:
+            partitions += [
+                (2 * n_partitions, partition + n_partitions),
+                (2 * n_partitions, partition),
+            ]
+            continue
+
+        keep = part_counts >= threshold
+        top_keys = np.concatenate([top_keys, part_keys[keep]])
+        top_counts = np.concatenate([top_counts, part_counts[keep]])
+        if len(top_counts) > n_phrases:
+            threshold = max(
+                threshold, int(np.partition(top_counts, -n_phrases)[-n_phrases])
+            )
+            keep = top_counts >= threshold
+            top_keys, top_counts = top_keys[keep], top_counts[keep]
+
+    return rank(top_keys, top_counts)
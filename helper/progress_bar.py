@@ -6,8 +6,10 @@ def parse_message(text):
     "parse the progress text into progress bar value and text"
     try:
         # search terms dict
-        if ("processing search terms for group" in text) or (
-            "co-occurence search for group" in text
+        if (
+            ("processing search terms for group" in text)
+            or ("co-occurence search for group" in text)
+            or ("second-level search for group" in text)
         ):
             process_dict = {
                 "processing search terms for group ": {
@@ -26,6 +28,33 @@ def parse_message(text):
                     "out_text": "(3/3) finding second-level search terms for group ",
                 },
             }
+        # shared tokenization of the corpus
+        elif "tokenizing documents" in text:
+            process_dict = {
+                "tokenizing documents:": {
+                    "overall_step": 1,
+                    "proportion": 0.0,
+                    "out_text": "tokenizing documents ",
+                },
+            }
+        # near-duplicate signatures
+        elif "hashing documents" in text:
+            process_dict = {
+                "hashing documents:": {
+                    "overall_step": 1,
+                    "proportion": 0.0,
+                    "out_text": "hashing documents ",
+                },
+            }
+        # topic models
+        elif "fitting topics" in text:
+            process_dict = {
+                "fitting topics:": {
+                    "overall_step": 1,
+                    "proportion": 0.0,
+                    "out_text": "fitting topics ",
+                },
+            }
         # top words
         elif "creating word count dictionary" in text:
             process_dict = {
@@ -35,6 +64,22 @@ def parse_message(text):
                     "out_text": "calculating top words ",
                 },
             }
+        # top phrases
+        elif ("counting phrases for group" in text) or (
+            "verifying phrases for group" in text
+        ):
+            process_dict = {
+                "counting phrases for group ": {
+                    "overall_step": 1,
+                    "proportion": 0.0,
+                    "out_text": "(1/2) counting phrases for group ",
+                },
+                "verifying phrases for group ": {
+                    "overall_step": 2,
+                    "proportion": 0.5,
+                    "out_text": "(2/2) verifying phrase counts for group ",
+                },
+            }
         # top entities
         elif "creating entity count dictionary" in text:
             process_dict = {
@@ -101,8 +146,8 @@ def parse_message(text):
             next_step_proportion - process_dict[which_key]["proportion"], 2
         )  # overall progress available for this step
 
-        numerator = int(re.findall(r"\d+", text.split(which_key)[1].split("/")[0])[0])
-        denominator = int(text.split(which_key)[1].split("/")[1])
+        numerator = int(re.findall(r"\d+", text.split(which_key)[1].split("/")[0])[-1])
+        denominator = int(re.findall(r"\d+", text.split(which_key)[1].split("/")[1])[0])
         addt_progress = numerator / denominator * overall_progress
 
         final_progress = int((base_progress + addt_progress) * 100)
@@ -0,0 +1,360 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import mmap
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+
+def open_text(file_path):
+    "memory-map a text file. Byte offsets into the map are the same as character offsets of the file read with latin1 encoding"
+    if os.path.getsize(file_path) == 0:
+        return b""
+    with open(file_path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def close_text(text):
+    "close a text opened with open_text"
+    if isinstance(text, mmap.mmap):
+        text.close()
+
+
+def transformed_path(data_path, text_id, path_prefix="transformed"):
+    "path of a transformed text file"
+    return f"{data_path}transformed_txt_files/{path_prefix}_{text_id}.txt"
+
+
+def read_occurrence_offsets(data_path, group_name="all"):
+    "read the offsets table of a group written by gen_search_terms_sharded, None if it doesn't exist"
+    csv_path = (
+        f"{data_path}csv_outputs/search_terms_{group_name}_occurrence_offsets.csv"
+    )
+    if not os.path.exists(csv_path):
+        return None
+    return pd.read_csv(
+        csv_path, dtype={"term_id": np.int32, "start": np.int64, "end": np.int64}
+    )
+
+
+def slice_contexts(data_path, offsets, character_buffer, path_prefix="transformed"):
+    "slice the character buffer context of every occurrence in offsets from the memory-mapped transformed texts"
+    contexts = np.empty(len(offsets), dtype=object)
+    starts = offsets["start"].values
+    for text_id, idx in offsets.groupby("text_id", sort=False).indices.items():
+        text = open_text(transformed_path(data_path, text_id, path_prefix))
+        try:
+            n = len(text)
+            for i in idx:
+                contexts[i] = text[
+                    max(0, starts[i] - character_buffer) : min(
+                        n, starts[i] + character_buffer
+                    )
+                ].decode("latin1")
+        finally:
+            close_text(text)
+
+    return contexts
+
+
+def compact_occurrences(data_path, search_terms_df, group_name="all"):
+    "drop the stored character_buffer_context column from search_terms_{group_name}_occurrences.csv once the offsets are available to regenerate it. search_terms_df is the search_terms sheet the offsets were generated from"
+    csv_path = f"{data_path}csv_outputs/search_terms_{group_name}_occurrences.csv"
+    offsets = read_occurrence_offsets(data_path, group_name)
+    if offsets is None or not os.path.exists(csv_path):
+        return
+
+    df = pd.read_csv(csv_path)
+    if "character_buffer_context" not in df.columns:
+        return
+    # only drop the contexts if the two tables line up, in document and in search term
+    if (
+        len(df) != len(offsets)
+        or not (df["text_id"].values == offsets["text_id"].values).all()
+        or not (
+            df[search_terms_df.columns[-1]].astype(str).values
+            == search_terms_df.iloc[offsets["term_id"].values, -1].astype(str).values
+        ).all()
+    ):
+        return
+
+    df.drop(["character_buffer_context"], axis=1).to_csv(csv_path, index=False)
+
+
+def load_occurrences(
+    data_path,
+    character_buffer,
+    path_prefix="transformed",
+    encoding="latin1",
+    group_name="all",
+):
+    "read search_terms_{group_name}_occurrences.csv with the character_buffer_context column sliced for any buffer size"
+    df = pd.read_csv(
+        f"{data_path}csv_outputs/search_terms_{group_name}_occurrences.csv",
+        encoding=encoding,
+    )
+    offsets = read_occurrence_offsets(data_path, group_name)
+    if offsets is None or len(offsets) != len(df):
+        return df
+
+    return insert_contexts(
+        df, slice_contexts(data_path, offsets, character_buffer, path_prefix)
+    )
+
+
+def insert_contexts(df, contexts):
+    "put a character_buffer_context column into an occurrences dataframe after sentence_context"
+    df = df.drop(["character_buffer_context"], axis=1, errors="ignore")
+    df.insert(
+        (
+            list(df.columns).index("sentence_context") + 1
+            if "sentence_context" in df.columns
+            else len(df.columns)
+        ),
+        "character_buffer_context",
+        contexts,
+    )
+
+    return df
+
+
+def iter_occurrences(
+    data_path,
+    character_buffer,
+    chunksize,
+    path_prefix="transformed",
+    encoding="latin1",
+    group_name="all",
+):
+    "iterate over search_terms_{group_name}_occurrences.csv in chunks of rows, with the character_buffer_context column sliced for any buffer size"
+    chunks = pd.read_csv(
+        f"{data_path}csv_outputs/search_terms_{group_name}_occurrences.csv",
+        encoding=encoding,
+        chunksize=chunksize,
+    )
+    offsets_path = (
+        f"{data_path}csv_outputs/search_terms_{group_name}_occurrence_offsets.csv"
+    )
+    offset_chunks = None
+    for chunk in chunks:
+        # contexts were only dropped from the CSV if the offsets line up with it
+        if offset_chunks is None and "character_buffer_context" not in chunk.columns:
+            offset_chunks = pd.read_csv(
+                offsets_path,
+                dtype={"term_id": np.int32, "start": np.int64, "end": np.int64},
+                chunksize=chunksize,
+            )
+        if offset_chunks is None:
+            yield chunk
+        else:
+            offsets = next(offset_chunks).reset_index(drop=True)
+            yield insert_contexts(
+                chunk,
+                slice_contexts(data_path, offsets, character_buffer, path_prefix),
+            )
+
+
+def parse_near(term):
+    "split an optional `NEAR/k ` prefix off a second-level term. Returns (k, term), k is None without the prefix"
+    match = re.match(r"^NEAR/(\d+)\s+(.+)$", str(term).strip())
+    if match is None:
+        return None, str(term)
+    return int(match.group(1)), match.group(2)
+
+
+def regex_pattern(term):
+    "compiled byte pattern of a term used as a regular expression, as in nlp_pipeline's gen_second_level_search_terms"
+    try:
+        return re.compile(str(term).encode("latin1"))
+    except UnicodeEncodeError:
+        return None
+
+
+def alternates_pattern(term):
+    "compiled byte pattern matching any of the `|` separated alternates of a term as a whole word"
+    try:
+        return re.compile(
+            b"|".join(
+                re.escape((" " + x + " ").encode("latin1"))
+                for x in str(term).split("|")
+            )
+        )
+    except UnicodeEncodeError:
+        return None
+
+
+def match_positions(text, pattern):
+    "sorted start and end offsets of the non-overlapping matches of a pattern in a text"
+    positions = [m.span() for m in pattern.finditer(text)]
+    if len(positions) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    positions = np.array(positions, dtype=np.int64)
+    return positions[:, 0], positions[:, 1]
+
+
+def occurrence_windows(text, starts, ends, character_buffer, near_tokens=None):
+    "[lo, hi) windows around occurrences. Either the character_buffer_context, +/- character_buffer characters from the start of the match, or +/- near_tokens space-separated tokens around the matched term with the spaces around them"
+    n = len(text)
+    if near_tokens is None:
+        return np.maximum(starts - character_buffer, 0), np.minimum(
+            starts + character_buffer, n
+        )
+
+    spaces = np.flatnonzero(np.frombuffer(text, dtype=np.uint8) == 32)
+    # token t runs from bounds[t] + 1 to bounds[t + 1]
+    bounds = np.concatenate(([-1], spaces, [n]))
+    # first-level matches are " term ", so the term's tokens sit inside the surrounding spaces
+    first_token = np.searchsorted(spaces, starts + 1, side="right")
+    last_token = np.searchsorted(spaces, np.maximum(ends - 2, starts + 1), side="right")
+    lo_token = np.maximum(first_token - near_tokens, 0)
+    hi_token = np.minimum(last_token + near_tokens, len(spaces))
+
+    # the window includes the spaces around its first and last token, so a `" term "` match in either of them counts
+    return np.maximum(bounds[lo_token], 0), np.minimum(bounds[hi_token + 1] + 1, n)
+
+
+def count_in_windows(match_starts, match_ends, lo, hi):
+    "number of matches lying completely inside each [lo, hi) window. Matches are non-overlapping, so both offset arrays are sorted"
+    return np.maximum(
+        np.searchsorted(match_ends, hi, side="right")
+        - np.searchsorted(match_starts, lo, side="left"),
+        0,
+    )
+
+
+def window_counts(
+    data_path,
+    offsets,
+    pattern,
+    character_buffer,
+    near_tokens=None,
+    path_prefix="transformed",
+):
+    "count the matches of a pattern inside the window of every occurrence in offsets. Only documents with at least one occurrence are read"
+    counts = np.zeros(len(offsets), dtype=np.int64)
+    if pattern is None or len(offsets) == 0:
+        return counts
+
+    starts = offsets["start"].values
+    ends = offsets["end"].values
+    for text_id, idx in offsets.groupby("text_id", sort=False).indices.items():
+        text = open_text(transformed_path(data_path, text_id, path_prefix))
+        try:
+            match_starts, match_ends = match_positions(text, pattern)
+            if len(match_starts) > 0:
+                lo, hi = occurrence_windows(
+                    text, starts[idx], ends[idx], character_buffer, near_tokens
+                )
+                counts[idx] = count_in_windows(match_starts, match_ends, lo, hi)
+        finally:
+            close_text(text)
+
+    return counts
+
+
+def gen_second_level_counts(
+    data_path,
+    group_name,
+    search_terms_df,
+    second_level_search_terms_df,
+    character_buffer,
+    path_prefix="transformed",
+):
+    """count second-level search terms within the context of first-level occurrences by joining their positions in the texts, rather than scanning the stored contexts. Writes the same csv_outputs/search_terms_{group_name}_second_level_counts.csv as nlp_pipeline's gen_second_level_search_terms. Prefix a second-level term with `NEAR/k ` to count it within k tokens of the first-level term instead of within the character buffer
+    parameters:
+        :data_path: str: processor.data_path of the corpus
+        :group_name: str: group name used in the output file name
+        :search_terms_df: pd.DataFrame: the search_terms sheet the offsets were generated from
+        :second_level_search_terms_df: pd.DataFrame: the second_level_search_terms sheet
+        :character_buffer: int: number of characters on either side of the first-level occurrence
+        :path_prefix: str: prefix of the files in the transformed_txt_files/ directory
+    output:
+        :pd.DataFrame: the second-level counts
+    """
+    offsets = read_occurrence_offsets(data_path, group_name)
+    second_level_search_terms_df = second_level_search_terms_df.replace(
+        "", np.nan
+    ).reset_index(drop=True)
+
+    counts = []
+    for i in range(len(second_level_search_terms_df)):
+        print(
+            f"second-level search for group {group_name}: {i+1}/{len(second_level_search_terms_df)}"
+        )
+        near_tokens, search_term = parse_near(second_level_search_terms_df.iloc[i, -1])
+        most_specific_col = second_level_search_terms_df.iloc[i, :-1].last_valid_index()
+        most_specific_term = second_level_search_terms_df.loc[i, most_specific_col]
+
+        term_ids = np.flatnonzero(
+            (search_terms_df[most_specific_col] == most_specific_term).values
+        )
+        selected = offsets.loc[lambda x: x.term_id.isin(term_ids), :]
+        counts.append(
+            int(
+                window_counts(
+                    data_path,
+                    selected,
+                    regex_pattern(search_term),
+                    character_buffer,
+                    near_tokens,
+                    path_prefix,
+                ).sum()
+            )
+        )
+
+    second_level_occurrences = second_level_search_terms_df.copy()
+    second_level_occurrences["count"] = counts
+    second_level_occurrences.to_csv(
+        f"{data_path}csv_outputs/search_terms_{group_name}_second_level_counts.csv",
+        index=False,
+    )
+
+    return second_level_occurrences
+
+
+def count_matches(file_path, patterns):
+    "number of non-overlapping matches in a memory-mapped text, summed over each list of patterns in patterns"
+    text = open_text(file_path)
+    try:
+        return [
+            sum(
+                sum(1 for _ in pattern.finditer(text))
+                for pattern in term_patterns
+                if pattern is not None
+            )
+            for term_patterns in patterns
+        ]
+    finally:
+        close_text(text)
+
+
+def iter_term_counts(data_path, terms, path_prefix="transformed", max_workers=None):
+    """count whole-word occurrences of several terms in every transformed text with a thread pool, yielding results as each document finishes
+    parameters:
+        :data_path: str: processor.data_path of the corpus
+        :terms: list[str]: terms to count. Separate alternates within a term with `|`, e.g. `shipping|trade`
+        :path_prefix: str: prefix of the files in the transformed_txt_files/ directory
+        :max_workers: int: number of threads, defaults to the ThreadPoolExecutor default
+    output:
+        :generator of (int, list[int]): text id and the count of each term in that document
+    """
+    # alternates are counted separately, so adjacent alternates sharing a space are all found
+    patterns = [[alternates_pattern(x) for x in term.split("|")] for term in terms]
+    file_names = [
+        x
+        for x in os.listdir(f"{data_path}transformed_txt_files/")
+        if x.startswith(f"{path_prefix}_") and ".txt" in x
+    ]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                count_matches,
+                f"{data_path}transformed_txt_files/{file_name}",
+                patterns,
+            ): int(file_name.split("_")[1].split(".")[0])
+            for file_name in file_names
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
@@ -1,12 +1,144 @@
 from nlp_pipeline.nlp_pipeline import nlp_processor
+import numpy as np
 import os
 import pandas as pd
 import plotly.express as px
 import streamlit as st
 import sys
+import time
 
 from helper.text_transformation import initialize_processor
+from helper.export import (
+    csv_chunks,
+    export_chunksize,
+    parquet_available,
+    write_excel_streaming,
+    write_zip_bundle,
+)
+from helper.near_duplicates import excluded_text_ids
 from helper.progress_bar import Logger
+from helper.sharded_search import gen_search_terms_sharded
+from helper.search_index import (
+    alternates_pattern,
+    compact_occurrences,
+    gen_second_level_counts,
+    iter_occurrences,
+    iter_term_counts,
+    load_occurrences,
+    parse_near,
+    read_occurrence_offsets,
+    window_counts,
+)
+
+
+# search output file for each download format
+search_output_files = {
+    "Excel workbook": "search_terms_output.xlsx",
+    "Zipped CSV files": "search_terms_output_csv.zip",
+}
+if parquet_available:
+    search_output_files["Zipped Parquet files"] = "search_terms_output_parquet.zip"
+
+# Arrow types of the numeric columns of the search output, every other column is text
+search_output_types = {
+    "text_id": "int64",
+    "count": "int64",
+    "count_per_1000_words": "float64",
+    "number_of_texts_present": "int64",
+    "share_of_texts_present": "float64",
+    "sentence_sentiment": "float64",
+    "character_buffer_sentiment": "float64",
+}
+
+
+def remove_search_outputs():
+    "delete the downloadable search outputs so they are recreated"
+    for output_file in [
+        "search_terms_output.xlsx",
+        "search_terms_output_csv.zip",
+        "search_terms_output_parquet.zip",
+    ]:
+        if os.path.exists(
+            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{output_file}"
+        ):
+            os.remove(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{output_file}"
+            )
+
+
+def search_buffer():
+    "character buffer the last search was run with, the current buffer input if it wasn't recorded"
+    try:
+        with open(
+            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_all_character_buffer.txt",
+            "r",
+        ) as f:
+            return int(f.read())
+    except:
+        return st.session_state["character_buffer"]
+
+
+def search_output_sheets(data_path, search_columns, character_buffer):
+    "sheet names and chunk iterators of the search output, read from the search CSVs one chunk at a time"
+    sheets = []
+
+    # all occurrences, contexts sliced for the character buffer of the search
+    sheets.append(
+        (
+            "all_occurrences",
+            lambda: iter_occurrences(data_path, character_buffer, export_chunksize),
+        )
+    )
+
+    # groupings
+    for col in search_columns:
+        sheets.append(
+            (
+                f"all_counts_by_{col}",
+                lambda col=col: csv_chunks(
+                    f"{data_path}csv_outputs/search_terms_all_counts_by_{col}.csv"
+                ),
+            )
+        )
+
+    # co-occurrences
+    sheets.append(
+        (
+            "co_occurrences",
+            lambda: csv_chunks(
+                f"{data_path}csv_outputs/search_terms_all_co_occurrences.csv"
+            ),
+        )
+    )
+
+    # second-level search terms
+    if os.path.exists(
+        f"{data_path}csv_outputs/search_terms_all_second_level_counts.csv"
+    ):
+        sheets.append(
+            (
+                "second_level_search",
+                lambda: csv_chunks(
+                    f"{data_path}csv_outputs/search_terms_all_second_level_counts.csv"
+                ),
+            )
+        )
+
+    # grouped by text id for everything on a per document level
+    for col in search_columns:
+        sheets.append(
+            (
+                f"text_id_by_{col}",
+                lambda col=col: (
+                    chunk.rename({"group": "text_id"}, axis=1)
+                    for chunk in csv_chunks(
+                        f"{data_path}csv_outputs/search_terms_grouped_by_{col}.csv"
+                    )
+                ),
+            )
+        )
+
+    return sheets
 
 
 def search_terms_inputs():
@@ -16,7 +148,7 @@ def search_terms_inputs():
         """
 Use this section to search for terms within the corpus. For the `Execute search` button to work properly, the `Replace periods` and `Remove punctuation` options must have been selected and run on the `Text transformation` tab. Download a template of the file to upload using the button below. The file has two tabs:
 - `search_terms`: Search terms to look for. The sheet can have multiple columns ending in the most specific terms to search for. E.g., columns of `grouping`>`concept`>`permutation`. Only the term in the right-most column, `permutation`, will be searched for. The other columns are for groupings and aggregations.
-- `second_level_search_terms: Searches for words within the context of the terms in the `search_terms` sheet. The sheet should have the same structure as the search terms sheet. E.g., if `grouping`>`concept`>`permutation` was used there, this CSV should have `grouping`>`concept`>`permutation`>`second_level_term`. Then it will find the counts of `second_level_term` within the context of the `permutation` term.
+- `second_level_search_terms: Searches for words within the context of the terms in the `search_terms` sheet. The sheet should have the same structure as the search terms sheet. E.g., if `grouping`>`concept`>`permutation` was used there, this CSV should have `grouping`>`concept`>`permutation`>`second_level_term`. Then it will find the counts of `second_level_term` within the context of the `permutation` term. Prefix the term with `NEAR/k `, e.g. `NEAR/5 tariff`, to count it only within `k` words of the `permutation` term.
 """
     )
 
@@ -171,7 +303,7 @@ Use this section to search for terms within the corpus. For the `Execute search`
         "Length of character buffer",
         min_value=3,
         value=100,
-        help="The search will return the context of the found terms as well. This parameter is the number of characters on either side of the term occurrence. A bigger number returns a larger context.",
+        help="The search will return the context of the found terms as well. This parameter is the number of characters on either side of the term occurrence. A bigger number returns a larger context. The buffer also sets the window of the sentiment of the contexts, the co-occurring words and the second-level counts, so the search has to be executed again for a change to this value to apply to the downloads.",
     )
 
     st.session_state["co_occurring_n_words"] = st.number_input(
@@ -181,6 +313,12 @@ Use this section to search for terms within the corpus. For the `Execute search`
         help="The search will also return the top n words that occur alongside each of the search terms.",
     )
 
+    st.session_state["parallel_search"] = st.checkbox(
+        "Parallel search",
+        value=False,
+        help="Split the documents into shards and search them in several processes at once. The results are the same as the regular search, but large corpora are searched much faster on servers with several CPU cores.",
+    )
+
     # run search terms button
     if os.path.exists(
         f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/search_terms.xlsx"
@@ -201,10 +339,16 @@ Use this section to search for terms within the corpus. For the `Execute search`
                     with st.spinner("Loading corpus..."):
                         processor = initialize_processor()
 
-                    # search terms
-                    processor.gen_search_terms(
+                    # search terms, overall and per document, with the positions of the occurrences to slice contexts for any buffer later
+                    excluded = excluded_text_ids(processor.data_path)
+                    gen_search_terms_sharded(
+                        processor,
                         group_name="all",
-                        text_ids=list(processor.metadata.text_id.values),
+                        text_ids=[
+                            x
+                            for x in processor.metadata.text_id.values
+                            if x not in excluded
+                        ],
                         search_terms_df=pd.read_excel(
                             f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/search_terms.xlsx",
                             sheet_name="search_terms",
@@ -212,18 +356,8 @@ Use this section to search for terms within the corpus. For the `Execute search`
                         path_prefix="transformed",
                         character_buffer=st.session_state["character_buffer"],
                         match_exclusion=st.session_state["exclude_occurrences"],
-                    )
-
-                    # search terms per document (for count per 1000, etc.)
-                    processor.gen_aggregated_search_terms(
-                        group_names=list(processor.metadata.text_id.values),
-                        text_ids=[[x] for x in list(processor.metadata.text_id.values)],
-                        search_terms_df=pd.read_excel(
-                            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/search_terms.xlsx",
-                            sheet_name="search_terms",
-                        ),
-                        path_prefix="transformed",
-                        character_buffer=st.session_state["character_buffer"],
+                        aggregate_by_text_id=True,
+                        parallel=st.session_state["parallel_search"],
                     )
 
                     # co-occurring terms
@@ -246,21 +380,39 @@ Use this section to search for terms within the corpus. For the `Execute search`
                         )
                         > 0
                     ):
-                        processor.gen_second_level_search_terms(
+                        gen_second_level_counts(
+                            data_path=processor.data_path,
                             group_name="all",
+                            search_terms_df=pd.read_excel(
+                                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/search_terms.xlsx",
+                                sheet_name="search_terms",
+                            ),
                             second_level_search_terms_df=pd.read_excel(
                                 f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/search_terms.xlsx",
                                 sheet_name="second_level_search_terms",
                             ),
+                            character_buffer=st.session_state["character_buffer"],
+                            path_prefix="transformed",
                         )
 
-                    # delete existing excel of outputs
-                    if os.path.exists(
-                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_output.xlsx"
-                    ):
-                        os.remove(
-                            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_output.xlsx"
-                        )
+                    # contexts are regenerated from the offsets from here on
+                    compact_occurrences(
+                        processor.data_path,
+                        pd.read_excel(
+                            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/search_terms.xlsx",
+                            sheet_name="search_terms",
+                        ),
+                    )
+
+                    # buffer the outputs are built with until the next search
+                    with open(
+                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_all_character_buffer.txt",
+                        "w",
+                    ) as f:
+                        f.write(str(st.session_state["character_buffer"]))
+
+                    # delete existing outputs
+                    remove_search_outputs()
 
                 st.info("Corpus searched successfully!")
             else:  # except:
@@ -281,81 +433,67 @@ Use this section to search for terms within the corpus. For the `Execute search`
                 "The search has previously been run. Click the `Execute search` button above to overwrite that output with a new search."
             )
 
-            # create excel version
-            if not (
-                os.path.exists(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_output.xlsx"
-                )
-            ):
-                dfs = {}
+            st.session_state["search_output_format"] = st.selectbox(
+                "Search output format",
+                options=list(search_output_files.keys()),
+                index=0,
+                help="Format of the downloadable search output. Excel sheets longer than Excel's row limit are continued on extra sheets, e.g. `all_occurrences_2`. For very large searches, the zipped CSV or Parquet files contain the same tables without that limit.",
+            )
+            output_file = search_output_files[st.session_state["search_output_format"]]
 
-                # all occurrences
-                dfs["all_occurrences"] = pd.read_csv(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_all_occurrences.csv",
-                    encoding="latin1",
+            if search_buffer() != st.session_state["character_buffer"]:
+                st.warning(
+                    f"The search output uses the character buffer of {search_buffer()} that the search was run with. Click the `Execute search` button above to apply the new buffer."
                 )
 
-                # groupings
-                for col in pd.read_excel(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/search_terms.xlsx",
-                    sheet_name="search_terms",
-                ).columns:
-                    dfs[f"all_counts_by_{col}"] = pd.read_csv(
-                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_all_counts_by_{col}.csv",
-                        encoding="latin1",
-                    )
-
-                # co-occurrences
-                dfs["co_occurrences"] = pd.read_csv(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_all_co_occurrences.csv",
-                    encoding="latin1",
+            # create the output
+            if not (
+                os.path.exists(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{output_file}"
                 )
-
-                # second-level search terms
-                if os.path.exists(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_all_second_level_counts.csv"
-                ):
-                    dfs["second_level_search"] = pd.read_csv(
-                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_all_second_level_counts.csv",
-                        encoding="latin1",
+            ):
+                with st.spinner("Preparing search output..."):
+                    sheets = search_output_sheets(
+                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/",
+                        list(
+                            pd.read_excel(
+                                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/search_terms.xlsx",
+                                sheet_name="search_terms",
+                            ).columns
+                        ),
+                        search_buffer(),
                     )
-
-                # grouped by text id for everything on a per document level
-                for col in pd.read_excel(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/search_terms.xlsx",
-                    sheet_name="search_terms",
-                ).columns:
-                    dfs[f"text_id_by_{col}"] = pd.read_csv(
-                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_grouped_by_{col}.csv",
-                        encoding="latin1",
-                    ).rename({"group": "text_id"}, axis=1)
-
-                # create excel
-                with pd.ExcelWriter(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_output.xlsx",
-                    engine="xlsxwriter",
-                ) as writer:
-                    for key in dfs.keys():
-                        dfs[key].to_excel(writer, sheet_name=key, index=False)
+                    if output_file.endswith(".xlsx"):
+                        write_excel_streaming(
+                            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{output_file}",
+                            sheets,
+                        )
+                    else:
+                        write_zip_bundle(
+                            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{output_file}",
+                            sheets,
+                            file_format=(
+                                "parquet" if "parquet" in output_file else "csv"
+                            ),
+                            column_types=search_output_types,
+                        )
 
             # download the file
             with open(
-                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_output.xlsx",
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{output_file}",
                 "rb",
             ) as template_file:
-                template_byte = template_file.read()
-
-            st.download_button(
-                "Download search terms output",
-                template_byte,
-                "search_terms_output.xlsx",
-                "application/octet-stream",
-                help="Download search output.",
-            )
+                st.download_button(
+                    "Download search terms output",
+                    template_file,
+                    output_file,
+                    "application/octet-stream",
+                    help="Download search output.",
+                )
 
     # excel sheet with occurrences and new search terms binary found
     st.markdown(
-        "## Second-level search binary occurrence and grouping \nGenerate an excel file that shows occurrences by metadata group. It shows occurrences of second-level search terms within the context of other search terms and tells what percentage of a metadata group a term is found in. So if the term is mentioned multiple times in a document, it will only count as a binary 'yes' in the `grouped` tab of the excel output. You can search for 'ors' in the second-level search term CSV as well, separate terms with a `|`. So `shipping|trade` will mark the document as containing the term if either of those terms apperas. Uses the `second_level_search_terms` sheet as an input. "
+        "## Second-level search binary occurrence and grouping \nGenerate an excel file that shows occurrences by metadata group. It shows occurrences of second-level search terms within the context of other search terms and tells what percentage of a metadata group a term is found in. So if the term is mentioned multiple times in a document, it will only count as a binary 'yes' in the `grouped` tab of the excel output. You can search for 'ors' in the second-level search term CSV as well, separate terms with a `|`. So `shipping|trade` will mark the document as containing the term if either of those terms apperas. Prefix a term with `NEAR/k `, e.g. `NEAR/5 shipping|trade`, to only count it if it appears within `k` words of the search term instead of anywhere in the character buffer. Uses the `second_level_search_terms` sheet as an input. "
     )
 
     if (
@@ -414,9 +552,18 @@ Use this section to search for terms within the corpus. For the `Execute search`
                     f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/search_terms.xlsx",
                     sheet_name="second_level_search_terms",
                 )
-                df = pd.read_csv(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/search_terms_all_occurrences.csv"
+                # contexts and windows use the buffer the search was run with, like the second-level counts
+                character_buffer = search_buffer()
+                df = load_occurrences(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/",
+                    character_buffer=character_buffer,
+                    encoding="utf-8",
+                )
+                offsets = read_occurrence_offsets(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/"
                 )
+                # searches by position if the occurrences were stored with their offsets
+                positional = offsets is not None and len(offsets) == len(df)
                 context_dict = {}
                 for value in df[st.session_state["excel_tab_column"]].unique():
                     short_val = value.lower().replace(" ", "_")[
@@ -451,17 +598,37 @@ Use this section to search for terms within the corpus. For the `Execute search`
                         .values
                     )
                     for term in second_search_i:
-                        context_dict[short_val][term] = 0
-                        for i in range(len(context_dict[short_val])):
+                        if positional:
+                            near_tokens, alternates = parse_near(term)
+                            context_dict[short_val][term] = (
+                                window_counts(
+                                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/",
+                                    offsets.loc[
+                                        (
+                                            df[st.session_state["excel_tab_column"]]
+                                            == value
+                                        ).values,
+                                        :,
+                                    ],
+                                    alternates_pattern(alternates),
+                                    character_buffer,
+                                    near_tokens,
+                                )
+                                > 0
+                            ).astype(int)
+                        else:
                             search_terms = [" " + x + " " for x in term.split("|")]
-                            if any(
-                                substring
-                                in context_dict[short_val].loc[
-                                    i, "character_buffer_context"
+                            context_dict[short_val][term] = [
+                                int(
+                                    any(
+                                        substring in context
+                                        for substring in search_terms
+                                    )
+                                )
+                                for context in context_dict[short_val][
+                                    "character_buffer_context"
                                 ]
-                                for substring in search_terms
-                            ):
-                                context_dict[short_val].loc[i, term] = 1
+                            ]
 
                 # aggregation by group
                 context_dict["grouped"] = second_level_terms.copy()
@@ -538,7 +705,7 @@ Use this section to search for terms within the corpus. For the `Execute search`
     st.session_state["search_individual_input"] = st.text_input(
         "Search term",
         value="",
-        help="Get a breakdown of occurrences of a search in each document",
+        help="Get a breakdown of occurrences of a search in each document. Separate several terms with commas, e.g. `trade, tariff`, and search for 'ors' within a term with `|`, e.g. `shipping|trade`.",
     )
 
     # dropdown of groups
@@ -565,52 +732,50 @@ Use this section to search for terms within the corpus. For the `Execute search`
             help="Search the corpus for an individual search term.",
         )
 
-        if st.session_state["search_individual_button"]:
+        terms = [
+            x.strip()
+            for x in st.session_state["search_individual_input"].split(",")
+            if x.strip() != ""
+        ]
+
+        if st.session_state["search_individual_button"] and len(terms) == 0:
+            st.error("Enter a search term first.")
+        elif st.session_state["search_individual_button"]:
             with st.spinner("Performing search..."):
-                # execute search
-                count = []
+
+                # execute search, updating the plot as documents finish
+                stream_plot = st.empty()
                 text_ids = []
-                for text in os.listdir(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/transformed_txt_files/"
+                counts = []
+                last_update = time.time()
+                for text_id, text_counts in iter_term_counts(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/",
+                    terms,
                 ):
-                    if ".txt" in text:
-                        with open(
-                            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/transformed_txt_files/{text}",
-                            "r",
-                            encoding="latin1",
-                        ) as f:
-                            stringx = f.read()
-                        text_ids.append(int(text.split("_")[1].split(".")[0]))
-                        count.append(
-                            stringx.count(
-                                " " + st.session_state["search_individual_input"] + " "
-                            )
+                    text_ids.append(text_id)
+                    counts.append(text_counts)
+                    if time.time() - last_update >= 1:
+                        stream_plot.plotly_chart(
+                            individual_search_plot(
+                                individual_search_output(
+                                    text_ids,
+                                    counts,
+                                    terms,
+                                    st.session_state["individuaL_search_groups"],
+                                )
+                            ),
+                            height=450,
+                            use_container_width=True,
+                            key=f"individual_search_stream_{len(text_ids)}",
                         )
-
-                output = pd.DataFrame({"text_id": text_ids, "count": count})
-                output["search_term"] = st.session_state["search_individual_input"]
-                output = output.loc[:, ["text_id", "search_term", "count"]]
-
-                # group by metadata columln if specified
-                if st.session_state["individuaL_search_groups"] != "NA":
-                    output = output.merge(
-                        st.session_state["metadata"], how="left", on="text_id"
-                    ).loc[
-                        :,
-                        [
-                            st.session_state["individuaL_search_groups"],
-                            "search_term",
-                            "count",
-                        ],
-                    ]
-                    output = (
-                        output.groupby(st.session_state["individuaL_search_groups"])
-                        .sum()
-                        .reset_index()
-                    )
-
-                output = output.sort_values([output.columns[0]], axis=0).reset_index(
-                    drop=True
+                        last_update = time.time()
+                stream_plot.empty()
+
+                output = individual_search_output(
+                    text_ids,
+                    counts,
+                    terms,
+                    st.session_state["individuaL_search_groups"],
                 )
 
                 output.to_excel(
@@ -641,16 +806,53 @@ Use this section to search for terms within the corpus. For the `Execute search`
             plot_df = pd.read_excel(
                 f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/individual_search_results.xlsx"
             )
-            fig = px.bar(
-                plot_df,
-                x=plot_df.columns[0],
-                y="count",
-            )
-            fig.update_layout(
-                yaxis_title="Count",
-                xaxis_title="",
-                # title=f"Occurrence of '{plot_df.loc[0, 'search_term']}' in documents",
+            st.plotly_chart(
+                individual_search_plot(plot_df), height=450, use_container_width=True
             )
-            st.plotly_chart(fig, height=450, use_container_width=True)
         except:
             pass
+
+
+def individual_search_output(text_ids, counts, terms, group_column):
+    "dataframe of individual term search counts per text id and term, summed by a metadata column if group_column isn't `NA`"
+    output = pd.DataFrame(
+        {
+            "text_id": np.repeat(text_ids, len(terms)),
+            "search_term": terms * len(text_ids),
+            "count": np.array(counts, dtype=np.int64).reshape(-1),
+        }
+    )
+
+    # group by metadata columln if specified
+    if group_column != "NA":
+        output = output.merge(
+            st.session_state["metadata"], how="left", on="text_id"
+        ).loc[:, [group_column, "search_term", "count"]]
+        output = (
+            output.groupby([group_column, "search_term"], sort=False)["count"]
+            .sum()
+            .reset_index()
+        )
+
+    output = output.sort_values([output.columns[0]], axis=0, kind="stable").reset_index(
+        drop=True
+    )
+
+    return output
+
+
+def individual_search_plot(plot_df):
+    "bar plot of individual term search results, one bar per term if several terms were searched"
+    fig = px.bar(
+        plot_df,
+        x=plot_df.columns[0],
+        y="count",
+        color="search_term" if plot_df["search_term"].nunique() > 1 else None,
+        barmode="group",
+    )
+    fig.update_layout(
+        yaxis_title="Count",
+        xaxis_title="",
+    )
+
+    return fig
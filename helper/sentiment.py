@@ -4,6 +4,11 @@ import plotly.express as px
 import streamlit as st
 import sys
 
+from helper.near_duplicates import excluded_text_ids
+from helper.sentiment_scores import (
+    gen_sentiment_csv_stored,
+    gen_sentiment_report_stored,
+)
 from helper.text_transformation import initialize_processor
 from helper.progress_bar import Logger
 
@@ -19,6 +24,12 @@ def gen_sentiment():
         with st.spinner("Loading corpus..."):
             processor = initialize_processor()
 
+        st.session_state["parallel_sentiment"] = st.checkbox(
+            "Parallel sentiment scoring",
+            value=False,
+            help="Score the sentences in several processes at once. The scores are the same, but large corpora are scored much faster on servers with several CPU cores.",
+        )
+
         # run button
         st.session_state["run_sentiment_button"] = st.button(
             "Generate sentiment scores",
@@ -26,15 +37,23 @@ def gen_sentiment():
         )
 
         if st.session_state["run_sentiment_button"]:
-            # generate the CSV first with all text ids regardless
+            # generate the CSV first with all text ids but the excluded near-duplicates
             with st.spinner("Generating sentiment scores..."):
                 # intialize progress bar in case necessary
                 old_stdout = sys.stdout
                 sys.stdout = Logger(st.progress(0), st.empty())
 
-                processor.gen_sentiment_csv(
-                    text_ids=list(processor.metadata.text_id.values),
+                # only documents that are new or changed since the last run are scored
+                excluded = excluded_text_ids(processor.data_path)
+                gen_sentiment_csv_stored(
+                    processor,
+                    text_ids=[
+                        x
+                        for x in processor.metadata.text_id.values
+                        if x not in excluded
+                    ],
                     path_prefix="transformed",
+                    parallel=st.session_state["parallel_sentiment"],
                 )
             st.info("Sentiment scores successfully generated!")
 
@@ -178,8 +197,8 @@ def gen_sentiment():
                         stringx = st.session_state["sentiment_string"]
 
                     if type(stringx) == int:
-                        sentiment_report = processor.gen_sentiment_report(
-                            text_id=stringx
+                        sentiment_report = gen_sentiment_report_stored(
+                            processor, text_id=stringx
                         )
                     else:
                         sentiment_report = processor.gen_sentiment_report(
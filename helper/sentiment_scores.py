@@ -0,0 +1,319 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import os
+
+from nltk.sentiment import SentimentIntensityAnalyzer
+import numpy as np
+import pandas as pd
+
+from helper.corpus_cache import cache_path, file_hash, read_artifact, save_artifact
+from helper.token_store import (
+    doc_rows,
+    doc_sentence_spans,
+    doc_substrings,
+    doc_token_starts,
+    delta_token_store,
+)
+
+# maximum number of sentences scored in one task, longer documents are split
+sentence_batch_size = 2000
+
+# document sentiment columns of transformed_sentiments.csv
+sentiment_columns = [
+    "avg_sentiment_w_neutral",
+    "avg_sentiment_wo_neutral",
+    "neutral_proportion",
+]
+
+# sentiment analyzer of a worker process, loaded once per process
+worker_analyzer = None
+
+
+def init_worker():
+    "load the VADER lexicon once per worker process"
+    global worker_analyzer
+    worker_analyzer = SentimentIntensityAnalyzer()
+
+
+def score_sentences(sentences):
+    "compound VADER scores of sentences, with the worker's analyzer"
+    return [worker_analyzer.polarity_scores(x)["compound"] for x in sentences]
+
+
+def doc_scored_sentences(store, i):
+    """the sentences of document i of a token store that nlp_pipeline scores, found from the lengths of its tokens. Only these sentences are turned back into text
+    parameters:
+        :store: dict: token store from gen_token_store
+        :i: int: row of the document
+    output:
+        :np.ndarray: start character offset of each sentence
+        :np.ndarray: end character offset of each sentence
+        :list[str]: the sentences
+    """
+    starts, ends = doc_sentence_spans(store, i)
+    spaces = doc_token_starts(store, i)[1:] - 1
+    n_words = np.searchsorted(spaces, ends) - np.searchsorted(spaces, starts) + 1
+
+    # a sentence of more than 2 words has spaces and is never numeric
+    scored = ((ends - starts) > 3) & (n_words > 2)
+    starts, ends = starts[scored], ends[scored]
+    return starts, ends, doc_substrings(store, i, starts, ends)
+
+
+def text_scored_sentences(stringx):
+    "the sentences of a text that nlp_pipeline scores, as doc_scored_sentences finds them in a token store: more than 3 characters, more than 2 words and not numeric"
+    starts, ends, sentences = [], [], []
+    start = 0
+    for x in stringx.split("|"):
+        if (len(x) > 3) & (len(x.split(" ")) > 2) & (not (x.isnumeric())):
+            starts.append(start)
+            ends.append(start + len(x))
+            sentences.append(x)
+        start += len(x) + 1
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64), sentences
+
+
+def document_sentiment(sentiments):
+    "avg_sentiment_w_neutral, avg_sentiment_wo_neutral and neutral_proportion of a document's sentence scores, 0 for all three if any cannot be calculated, as in nlp_pipeline's gen_sentiment_csv"
+    try:
+        return (
+            sum(sentiments) / len(sentiments),
+            sum([x for x in sentiments if x != 0.0])
+            / len([x for x in sentiments if x != 0.0]),
+            len([x for x in sentiments if x == 0.0]) / len(sentiments),
+        )
+    except:
+        return (0, 0, 0)
+
+
+def iter_scores(tasks, parallel=False, max_workers=None):
+    """sentiment scores of lists of sentences, in this process or in worker processes. In parallel, long lists are split into batches and only a bounded number of batches is in flight
+    parameters:
+        :tasks: iterable[(key, list[str])]: sentences to score, keyed by e.g. text id
+        :parallel: bool: whether to score in worker processes
+        :max_workers: int: number of worker processes, defaults to the number of CPUs
+    output:
+        :iterator[(key, list[float])]: scores of each task's sentences, in the order the tasks finish
+    """
+    if not parallel:
+        analyzer = SentimentIntensityAnalyzer()
+        for key, sentences in tasks:
+            yield key, [analyzer.polarity_scores(x)["compound"] for x in sentences]
+        return
+
+    max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+    scores = {}
+    n_batches = {}
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=init_worker
+    ) as executor:
+        task_iter = iter(tasks)
+        pending = {}
+        while True:
+            # keep a bounded number of batches in flight
+            for key, sentences in task_iter:
+                batches = [
+                    sentences[i : i + sentence_batch_size]
+                    for i in range(0, len(sentences), sentence_batch_size)
+                ] or [[]]
+                n_batches[key] = len(batches)
+                scores[key] = [None] * len(batches)
+                for part, batch in enumerate(batches):
+                    pending[executor.submit(score_sentences, batch)] = (key, part)
+                if len(pending) >= max_workers * 4:
+                    break
+
+            if len(pending) == 0:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, part = pending.pop(future)
+                scores[key][part] = future.result()
+                n_batches[key] -= 1
+
+                # task complete
+                if n_batches[key] == 0:
+                    del n_batches[key]
+                    yield key, [x for batch in scores.pop(key) for x in batch]
+
+
+def sentiment_store_path(data_path, kind, text_id):
+    "file of a document's stored sentence sentiments. kind is `transformed` for the sentences of the document scores, `report` for those of the sentence-by-sentence report"
+    path = f"{cache_path(data_path)}sentiment/"
+    os.makedirs(path, exist_ok=True)
+    return f"{path}{kind}_{text_id}.npz"
+
+
+def read_sentiment_store(store_path, file_path):
+    """a document's stored sentence sentiments if they are of the current text of file_path, else None. The text is only hashed if its size or modification time changed
+    parameters:
+        :store_path: str: file of the store
+        :file_path: str: text file the sentences came from
+    output:
+        :dict: `scores` and the other arrays stored with them, or None
+    """
+    store = read_artifact(store_path)
+    if store is None:
+        return None
+
+    stat = os.stat(file_path)
+    if (int(store["size"]) == stat.st_size) and (
+        int(store["mtime_ns"]) == stat.st_mtime_ns
+    ):
+        return store
+
+    if str(store["version"]) == file_hash(file_path):
+        write_sentiment_store(
+            store_path,
+            file_path,
+            store["scores"],
+            **{
+                k: v
+                for k, v in store.items()
+                if k not in ["version", "scores", "size", "mtime_ns"]
+            },
+        )
+        return store
+
+    return None
+
+
+def write_sentiment_store(store_path, file_path, scores, **arrays):
+    "store a document's sentence scores and whatever else is needed to use them, e.g. the sentence boundaries, keyed by the hash of its text file"
+    stat = os.stat(file_path)
+    save_artifact(
+        store_path,
+        file_hash(file_path),
+        scores=np.array(scores, dtype=np.float64),
+        size=np.array(stat.st_size),
+        mtime_ns=np.array(stat.st_mtime_ns),
+        **arrays,
+    )
+
+
+def gen_sentiment_csv_stored(
+    processor, text_ids, path_prefix, parallel=False, max_workers=None
+):
+    """document sentiments like nlp_pipeline's gen_sentiment_csv, from sentence scores stored per document in the corpus's cache/sentiment/ directory. Only new or changed documents are scored, the document averages of the rest are aggregated from their stored scores
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+        :text_ids: list[int]: text ids to score
+        :path_prefix: str: prefix of the files in the transformed_txt_files/ directory
+        :parallel: bool: whether to score the sentences in worker processes
+        :max_workers: int: number of worker processes, defaults to the number of CPUs
+    """
+    csv_path = f"{processor.data_path}csv_outputs/{path_prefix}_sentiments.csv"
+
+    if os.path.exists(csv_path):
+        csv = pd.read_csv(csv_path)
+    else:
+        csv = pd.DataFrame(
+            {
+                "text_id": processor.metadata.text_id.values,
+                "avg_sentiment_w_neutral": None,
+                "avg_sentiment_wo_neutral": None,
+                "neutral_proportion": None,
+            }
+        )
+
+    text_paths = {
+        text_id: f"{processor.data_path}transformed_txt_files/{path_prefix}_{text_id}.txt"
+        for text_id in text_ids
+    }
+    text_paths = {k: v for k, v in text_paths.items() if os.path.exists(v)}
+
+    # documents with stored scores of their current text
+    results = {}
+    to_score = []
+    for text_id, text_path in text_paths.items():
+        store = read_sentiment_store(
+            sentiment_store_path(processor.data_path, "transformed", text_id),
+            text_path,
+        )
+        if store is None:
+            to_score.append(text_id)
+        else:
+            results[text_id] = document_sentiment(list(store["scores"]))
+
+    # sentences to score come from the shared token store rather than being read again, a few changed documents from their own texts
+    store = None
+    if len(to_score) > 0:
+        store = delta_token_store(
+            processor.data_path,
+            list(processor.metadata.text_id.values),
+            path_prefix,
+            len(to_score),
+        )
+    if store is not None:
+        rows = doc_rows(store)
+
+    # only the sentences go to the workers, their boundaries stay here until the scores are back
+    spans = {}
+
+    def tasks():
+        for text_id in to_score:
+            if store is not None:
+                starts, ends, sentences = doc_scored_sentences(store, rows[text_id])
+            else:
+                with open(text_paths[text_id], "r", encoding="UTF-8") as file:
+                    starts, ends, sentences = text_scored_sentences(file.read())
+            spans[text_id] = (starts, ends)
+            yield text_id, sentences
+
+    for counter, (text_id, scores) in enumerate(
+        iter_scores(tasks(), parallel, max_workers), start=1
+    ):
+        print(f"getting sentiments: {counter}/{len(to_score)}")
+        starts, ends = spans.pop(text_id)
+        write_sentiment_store(
+            sentiment_store_path(processor.data_path, "transformed", text_id),
+            text_paths[text_id],
+            scores,
+            starts=np.array(starts, dtype=np.int64),
+            ends=np.array(ends, dtype=np.int64),
+        )
+        results[text_id] = document_sentiment(scores)
+
+    # adding and writing to CSV
+    if len(results) > 0:
+        values = pd.DataFrame.from_dict(
+            results, orient="index", columns=sentiment_columns
+        )
+        rows = csv.text_id.isin(values.index)
+        csv[sentiment_columns] = csv[sentiment_columns].astype(object)
+        csv.loc[rows, sentiment_columns] = values.loc[csv.text_id[rows]].values
+    csv.to_csv(csv_path, index=False)
+
+
+def gen_sentiment_report_stored(processor, text_id):
+    """sentence-by-sentence sentiment report of a document from nlp_pipeline's gen_sentiment_report. The report's sentences and scores are stored the first time, later reports of the same text are a lookup
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+        :text_id: int: text id of the document
+    output:
+        :pd.DataFrame: with columns `sentence_number`, `sentence` and `sentiment`
+    """
+    txt_path = f"{processor.data_path}txt_files/{text_id}.txt"
+    store_path = sentiment_store_path(processor.data_path, "report", text_id)
+
+    store = read_sentiment_store(store_path, txt_path)
+    if (store is None) or ("sentences" not in store):
+        report = processor.gen_sentiment_report(text_id=text_id)
+        # the sentences were split on |, so it can join them
+        write_sentiment_store(
+            store_path,
+            txt_path,
+            report.sentiment.values,
+            sentences=np.array("|".join(report.sentence)),
+        )
+        return report
+
+    scores = list(store["scores"])
+    return pd.DataFrame(
+        {
+            "sentence_number": list(range(1, len(scores) + 1)),
+            "sentence": str(store["sentences"]).split("|") if len(scores) > 0 else [],
+            "sentiment": scores,
+        }
+    )
@@ -0,0 +1,466 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import io
+import itertools
+import os
+import re
+
+from nltk.sentiment import SentimentIntensityAnalyzer
+import numpy as np
+import pandas as pd
+
+
+pre_agg_counts_columns = [
+    "text_id",
+    "count",
+    "n_words",
+    "sentence_sentiment",
+    "character_buffer_sentiment",
+]
+sentence_occurrences_columns = [
+    "text_id",
+    "sentence_context",
+    "character_buffer_context",
+    "sentence_sentiment",
+    "character_buffer_sentiment",
+]
+counts_columns = [
+    "count",
+    "count_per_1000_words",
+    "number_of_texts_present",
+    "share_of_texts_present",
+    "sentence_sentiment",
+    "character_buffer_sentiment",
+]
+
+# sentiment analyzer of a worker process, loaded once per process
+worker_analyzer = None
+
+
+def init_worker():
+    "load the VADER lexicon once per worker process"
+    global worker_analyzer
+    worker_analyzer = SentimentIntensityAnalyzer()
+
+
+def term_counts(occurrences, search_terms_df, i, text_id, n_words):
+    "pre-aggregation counts of search term i in one text from its occurrences table"
+    tmp_counts = pd.DataFrame(
+        {
+            "count": len(occurrences),
+            "n_words": n_words,
+            "sentence_sentiment": np.mean(occurrences.sentence_sentiment),
+            "character_buffer_sentiment": np.mean(
+                occurrences.character_buffer_sentiment
+            ),
+        },
+        index=[0],
+    )
+
+    for j in range(len(search_terms_df.columns) - 1):
+        tmp_counts[search_terms_df.columns[j]] = search_terms_df.iloc[i, j]
+    tmp_counts[search_terms_df.columns[-1]] = search_terms_df.iloc[i, -1]
+    tmp_counts["text_id"] = text_id
+    return tmp_counts.loc[:, list(search_terms_df.columns) + pre_agg_counts_columns]
+
+
+def search_text(
+    stringx,
+    text_id,
+    search_terms_df,
+    i,
+    character_buffer,
+    exclude_sentences,
+    analyzer,
+    n_words,
+):
+    """occurrences of search term i in one text, exactly as nlp_pipeline's gen_search_terms finds them. The text is searched and the occurrences scored once, the occurrences matching exclude_sentences are then dropped from a copy
+    output:
+        :tuple: (occurrences, counts, offsets) with the exclusions applied, offsets being the (start, end) character offsets of each occurrence. None if there are no occurrences left
+        :tuple: the same without the exclusions
+    """
+    word = search_terms_df.iloc[i, -1]
+
+    split_string = stringx.split("|")
+
+    occurrences = [
+        (split_string[j - 1] if j > 0 else "")
+        + "|"
+        + split_string[j]
+        + "|"
+        + (split_string[j + 1] if j < len(split_string) - 1 else "")
+        for j in range(len(split_string))
+        if split_string[j].find(" " + word + " ") > -1
+    ]
+    # when it happens multiple times in one sentence
+    occurrences = list(
+        itertools.chain.from_iterable(
+            [occurrence]
+            * len(
+                [
+                    m.start()
+                    for m in re.finditer(" " + word + " ", occurrence.split("|")[1])
+                ]
+            )
+            for occurrence in occurrences
+        )
+    )
+    if len(occurrences) == 0:
+        return None, None
+
+    # occurrences for character buffer sentiment, and where they are
+    spans = np.array(
+        [m.span() for m in re.finditer(" " + word + " ", stringx)], dtype=np.int64
+    ).reshape(-1, 2)
+
+    contexts = [
+        stringx[
+            np.max([0, j - character_buffer]) : np.min(
+                [len(stringx), j + character_buffer]
+            )
+        ]
+        for j in spans[:, 0]
+    ]
+    tmp_sentence_occurrences = pd.DataFrame(
+        {
+            "sentence_context": occurrences,
+            "character_buffer_context": contexts,
+            "sentence_sentiment": [
+                analyzer.polarity_scores(x.split("|")[1])["compound"]
+                for x in occurrences
+            ],
+            "character_buffer_sentiment": [
+                analyzer.polarity_scores(x)["compound"] for x in contexts
+            ],
+        }
+    )
+    for j in range(len(search_terms_df.columns) - 1):
+        tmp_sentence_occurrences[search_terms_df.columns[j]] = search_terms_df.iloc[
+            i, j
+        ]
+    tmp_sentence_occurrences[search_terms_df.columns[-1]] = word
+    tmp_sentence_occurrences["text_id"] = text_id
+
+    tmp_sentence_occurrences = tmp_sentence_occurrences.loc[
+        :, list(search_terms_df.columns) + sentence_occurrences_columns
+    ]
+    full = (
+        tmp_sentence_occurrences,
+        term_counts(tmp_sentence_occurrences, search_terms_df, i, text_id, n_words),
+        spans,
+    )
+
+    # occurrences to remove if specified
+    keep = np.array(
+        [not any(search_s in s for search_s in exclude_sentences) for s in occurrences]
+    )
+    if keep.all():
+        return full, full
+    if not keep.any():
+        return None, full
+
+    kept_occurrences = tmp_sentence_occurrences.loc[keep, :].reset_index(drop=True)
+    excluded = (
+        kept_occurrences,
+        term_counts(kept_occurrences, search_terms_df, i, text_id, n_words),
+        spans[keep],
+    )
+    return excluded, full
+
+
+def search_shard(
+    data_path,
+    text_ids,
+    search_terms_df,
+    path_prefix,
+    character_buffer,
+    exclusions,
+    unexcluded=False,
+):
+    """run every search term over one shard of text ids. Each text is read once and searched once per term
+    output:
+        :dict{(int, int): tuple}: keyed by (search term row, text id), the (occurrences, counts, offsets) with exclusions applied, and if unexcluded=True the (occurrences, counts, offsets) without them. Missing keys have no occurrences
+    """
+    analyzer = (
+        worker_analyzer if worker_analyzer is not None else SentimentIntensityAnalyzer()
+    )
+    results = {}
+    for text_id in text_ids:
+        file_path = f"{data_path}transformed_txt_files/{path_prefix}_{text_id}.txt"
+        file = open(file_path, "r", encoding="latin1")
+        stringx = file.read()
+        file.close()
+
+        n_words = len([x for x in stringx.replace("|", "").split(" ") if len(x) > 0])
+
+        for i in range(len(search_terms_df)):
+            excluded, full = search_text(
+                stringx,
+                text_id,
+                search_terms_df,
+                i,
+                character_buffer,
+                exclusions[i],
+                analyzer,
+                n_words,
+            )
+            if full is not None:
+                results[(i, text_id)] = (excluded, full if unexcluded else None)
+
+    return results
+
+
+def aggregate_search_counts(pre_agg_counts, search_terms_df, n_texts):
+    "term counts aggregated at each level of the search terms columns, as nlp_pipeline's gen_search_terms writes them"
+    counts = []
+    for i in range(len(search_terms_df.columns)):
+        agg_columns = list(search_terms_df.columns[: i + 1])
+
+        try:
+            count = (
+                pre_agg_counts.groupby(agg_columns)
+                .apply(
+                    lambda s: pd.Series(
+                        {
+                            "count": s["count"].sum(),
+                            "count_per_1000_words": s["count"].sum()
+                            / s["n_words"].sum()
+                            * 1000,
+                            "number_of_texts_present": s["text_id"].nunique(),
+                            "share_of_texts_present": s["text_id"].nunique() / n_texts,
+                            "sentence_sentiment": s["sentence_sentiment"].mean(),
+                            "character_buffer_sentiment": s[
+                                "character_buffer_sentiment"
+                            ].mean(),
+                        }
+                    )
+                )
+                .reset_index()
+            )
+        except:
+            count = pd.DataFrame(columns=agg_columns + counts_columns)
+        counts.append(count)
+
+    return counts
+
+
+def gen_search_terms_sharded(
+    processor,
+    group_name,
+    text_ids,
+    search_terms_df,
+    path_prefix,
+    character_buffer=100,
+    match_exclusion=None,
+    aggregate_by_text_id=True,
+    parallel=True,
+    max_workers=None,
+):
+    """process-parallel version of nlp_pipeline's gen_search_terms. Text ids are split into shards, each worker process runs the full set of search terms over its shard, and the partial tables are merged in text id order, so the CSVs written are the same as those of the serial run. The positions of the occurrences are collected in the same pass and written to csv_outputs/search_terms_{group_name}_occurrence_offsets.csv as (text_id, term_id, start, end), term_id being the row of the term in search_terms_df, row for row with the occurrences CSV
+    parameters:
+        :processor: nlp_processor: the corpus processor
+        :group_name: str: group name used in the output file names
+        :text_ids: list[int]: text ids to search
+        :search_terms_df: pd.DataFrame: the search_terms sheet
+        :path_prefix: str: prefix of the files in the transformed_txt_files/ directory
+        :character_buffer: int: number of characters on either side of an occurrence to use as its context
+        :match_exclusion: pd.DataFrame: optional sheet of occurrences to drop, search terms in the first column (`permutation`) and sentence contexts in the second (`sentence_context`)
+        :aggregate_by_text_id: bool: also write the per-document search_terms_grouped_by_{column}.csv files of gen_aggregated_search_terms from the same results
+        :parallel: bool: whether to search in worker processes, otherwise the shards are searched one after the other in this process
+        :max_workers: int: number of worker processes, defaults to the number of CPUs
+    """
+    if isinstance(text_ids, int):
+        text_ids = [text_ids]
+    text_ids = [x for x in text_ids]
+
+    exclusions = [[] for _ in range(len(search_terms_df))]
+    if match_exclusion is not None:
+        for i in range(len(search_terms_df)):
+            # first column the search term, second column the sentence context to drop, whatever they're called
+            exclusions[i] = list(
+                match_exclusion.loc[
+                    lambda x: x.iloc[:, 0] == search_terms_df.iloc[i, -1]
+                ]
+                .iloc[:, 1]
+                .values
+            )
+
+    # balance shards by file size, more shards than workers so progress is reported regularly
+    max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+    n_shards = max(min(len(text_ids), max_workers * 4 if parallel else 100), 1)
+    shards = [[] for _ in range(n_shards)]
+    shard_sizes = [0] * n_shards
+    for text_id in sorted(
+        text_ids,
+        key=lambda x: -os.path.getsize(
+            f"{processor.data_path}transformed_txt_files/{path_prefix}_{x}.txt"
+        ),
+    ):
+        smallest = shard_sizes.index(min(shard_sizes))
+        shards[smallest].append(text_id)
+        shard_sizes[smallest] += os.path.getsize(
+            f"{processor.data_path}transformed_txt_files/{path_prefix}_{text_id}.txt"
+        )
+
+    shards = [x for x in shards if len(x) > 0]
+    results = {}
+    for counter, shard_results in enumerate(
+        iter_shard_results(
+            processor.data_path,
+            shards,
+            search_terms_df,
+            path_prefix,
+            character_buffer,
+            exclusions,
+            aggregate_by_text_id,
+            parallel,
+            max_workers,
+        )
+    ):
+        print(
+            f"processing search terms for group {group_name}: {counter+1}/{len(shards)}"
+        )
+        results.update(shard_results)
+
+    # merge in the serial order, search terms then text ids
+    keys = [
+        (i, text_id)
+        for i in range(len(search_terms_df))
+        for text_id in text_ids
+        if (i, text_id) in results and results[(i, text_id)][0] is not None
+    ]
+    sentence_occurrences = pd.concat(
+        [
+            pd.DataFrame(
+                columns=list(search_terms_df.columns) + sentence_occurrences_columns
+            )
+        ]
+        + [results[key][0][0] for key in keys],
+        ignore_index=True,
+        axis=0,
+    )
+    pre_agg_counts = pd.concat(
+        [pd.DataFrame(columns=list(search_terms_df.columns) + pre_agg_counts_columns)]
+        + [results[key][0][1] for key in keys],
+        ignore_index=True,
+        axis=0,
+    )
+
+    offsets = [results[key][0][2] for key in keys]
+    pd.DataFrame(
+        {
+            "text_id": np.repeat([x[1] for x in keys], [len(x) for x in offsets]),
+            "term_id": np.repeat(
+                np.array([x[0] for x in keys], dtype=np.int32),
+                [len(x) for x in offsets],
+            ),
+            "start": np.concatenate(
+                [np.array([], dtype=np.int64)] + [x[:, 0] for x in offsets]
+            ),
+            "end": np.concatenate(
+                [np.array([], dtype=np.int64)] + [x[:, 1] for x in offsets]
+            ),
+        }
+    ).to_csv(
+        f"{processor.data_path}csv_outputs/search_terms_{group_name}_occurrence_offsets.csv",
+        index=False,
+    )
+
+    sentence_occurrences.to_csv(
+        f"{processor.data_path}csv_outputs/search_terms_{group_name}_occurrences.csv",
+        index=False,
+    )
+    for column, count in zip(
+        search_terms_df.columns,
+        aggregate_search_counts(pre_agg_counts, search_terms_df, len(text_ids)),
+    ):
+        count.to_csv(
+            f"{processor.data_path}csv_outputs/search_terms_{group_name}_counts_by_{column}.csv",
+            index=False,
+        )
+
+    if aggregate_by_text_id:
+        gen_aggregated_search_counts(
+            processor.data_path, text_ids, search_terms_df, results
+        )
+
+
+def iter_shard_results(
+    data_path,
+    shards,
+    search_terms_df,
+    path_prefix,
+    character_buffer,
+    exclusions,
+    unexcluded,
+    parallel,
+    max_workers,
+):
+    "search_shard results of each shard, in this process or in worker processes, in the order the shards finish"
+    if not parallel:
+        if worker_analyzer is None:
+            init_worker()
+        for shard in shards:
+            yield search_shard(
+                data_path,
+                shard,
+                search_terms_df,
+                path_prefix,
+                character_buffer,
+                exclusions,
+                unexcluded,
+            )
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=init_worker
+    ) as executor:
+        futures = [
+            executor.submit(
+                search_shard,
+                data_path,
+                shard,
+                search_terms_df,
+                path_prefix,
+                character_buffer,
+                exclusions,
+                unexcluded,
+            )
+            for shard in shards
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def gen_aggregated_search_counts(data_path, text_ids, search_terms_df, results):
+    "write the per-document search_terms_grouped_by_{column}.csv files of nlp_pipeline's gen_aggregated_search_terms, from the unexcluded results of search_shard"
+    grouped = [[] for _ in range(len(search_terms_df.columns))]
+    for text_id in text_ids:
+        pre_agg_counts = pd.concat(
+            [
+                pd.DataFrame(
+                    columns=list(search_terms_df.columns) + pre_agg_counts_columns
+                )
+            ]
+            + [
+                results[(i, text_id)][1][1]
+                for i in range(len(search_terms_df))
+                if (i, text_id) in results and results[(i, text_id)][1] is not None
+            ],
+            ignore_index=True,
+            axis=0,
+        )
+        for j, count in enumerate(
+            aggregate_search_counts(pre_agg_counts, search_terms_df, 1)
+        ):
+            # nlp_pipeline reads these back from CSV before combining them
+            tmp_df = pd.read_csv(io.StringIO(count.to_csv(index=False)))
+            tmp_df["group"] = text_id
+            grouped[j].append(tmp_df)
+
+    for j in range(len(search_terms_df.columns)):
+        df = pd.concat(grouped[j], ignore_index=True, axis=0)
+        df = df.loc[:, ["group"] + list(df.columns[:-1])]
+        df.to_csv(
+            f"{data_path}csv_outputs/search_terms_grouped_by_{search_terms_df.columns[j]}.csv",
+            index=False,
+        )
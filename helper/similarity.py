@@ -1,12 +1,57 @@
+import numpy as np
 import os
 import pandas as pd
-import pickle
+from pathlib import Path
 import plotly.express as px
 import streamlit as st
+import sys
 
+from helper.near_duplicates import (
+    excluded_text_ids,
+    gen_minhash_signatures,
+    near_duplicate_clusters,
+    set_excluded_text_ids,
+)
+from helper.progress_bar import Logger
+from helper.similarity_matrix import (
+    cluster_documents,
+    document_clusters_version_path,
+    excel_max_documents,
+    full_matrix_max_documents,
+    gen_similarity_heatmap,
+    gen_similarity_matrix,
+    gen_similarity_projection,
+    gen_tfidf_matrix,
+    pooled_similarity,
+    heatmap_tiles,
+    similarity_cluster_df,
+    similarity_heatmap,
+    similarity_matrix_version,
+    similarity_neighbours_version_path,
+    similarity_table_version_path,
+    top_neighbours,
+    write_similarity_table,
+)
 from helper.text_transformation import initialize_processor
 
 
+def remove_stale_outputs(version_path, version, file_names):
+    "delete outputs in csv_outputs/ that were written for a different version, e.g. of another selection or texts that have changed since"
+    try:
+        with open(version_path, "r") as f:
+            output_version = f.read()
+    except FileNotFoundError:
+        output_version = None
+    if output_version != version:
+        for file_name in file_names:
+            if os.path.exists(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{file_name}"
+            ):
+                os.remove(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{file_name}"
+                )
+
+
 # gen entity count csv
 def gen_similarity():
     st.markdown("### Text similarity")
@@ -25,10 +70,15 @@ def gen_similarity():
         with st.spinner("Loading corpus..."):
             processor = initialize_processor()
 
+        # near-duplicates are left out of the default selection if excluded
         if st.session_state["similarity_text_ids"] == "":
-            text_ids = list(processor.metadata.text_id.values)
+            excluded = excluded_text_ids(processor.data_path)
+            text_ids = [
+                x for x in processor.metadata.text_id.values if x not in excluded
+            ]
         else:
             text_ids = eval("[" + st.session_state["similarity_text_ids"] + "]")
+        selection_version = similarity_matrix_version(processor, text_ids)
 
         # which metadata column to use for x axis labels
         st.session_state["similarity_label"] = st.selectbox(
@@ -47,140 +97,484 @@ def gen_similarity():
             help="Select which metadata column you want to use for labelling the axes.",
         )
 
+        # the full matrix is only offered for small and mid-sized selections
+        similarity_modes = ["Top neighbours"]
+        if len(text_ids) <= full_matrix_max_documents:
+            similarity_modes = ["Full matrix"] + similarity_modes
+        st.session_state["similarity_mode"] = st.selectbox(
+            "Similarity output",
+            options=similarity_modes,
+            index=0,
+            help=f"`Full matrix` compares every document with every other document and is only available for up to {full_matrix_max_documents} documents, the Excel download for up to {excel_max_documents}. `Top neighbours` lists the most similar documents of each document and works for corpora of any size.",
+        )
+
+        if st.session_state["similarity_mode"] == "Top neighbours":
+            st.session_state["n_similarity_neighbours"] = st.number_input(
+                "Number of neighbours per document",
+                min_value=1,
+                value=10,
+                help="How many of the most similar documents to list for each document.",
+            )
+            st.session_state["similarity_threshold"] = st.number_input(
+                "Minimum similarity",
+                min_value=0.0,
+                max_value=1.0,
+                value=0.0,
+                step=0.05,
+                help="Only list neighbours that are at least this similar, from 0 (completely different) to 1 (identical).",
+            )
+
         # run button
         st.session_state["run_text_similarity_button"] = st.button(
             "Generate generate text similarity",
             help="Generate text similarity.",
         )
 
-        # generate data
+        # cluster plot projection of the whole corpus, only fitted again when the texts change
         if st.session_state["run_text_similarity_button"]:
+            with st.spinner("Generating cluster plot..."):
+                gen_similarity_projection(processor)
+
+        # top neighbours of this selection, label column and parameters
+        neighbours_version = selection_version + str(
+            [
+                st.session_state["similarity_label"],
+                st.session_state.get("n_similarity_neighbours"),
+                st.session_state.get("similarity_threshold"),
+            ]
+        )
+
+        # generate top neighbours
+        if st.session_state["run_text_similarity_button"] and (
+            st.session_state["similarity_mode"] == "Top neighbours"
+        ):
             with st.spinner("Generating text similarity data..."):
-                p, plot_df, xaxis_labels = processor.plot_text_similarity(
-                    text_ids, label_column=st.session_state["similarity_label"]
+                neighbours_df = top_neighbours(
+                    gen_tfidf_matrix(processor, text_ids),
+                    text_ids,
+                    n_neighbours=st.session_state["n_similarity_neighbours"],
+                    threshold=st.session_state["similarity_threshold"],
                 )
 
-                # pickle the plot
+                # label columns if different metadata column selected
+                if st.session_state["similarity_label"] != "text_id":
+                    labels = st.session_state["metadata"].set_index("text_id")[
+                        st.session_state["similarity_label"]
+                    ]
+                    neighbours_df.insert(
+                        1,
+                        st.session_state["similarity_label"],
+                        labels.reindex(neighbours_df.text_id).values,
+                    )
+                    neighbours_df.insert(
+                        len(neighbours_df.columns) - 1,
+                        f"neighbour_{st.session_state['similarity_label']}",
+                        labels.reindex(neighbours_df.neighbour_text_id).values,
+                    )
+
+                neighbours_df.to_csv(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_similarity_neighbours.csv",
+                    index=False,
+                )
                 with open(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/similarity_heatmap.pkl",
-                    "wb",
+                    similarity_neighbours_version_path(processor.data_path), "w"
                 ) as f:
-                    pickle.dump(p, f)
+                    f.write(neighbours_version)
+            st.info("Text similarity data succcessfully generated!")
 
-                # edit column names if different metadata column selected
-                plot_df.columns = list(
-                    st.session_state["metadata"]
-                    .loc[
-                        lambda x: x.text_id.isin(text_ids),
-                        st.session_state["similarity_label"],
+        # neighbours of a different selection, label column or parameters
+        if st.session_state["similarity_mode"] == "Top neighbours":
+            remove_stale_outputs(
+                similarity_neighbours_version_path(processor.data_path),
+                neighbours_version,
+                ["text_similarity_neighbours.csv"],
+            )
+
+        if (st.session_state["similarity_mode"] == "Top neighbours") and os.path.exists(
+            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_similarity_neighbours.csv"
+        ):
+            # download button
+            with open(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_similarity_neighbours.csv",
+                "rb",
+            ) as template_file:
+                template_byte = template_file.read()
+
+            st.download_button(
+                "Download text similarity neighbours",
+                template_byte,
+                "text_similarity_neighbours.csv",
+                "text/csv",
+                help="Download the most similar documents of each document.",
+            )
+
+            st.markdown("### Most similar documents")
+            st.markdown(
+                "Each row is a document and one of its most similar other documents. A similarity close to 1 means the documents are very similar, a value of 0 means they are completely different."
+            )
+            st.dataframe(
+                pd.read_csv(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_similarity_neighbours.csv"
+                ),
+                hide_index=True,
+            )
+
+        # labels of the rows and columns of the full matrix
+        if st.session_state["similarity_label"] == "text_id":
+            similarity_labels = np.array(text_ids)
+        else:
+            similarity_labels = (
+                st.session_state["metadata"]
+                .set_index("text_id")[st.session_state["similarity_label"]]
+                .reindex(text_ids)
+                .values
+            )
+
+        # generate data
+        if st.session_state["run_text_similarity_button"] and (
+            st.session_state["similarity_mode"] == "Full matrix"
+        ):
+            with st.spinner("Generating text similarity data..."):
+                matrix = gen_similarity_matrix(processor, text_ids)
+
+                # outputs of a previous run that this selection does not have
+                for file_name in [
+                    "text_similarity.csv",
+                    "text_similarity.xlsx",
+                    "similarity_heatmap.pkl",
+                ]:
+                    if os.path.exists(
+                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{file_name}"
+                    ):
+                        os.remove(
+                            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{file_name}"
+                        )
+
+                # Excel download for small selections, CSV download for larger ones
+                write_similarity_table(
+                    matrix,
+                    similarity_labels,
+                    st.session_state["similarity_label"],
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_similarity."
+                    + ("xlsx" if len(text_ids) <= excel_max_documents else "csv"),
+                )
+
+                with open(similarity_table_version_path(processor.data_path), "w") as f:
+                    f.write(selection_version + st.session_state["similarity_label"])
+
+                # overview of the heat map, stored with the matrix
+                gen_similarity_heatmap(processor, text_ids, matrix)
+
+            st.info("Text similarity data succcessfully generated!")
+
+        # full matrix downloads of a different selection or label column
+        remove_stale_outputs(
+            similarity_table_version_path(processor.data_path),
+            selection_version + st.session_state["similarity_label"],
+            ["text_similarity.xlsx", "text_similarity.csv"],
+        )
+
+        if st.session_state["similarity_mode"] == "Full matrix":
+            # download button, the file is only read when it is clicked
+            for file_name, mime in [
+                ("text_similarity.xlsx", "application/octet-stream"),
+                ("text_similarity.csv", "text/csv"),
+            ]:
+                if os.path.exists(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{file_name}"
+                ):
+                    st.download_button(
+                        "Download text similarity data",
+                        Path(
+                            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{file_name}"
+                        ).read_bytes,
+                        file_name,
+                        mime,
+                        help="Download text similarity data.",
+                    )
+
+            # display heatmap of the stored matrix of this selection
+            matrix = gen_similarity_matrix(processor, text_ids, calculate=False)
+            if matrix is not None:
+                st.markdown("### Heat map of similarity between text")
+                st.markdown(
+                    "Each grid is the comparision between two documents. A value close to 1 means the documents are very similar, a value of 0 means they are completely different. For large selections, each grid is a block of documents showing the highest similarity between two different documents in it. Click a square to zoom into its documents."
+                )
+
+                # a click on a tile of the overview zooms into it
+                tiles = heatmap_tiles(len(text_ids))
+                tile_options = ["Whole matrix"] + [
+                    f"Documents {x[0] + 1}-{x[1]} and {x[2] + 1}-{x[3]}" for x in tiles
+                ]
+                try:
+                    points = st.session_state["similarity_heatmap_overview"][
+                        "selection"
+                    ]["points"]
+                    clicked = [
+                        x["point_index"] for x in points if x["curve_number"] == 1
                     ]
+                    if len(clicked) > 0:
+                        st.session_state["similarity_heatmap_tile"] = tile_options[
+                            clicked[0] + 1
+                        ]
+                except:
+                    pass
+                if st.session_state.get("similarity_heatmap_tile") not in tile_options:
+                    st.session_state["similarity_heatmap_tile"] = "Whole matrix"
+
+                if len(tiles) > 0:
+                    st.selectbox(
+                        "Heat map view",
+                        options=tile_options,
+                        key="similarity_heatmap_tile",
+                        help="Show the whole matrix, or zoom into a block of documents to see every pair of documents in it.",
+                    )
+
+                if st.session_state["similarity_heatmap_tile"] == "Whole matrix":
+                    pooled, row_edges, column_edges = gen_similarity_heatmap(
+                        processor, text_ids, matrix
+                    )
+                    st.plotly_chart(
+                        similarity_heatmap(
+                            pooled, row_edges, column_edges, similarity_labels, tiles
+                        ),
+                        use_container_width=True,
+                        key="similarity_heatmap_overview",
+                        on_select="rerun",
+                        selection_mode="points",
+                    )
+                else:
+                    tile = tiles[
+                        tile_options.index(st.session_state["similarity_heatmap_tile"])
+                        - 1
+                    ]
+                    pooled, row_edges, column_edges = pooled_similarity(
+                        matrix, tile[:2], tile[2:]
+                    )
+                    st.plotly_chart(
+                        similarity_heatmap(
+                            pooled, row_edges, column_edges, similarity_labels
+                        ),
+                        use_container_width=True,
+                    )
+
+        # display cluster plot, documents coloured by the current label column
+        projection = gen_similarity_projection(processor, fit=False)
+        if projection is not None:
+            if st.session_state["similarity_label"] == "text_id":
+                groups = ["text_id"] * len(text_ids)
+            else:
+                groups = list(
+                    st.session_state["metadata"]
+                    .set_index("text_id")[st.session_state["similarity_label"]]
+                    .reindex(text_ids)
                     .values
                 )
-                plot_df[st.session_state["similarity_label"]] = list(
+            cluster_plot_df = similarity_cluster_df(projection, text_ids, groups)
+
+            st.markdown("### Cluster plot of documents")
+            st.markdown(
+                "For this plot, the TF-IDF vectors of the documents are compressed to two dimensions via truncated singular value decomposition (SVD) to be able to be displayed on a plot. Documents that are closer together are more similar, and vice versa."
+            )
+            fig = px.scatter(
+                x=cluster_plot_df["pc1"],
+                y=cluster_plot_df["pc2"],
+                color=cluster_plot_df["group"],
+            )
+            fig.update_layout(
+                yaxis_title="Component 2",
+                xaxis_title="Component 1",
+                title="",
+                legend=dict(title_text=st.session_state["similarity_label"]),
+            )
+            st.plotly_chart(fig, height=450, use_container_width=True)
+
+        # document clusters of the selection
+        st.markdown("### Document clusters")
+        st.markdown(
+            "Group the selected documents into clusters of similar documents with [k-means](https://en.wikipedia.org/wiki/K-means_clustering) on their TF-IDF vectors. Each cluster is described by the words that are most characteristic of its documents."
+        )
+        st.session_state["n_document_clusters"] = st.number_input(
+            "Number of clusters",
+            min_value=1,
+            value=10,
+            help="How many clusters to group the documents into. Capped at the number of documents.",
+        )
+        st.session_state["run_document_clusters_button"] = st.button(
+            "Cluster documents",
+            help="Group the selected documents into clusters.",
+        )
+
+        if st.session_state["run_document_clusters_button"]:
+            with st.spinner("Clustering documents..."):
+                labels, clusters_df = cluster_documents(
+                    *gen_tfidf_matrix(processor, text_ids, return_terms=True),
+                    n_clusters=st.session_state["n_document_clusters"],
+                )
+
+                # cluster of each document with its metadata
+                members_df = (
                     st.session_state["metadata"]
-                    .loc[
-                        lambda x: x.text_id.isin(text_ids),
-                        st.session_state["similarity_label"],
-                    ]
-                    .values
+                    .drop(
+                        [
+                            "local_raw_filepath",
+                            "local_txt_filepath",
+                            "detected_language",
+                        ],
+                        axis=1,
+                        errors="ignore",
+                    )
+                    .set_index("text_id")
+                    .reindex(text_ids)
+                    .reset_index()
                 )
-                plot_df = plot_df.loc[
-                    :,
-                    [st.session_state["similarity_label"]]
-                    + [
-                        x
-                        for x in plot_df.columns
-                        if x != st.session_state["similarity_label"]
-                    ],
-                ]
-                plot_df.to_csv(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_similarity.csv",
+                members_df.insert(1, "cluster", labels)
+
+                clusters_df.to_csv(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/document_clusters.csv",
+                    index=False,
+                )
+                members_df.to_csv(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/document_cluster_members.csv",
                     index=False,
                 )
+                with open(
+                    document_clusters_version_path(processor.data_path), "w"
+                ) as f:
+                    f.write(selection_version)
+            st.info("Documents successfully clustered!")
 
-                # generate cluster info
-                if st.session_state["similarity_label"] == "text_id":
-                    text_id_dict = {"text_id": text_ids}
-                else:
-                    text_id_dict = {}
-                    for group in st.session_state["metadata"][
-                        st.session_state["similarity_label"]
-                    ].unique():
-                        text_id_dict[group] = list(
-                            st.session_state["metadata"].loc[
-                                lambda x: (
-                                    x[st.session_state["similarity_label"]] == group
-                                )
-                                & (x.text_id.isin(text_ids)),
-                                "text_id",
-                            ]
-                        )
+        # clusters of a different selection or of texts that have changed since, like the full matrix outputs
+        remove_stale_outputs(
+            document_clusters_version_path(processor.data_path),
+            selection_version,
+            ["document_clusters.csv", "document_cluster_members.csv"],
+        )
+
+        if os.path.exists(
+            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/document_clusters.csv"
+        ):
+            # download buttons
+            for file_name, label, help_text in [
+                (
+                    "document_clusters.csv",
+                    "Download cluster summary",
+                    "Download the size and top words of each cluster.",
+                ),
+                (
+                    "document_cluster_members.csv",
+                    "Download documents with their clusters",
+                    "Download the metadata of the documents with the cluster of each document.",
+                ),
+            ]:
+                with open(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/{file_name}",
+                    "rb",
+                ) as template_file:
+                    template_byte = template_file.read()
 
-                cluster_df = processor.gen_cluster_df(text_id_dict=text_id_dict)
-                cluster_df.to_csv(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_cluster.csv",
+                st.download_button(
+                    label,
+                    template_byte,
+                    file_name,
+                    "text/csv",
+                    help=help_text,
+                )
+
+            st.markdown(
+                "`n_documents` is the number of documents in each cluster, `top_terms` the words with the most weight in its documents."
+            )
+            st.dataframe(
+                pd.read_csv(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/document_clusters.csv"
+                ),
+                hide_index=True,
+            )
+
+        # near-duplicate documents of the whole corpus
+        st.markdown("### Near-duplicate documents")
+        st.markdown(
+            "Find documents that are (nearly) the same text, e.g. the same report downloaded twice or a draft and its final version. Documents are compared by the overlap of their runs of 5 words, estimated with [MinHash](https://en.wikipedia.org/wiki/MinHash) so the corpus does not have to be compared document by document."
+        )
+        st.session_state["near_duplicate_threshold"] = st.number_input(
+            "Minimum Jaccard similarity",
+            min_value=0.1,
+            max_value=1.0,
+            value=0.8,
+            step=0.05,
+            help="How much of their runs of 5 words two documents need to share to count as duplicates, from 0 (nothing in common) to 1 (identical).",
+        )
+        st.session_state["run_near_duplicates_button"] = st.button(
+            "Find near-duplicates",
+            help="Find clusters of near-duplicate documents in the corpus.",
+        )
+
+        if st.session_state["run_near_duplicates_button"]:
+            with st.spinner("Finding near-duplicates..."):
+                # intialize progress bar in case necessary
+                old_stdout = sys.stdout
+                sys.stdout = Logger(st.progress(0), st.empty())
+
+                signatures, has_text = gen_minhash_signatures(
+                    processor.data_path, list(processor.metadata.text_id.values)
+                )
+                duplicates_df = near_duplicate_clusters(
+                    signatures,
+                    has_text,
+                    list(processor.metadata.text_id.values),
+                    threshold=st.session_state["near_duplicate_threshold"],
+                )
+                duplicates_df.to_csv(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/near_duplicates.csv",
                     index=False,
                 )
 
-            st.info("Text similarity data succcessfully generated!")
+                # clear the progress bar
+                try:
+                    sys.stdout = sys.stdout.clear()
+                    sys.stdout = old_stdout
+                except:
+                    pass
+
+            # the exclusion follows the latest clusters
+            if len(excluded_text_ids(processor.data_path)) > 0:
+                set_excluded_text_ids(processor.data_path, duplicates_df)
+            st.info("Near-duplicates successfully found!")
 
         if os.path.exists(
-            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_similarity.csv"
+            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/near_duplicates.csv"
         ):
-            pd.read_csv(
-                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_similarity.csv"
-            ).to_excel(
-                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_similarity.xlsx",
-                index=False,
+            duplicates_df = pd.read_csv(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/near_duplicates.csv"
+            )
+
+            # exclude duplicates from the other tabs
+            exclude_duplicates = st.checkbox(
+                "Exclude near-duplicates from other analyses",
+                value=len(excluded_text_ids(processor.data_path)) > 0,
+                help="Leave all but the first document of each cluster out of top words, top phrases, entities and text similarity when no text ids are entered there, and out of sentiment, summary statistics, the corpus search and topic modelling. Individual term search still plots every document. Outputs are only updated the next time they are generated.",
             )
+            if exclude_duplicates != (len(excluded_text_ids(processor.data_path)) > 0):
+                set_excluded_text_ids(
+                    processor.data_path, duplicates_df if exclude_duplicates else None
+                )
 
             # download button
             with open(
-                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_similarity.xlsx",
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/near_duplicates.csv",
                 "rb",
             ) as template_file:
                 template_byte = template_file.read()
 
             st.download_button(
-                "Download text similarity data",
+                "Download near-duplicates",
                 template_byte,
-                "summary_statistics.xlsx",
-                "application/octet-stream",
-                help="Download text similarity data.",
+                "near_duplicates.csv",
+                "text/csv",
+                help="Download the clusters of near-duplicate documents.",
             )
 
-            # display heatmap
-            if os.path.exists(
-                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/similarity_heatmap.pkl"
-            ):
-                st.markdown("### Heat map of similarity between text")
-                st.markdown(
-                    "Each grid is the comparision between two documents. A value close to 1 means the documents are very similar, a value of 0 means they are completely different."
-                )
-                with open(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/similarity_heatmap.pkl",
-                    "rb",
-                ) as f:
-                    p = pickle.load(f)
-                st.pyplot(p)
-
-                # display cluster plot
-                st.markdown("### Cluster plot of documents")
-                st.markdown(
-                    "For this plot, the above matrix is compressed to two dimensions via principle component analysis (PCA) to be able to be displayed on a plot. Documents that are closer together are more similar, and vice versa."
-                )
-                cluster_plot_df = pd.read_csv(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/text_cluster.csv"
-                )
-                fig = px.scatter(
-                    x=cluster_plot_df["pc1"],
-                    y=cluster_plot_df["pc2"],
-                    color=cluster_plot_df["group"],
-                )
-                fig.update_layout(
-                    yaxis_title="Principal component 2",
-                    xaxis_title="Principal component 1",
-                    title="",
-                    legend=dict(title_text=st.session_state["similarity_label"]),
-                )
-                st.plotly_chart(fig, height=450, use_container_width=True)
+            st.markdown(
+                f"{duplicates_df.cluster.nunique()} clusters of near-duplicates. `kept` is the first document of each cluster, `estimated_jaccard` the share of runs of 5 words a document has in common with it."
+            )
+            st.dataframe(duplicates_df, hide_index=True)
@@ -0,0 +1,449 @@
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+
+from helper.corpus_cache import cache_path, corpus_version, load_artifact, save_artifact
+from helper.tfidf_store import gen_tfidf_store, tfidf_matrix
+
+# largest selection the Excel download of the full similarity matrix is made for
+excel_max_documents = 200
+
+# largest number of rows and columns of a heat map, larger matrices are max-pooled down to it
+heatmap_resolution = 500
+
+# largest number of documents per axis that heat maps show the labels of
+heatmap_label_documents = 100
+
+# largest selection the full similarity matrix is offered for
+full_matrix_max_documents = 5000
+
+# rows and columns of a tile of the full similarity matrix
+similarity_tile_size = 1000
+
+# number of similarity cells calculated at once
+similarity_block_cells = 20000000
+
+# number of documents per minibatch of the document clustering
+cluster_batch_size = 1024
+
+
+def gen_tfidf_matrix(processor, text_ids, return_terms=False):
+    """sparse TF-IDF vectors of the original texts, the same as nlp_pipeline's gen_similarity. Calculated from the term counts stored per document, so only new or changed texts are tokenized. Rows have unit length, so the product of two rows is their cosine similarity
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+        :text_ids: list[int]: text ids, one row each
+        :return_terms: bool: whether to also return the term of each column
+    output:
+        :sparse.csr_matrix: document x term TF-IDF
+        :list[str]: term of each column, if return_terms
+    """
+    return tfidf_matrix(gen_tfidf_store(processor), text_ids, return_terms)
+
+
+def top_neighbours(tfidf, text_ids, n_neighbours, threshold=None):
+    """the most similar other documents of every document. Cosine similarities are calculated for a block of rows at a time, so memory is bounded by similarity_block_cells rather than the square of the number of documents
+    parameters:
+        :tfidf: sparse.csr_matrix: document x term TF-IDF with unit length rows
+        :text_ids: list[int]: text id of each row
+        :n_neighbours: int: how many neighbours to keep per document
+        :threshold: float: only keep neighbours at least this similar
+    output:
+        :pd.DataFrame: with columns `text_id`, `rank`, `neighbour_text_id` and `similarity`, neighbours by descending similarity
+    """
+    text_ids = np.array(text_ids)
+    n_docs = tfidf.shape[0]
+    n_neighbours = min(n_neighbours, n_docs - 1)
+    block_size = max(1, similarity_block_cells // max(n_docs, 1))
+    transposed = tfidf.T.tocsc()
+
+    rows, neighbours, similarities = [], [], []
+    for start in range(0, n_docs if n_neighbours > 0 else 0, block_size):
+        end = min(start + block_size, n_docs)
+        block = (tfidf[start:end] @ transposed).toarray()
+
+        # a document is not its own neighbour
+        block[np.arange(end - start), np.arange(start, end)] = -np.inf
+
+        top = np.argpartition(-block, n_neighbours - 1, axis=1)[:, :n_neighbours]
+        top_values = np.take_along_axis(block, top, axis=1)
+        order = np.lexsort((top, -top_values), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_values = np.take_along_axis(top_values, order, axis=1)
+
+        rows.append(np.repeat(np.arange(start, end), n_neighbours))
+        neighbours.append(top.ravel())
+        similarities.append(top_values.ravel())
+
+    if len(rows) == 0:
+        rows, neighbours, similarities = [[]], [[]], [[]]
+    rows = np.concatenate(rows).astype(int)
+    neighbours = np.concatenate(neighbours).astype(int)
+    similarities = np.concatenate(similarities)
+
+    df = pd.DataFrame(
+        {
+            "text_id": text_ids[rows],
+            "rank": np.tile(np.arange(1, n_neighbours + 1), n_docs)[: len(rows)],
+            "neighbour_text_id": text_ids[neighbours],
+            "similarity": similarities,
+        }
+    )
+    if threshold is not None:
+        df = df.loc[lambda x: x.similarity >= threshold].reset_index(drop=True)
+    return df
+
+
+def similarity_matrix_path(data_path):
+    "file of the memory-mapped full similarity matrix"
+    return f"{cache_path(data_path)}similarity_matrix.npy"
+
+
+def document_clusters_version_path(data_path):
+    "file of the similarity_matrix_version of the selection the document clusters in csv_outputs/ were made from"
+    return f"{cache_path(data_path)}document_clusters.version"
+
+
+def similarity_table_version_path(data_path):
+    "file of the version of the selection and label column the full matrix download in csv_outputs/ was written for"
+    return f"{cache_path(data_path)}text_similarity.version"
+
+
+def similarity_neighbours_version_path(data_path):
+    "file of the version of the selection, label column and parameters the top neighbours in csv_outputs/ were made for"
+    return f"{cache_path(data_path)}text_similarity_neighbours.version"
+
+
+def similarity_matrix_version(processor, text_ids):
+    "version of the full similarity matrix of a selection, changes when the selection or its texts change"
+    txt_paths = dict(
+        zip(processor.metadata.text_id, processor.metadata.local_txt_filepath)
+    )
+    return corpus_version([txt_paths[x] for x in text_ids]) + str(list(text_ids))
+
+
+def gen_similarity_matrix(processor, text_ids, tile_size=None, calculate=True):
+    """full document x document cosine similarity of the TF-IDF vectors, the same as nlp_pipeline's gen_similarity. The matrix is written tile by tile into a float32 .npy file in the corpus's cache/ directory and memory-mapped, so memory is bounded by the tile size rather than the square of the number of documents. It is reused as long as the selection and its texts do not change
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+        :text_ids: list[int]: text ids, one row and column each
+        :tile_size: int: rows and columns per tile, similarity_tile_size by default
+        :calculate: bool: whether to calculate the matrix if there is none of the selection
+    output:
+        :np.memmap: similarity matrix, or None if there is none and calculate is False
+    """
+    tile_size = tile_size if tile_size is not None else similarity_tile_size
+    version = similarity_matrix_version(processor, text_ids)
+    matrix_path = similarity_matrix_path(processor.data_path)
+    version_path = f"{matrix_path}.version"
+
+    if os.path.exists(matrix_path) and os.path.exists(version_path):
+        with open(version_path, "r") as f:
+            if f.read() == version:
+                return np.load(matrix_path, mmap_mode="r")
+    if not calculate:
+        return None
+
+    tfidf = gen_tfidf_matrix(processor, text_ids)
+    n_docs = tfidf.shape[0]
+    tmp_path = f"{matrix_path}.tmp{os.getpid()}.npy"
+    matrix = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=np.float32, shape=(n_docs, n_docs)
+    )
+
+    # the matrix is symmetric, each tile above the diagonal is also written transposed below it
+    for row in range(0, n_docs, tile_size):
+        rows = tfidf[row : row + tile_size]
+        for column in range(row, n_docs, tile_size):
+            tile = (rows @ tfidf[column : column + tile_size].T).toarray()
+            matrix[row : row + tile_size, column : column + tile_size] = tile
+            if column != row:
+                matrix[column : column + tile_size, row : row + tile_size] = tile.T
+    matrix.flush()
+    del matrix
+
+    os.replace(tmp_path, matrix_path)
+    with open(version_path, "w") as f:
+        f.write(version)
+    return np.load(matrix_path, mmap_mode="r")
+
+
+def write_similarity_table(matrix, labels, label_column, file_path, block_rows=1000):
+    "write a similarity matrix with a label column and labelled columns, like the text similarity data of nlp_pipeline. CSV files are written a block of rows at a time from the memory map, .xlsx files in one go"
+    if file_path.endswith(".xlsx"):
+        df = pd.DataFrame(np.asarray(matrix), columns=list(labels))
+        df.insert(0, label_column, list(labels))
+        df.to_excel(file_path, index=False)
+        return
+
+    tmp_path = f"{file_path}.tmp"
+    for start in range(0, max(len(labels), 1), block_rows):
+        df = pd.DataFrame(
+            np.asarray(matrix[start : start + block_rows]), columns=list(labels)
+        )
+        df.insert(0, label_column, list(labels[start : start + block_rows]))
+        df.to_csv(
+            tmp_path, index=False, header=(start == 0), mode="w" if start == 0 else "a"
+        )
+    os.replace(tmp_path, file_path)
+
+
+def heatmap_edges(start, end, size):
+    "boundaries of at most size blocks of nearly equal numbers of documents covering documents start to end"
+    return np.linspace(start, end, min(size, end - start) + 1).round().astype(int)
+
+
+def pooled_similarity(matrix, rows, columns, size=None):
+    """the similarity matrix, or a region of it, max-pooled to at most size x size blocks, read from the memory map a block of rows at a time. A block's value is the highest similarity between two different documents in it, so a block on the diagonal is only 1 if two of its documents are identical
+    parameters:
+        :matrix: np.memmap: similarity matrix
+        :rows: tuple[int]: start and end row of the region
+        :columns: tuple[int]: start and end column of the region
+        :size: int: largest number of blocks per axis, heatmap_resolution by default
+    output:
+        :np.ndarray: pooled similarities
+        :np.ndarray: row boundaries of the blocks
+        :np.ndarray: column boundaries of the blocks
+    """
+    size = size if size is not None else heatmap_resolution
+    row_edges = heatmap_edges(rows[0], rows[1], size)
+    column_edges = heatmap_edges(columns[0], columns[1], size)
+    column_starts = column_edges[:-1] - columns[0]
+
+    pooled = np.zeros((len(row_edges) - 1, len(column_edges) - 1), dtype=np.float32)
+    for i, (start, end) in enumerate(zip(row_edges[:-1], row_edges[1:])):
+        block = np.array(matrix[start:end, columns[0] : columns[1]], dtype=np.float32)
+        with_self = np.maximum.reduceat(block, column_starts, axis=1).max(axis=0)
+
+        # self-similarity only counts in blocks of a single document
+        diagonal = np.arange(start, end)
+        diagonal = diagonal[(diagonal >= columns[0]) & (diagonal < columns[1])]
+        block[diagonal - start, diagonal - columns[0]] = -np.inf
+        without_self = np.maximum.reduceat(block, column_starts, axis=1).max(axis=0)
+        pooled[i] = np.where(np.isneginf(without_self), with_self, without_self)
+
+    return pooled, row_edges, column_edges
+
+
+def gen_similarity_heatmap(processor, text_ids, matrix):
+    """max-pooled overview of the full similarity matrix of a selection for its heat map, stored in the corpus's cache/ directory with the matrix
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+        :text_ids: list[int]: text ids of the matrix's rows and columns
+        :matrix: np.memmap: similarity matrix from gen_similarity_matrix
+    output:
+        :np.ndarray: pooled similarities
+        :np.ndarray: row boundaries of the blocks
+        :np.ndarray: column boundaries of the blocks
+    """
+    version = similarity_matrix_version(processor, text_ids) + str(heatmap_resolution)
+    artifact_path = f"{cache_path(processor.data_path)}similarity_heatmap.npz"
+
+    cached = load_artifact(artifact_path, version)
+    if cached is not None:
+        return cached["pooled"], cached["row_edges"], cached["column_edges"]
+
+    pooled, row_edges, column_edges = pooled_similarity(
+        matrix, (0, len(text_ids)), (0, len(text_ids))
+    )
+    save_artifact(
+        artifact_path,
+        version,
+        pooled=pooled,
+        row_edges=row_edges,
+        column_edges=column_edges,
+    )
+    return pooled, row_edges, column_edges
+
+
+def heatmap_tiles(n_docs, size=None):
+    "(row start, row end, column start, column end) of the tiles of documents a heat map can zoom into, none if the whole matrix fits in one"
+    size = size if size is not None else heatmap_resolution
+    if n_docs <= size:
+        return []
+    starts = range(0, n_docs, size)
+    return [
+        (row, min(row + size, n_docs), column, min(column + size, n_docs))
+        for row in starts
+        for column in starts
+    ]
+
+
+def similarity_heatmap(pooled, row_edges, column_edges, labels, tiles=None):
+    """interactive heat map of a similarity matrix or a region of it. Rows and columns are document positions in the selection, the labels are only shown for small views so the size of the chart stays bounded
+    parameters:
+        :pooled: np.ndarray: similarities, from pooled_similarity
+        :row_edges: np.ndarray: row boundaries of the blocks
+        :column_edges: np.ndarray: column boundaries of the blocks
+        :labels: list: label of each document of the selection
+        :tiles: list[tuple]: tiles from heatmap_tiles to mark as clickable, the clickable marks are the figure's second trace
+    output:
+        :go.Figure: heat map
+    """
+    single = (np.diff(row_edges).max() == 1) and (np.diff(column_edges).max() == 1)
+    heatmap = dict(
+        z=np.round(pooled, 3),
+        x=column_edges + 0.5,
+        y=row_edges + 0.5,
+        colorscale="Reds",
+        zmin=0,
+        zmax=1,
+        colorbar=dict(title="similarity"),
+    )
+    labels = [str(x) for x in labels]
+    show_rows = single and (len(row_edges) - 1 <= heatmap_label_documents)
+    show_columns = single and (len(column_edges) - 1 <= heatmap_label_documents)
+    if show_rows and show_columns:
+        heatmap["text"] = [
+            [f"{labels[row]} and {labels[column]}" for column in column_edges[:-1]]
+            for row in row_edges[:-1]
+        ]
+        heatmap["hovertemplate"] = "%{text}: %{z}<extra></extra>"
+    elif single:
+        heatmap["hovertemplate"] = "documents %{y} and %{x}: %{z}<extra></extra>"
+    else:
+        heatmap["hovertemplate"] = (
+            "documents around %{y} and %{x}: highest similarity %{z}<extra></extra>"
+        )
+
+    fig = go.Figure(go.Heatmap(**heatmap))
+
+    # a transparent square over each tile that can be clicked to zoom into it
+    if tiles:
+        n_tiles = int(np.sqrt(len(tiles)))
+        fig.add_trace(
+            go.Scatter(
+                x=[(x[2] + x[3]) / 2 + 0.5 for x in tiles],
+                y=[(x[0] + x[1]) / 2 + 0.5 for x in tiles],
+                mode="markers",
+                marker=dict(
+                    symbol="square",
+                    size=max(560 // n_tiles, 8),
+                    color="rgba(0, 0, 0, 0)",
+                    line=dict(width=1, color="rgba(0, 0, 0, 0.2)"),
+                ),
+                text=[
+                    f"documents {x[0] + 1}-{x[1]} and {x[2] + 1}-{x[3]}" for x in tiles
+                ],
+                hovertemplate="click to zoom into %{text}<extra></extra>",
+                showlegend=False,
+            )
+        )
+
+    if show_rows:
+        fig.update_yaxes(
+            tickvals=row_edges[:-1] + 1, ticktext=[labels[x] for x in row_edges[:-1]]
+        )
+    if show_columns:
+        fig.update_xaxes(
+            tickvals=column_edges[:-1] + 1,
+            ticktext=[labels[x] for x in column_edges[:-1]],
+        )
+    fig.update_yaxes(autorange="reversed")
+    fig.update_layout(height=700, xaxis_title="", yaxis_title="")
+    return fig
+
+
+def gen_similarity_projection(processor, fit=True):
+    """two-dimensional projection of the TF-IDF vectors of every document in the corpus, by randomized truncated SVD directly on the sparse matrix. Fitted once per version of the corpus's texts and stored in the cache/ directory, so other selections and labels only look rows up
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+        :fit: bool: whether to fit the projection if there is none of the current texts
+    output:
+        :np.ndarray: text id of each row
+        :np.ndarray: number of documents x 2 coordinates
+        or None if there is no projection and fit is False
+    """
+    text_ids = list(processor.metadata.text_id.values)
+    version = corpus_version(
+        [str(x) for x in processor.metadata.local_txt_filepath.values]
+    )
+    artifact_path = f"{cache_path(processor.data_path)}similarity_projection.npz"
+
+    cached = load_artifact(artifact_path, version)
+    if cached is not None:
+        return cached["text_ids"], cached["coordinates"]
+    if not fit:
+        return None
+
+    tfidf = gen_tfidf_matrix(processor, text_ids)
+    n_components = max(min(2, tfidf.shape[1] - 1, tfidf.shape[0]), 0)
+    coordinates = np.zeros((len(text_ids), 2))
+    if n_components > 0:
+        coordinates[:, :n_components] = TruncatedSVD(
+            n_components=n_components, algorithm="randomized", random_state=42
+        ).fit_transform(tfidf)
+
+    save_artifact(
+        artifact_path, version, text_ids=np.array(text_ids), coordinates=coordinates
+    )
+    return np.array(text_ids), coordinates
+
+
+def similarity_cluster_df(projection, text_ids, groups):
+    """cluster plot data of a selection of documents from the corpus's projection
+    parameters:
+        :projection: tuple: text ids and coordinates from gen_similarity_projection
+        :text_ids: list[int]: text ids of the selection
+        :groups: list: group of each text id, documents without a group are left out
+    output:
+        :pd.DataFrame: with columns `text_id`, `group`, `pc1` and `pc2`
+    """
+    projection_ids, coordinates = projection
+    rows = pd.Index(projection_ids).get_indexer(text_ids)
+    keep = np.flatnonzero((rows >= 0) & pd.notna(pd.Series(groups)).values)
+    return pd.DataFrame(
+        {
+            "text_id": np.array(text_ids)[keep],
+            "group": np.array(groups, dtype=object)[keep],
+            "pc1": coordinates[rows[keep], 0],
+            "pc2": coordinates[rows[keep], 1],
+        }
+    )
+
+
+def cluster_documents(tfidf, terms, n_clusters, n_terms=10, batch_size=None):
+    """cluster documents by their TF-IDF vectors with minibatch k-means directly on the sparse matrix. Only a minibatch of documents and the cluster centres are worked on at a time, so time and memory grow linearly with the number of documents
+    parameters:
+        :tfidf: sparse.csr_matrix: document x term TF-IDF with unit length rows
+        :terms: list[str]: term of each column
+        :n_clusters: int: number of clusters, at most the number of documents
+        :n_terms: int: number of top terms to list per cluster
+        :batch_size: int: documents per minibatch, cluster_batch_size by default
+    output:
+        :np.ndarray: cluster of each document, numbered from 1 by descending size
+        :pd.DataFrame: with columns `cluster`, `n_documents` and `top_terms`, the terms with the highest weight in the cluster's centre
+    """
+    batch_size = batch_size if batch_size is not None else cluster_batch_size
+    n_clusters = max(min(n_clusters, tfidf.shape[0]), 1)
+    if tfidf.shape[0] == 0:
+        return np.array([], dtype=int), pd.DataFrame(
+            columns=["cluster", "n_documents", "top_terms"]
+        )
+
+    kmeans = MiniBatchKMeans(
+        n_clusters=n_clusters, batch_size=batch_size, n_init=3, random_state=42
+    ).fit(tfidf)
+
+    # clusters numbered by descending size
+    sizes = np.bincount(kmeans.labels_, minlength=n_clusters)
+    order = np.argsort(-sizes, kind="stable")
+    numbers = np.empty(n_clusters, dtype=int)
+    numbers[order] = np.arange(1, n_clusters + 1)
+
+    terms = np.array(terms, dtype=object)
+    top_terms = []
+    for centre in kmeans.cluster_centers_[order]:
+        top = np.argsort(-centre, kind="stable")[:n_terms]
+        top_terms.append(", ".join(terms[top[centre[top] > 0]]))
+
+    return numbers[kmeans.labels_], pd.DataFrame(
+        {
+            "cluster": np.arange(1, n_clusters + 1),
+            "n_documents": sizes[order],
+            "top_terms": top_terms,
+        }
+    )
@@ -5,7 +5,9 @@ import streamlit as st
 import sys
 
 from helper.text_transformation import initialize_processor
+from helper.near_duplicates import excluded_text_ids
 from helper.progress_bar import Logger
+from helper.summary_stats import gen_summary_stats_fused
 
 
 # gen summary statistics csv
@@ -29,6 +31,12 @@ def gen_summary_statistics():
         with st.spinner("Loading corpus..."):
             processor = initialize_processor()
 
+        st.session_state["parallel_summary"] = st.checkbox(
+            "Parallel summary statistics",
+            value=False,
+            help="Calculate the statistics of the documents in several processes at once. The statistics are the same, but large corpora are processed faster on servers with several CPU cores.",
+        )
+
         # run button
         st.session_state["run_summary_button"] = st.button(
             "Generate summary statistics",
@@ -36,15 +44,22 @@ def gen_summary_statistics():
         )
 
         if st.session_state["run_summary_button"]:
-            # generate the CSV first with all text ids regardless
+            # generate the CSV first with all text ids but the excluded near-duplicates
             with st.spinner("Generating summary statistics..."):
                 # intialize progress bar in case necessary
                 old_stdout = sys.stdout
                 sys.stdout = Logger(st.progress(0), st.empty())
 
-                processor.gen_summary_stats_csv(
-                    text_ids=list(processor.metadata.text_id.values),
+                excluded = excluded_text_ids(processor.data_path)
+                gen_summary_stats_fused(
+                    processor,
+                    text_ids=[
+                        x
+                        for x in processor.metadata.text_id.values
+                        if x not in excluded
+                    ],
                     path_prefix="transformed",
+                    parallel=st.session_state["parallel_summary"],
                 )
             st.info("Summary statistics successfully calculated!")
 
@@ -0,0 +1,582 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from helper.corpus_cache import (
+    cache_path,
+    file_fingerprint,
+    file_hash,
+    read_artifact,
+    save_artifact,
+)
+from helper.token_store import (
+    delta_token_store,
+    doc_rows,
+    doc_tokens,
+    load_tokens,
+    text_file_paths,
+)
+
+# number of documents per task
+document_batch_size = 64
+
+# number of words looked up per Zipf frequency task
+zipf_batch_size = 5000
+
+# columns of transformed_summary_stats.csv
+summary_columns = [
+    "n_words",
+    "n_unique_words",
+    "n_sentences",
+    "n_pages",
+    "avg_word_length",
+    "avg_word_incidence",
+    "num_chars_numeric",
+    "num_chars_alpha",
+    "numeric_proportion",
+]
+
+# columns of transformed_summary_stats.csv that are counts
+integer_columns = [
+    "n_words",
+    "n_unique_words",
+    "n_sentences",
+    "n_pages",
+    "num_chars_numeric",
+    "num_chars_alpha",
+]
+
+# character classes of single bytes, ASCII only. Vocabulary entries with other characters are classified per character
+digit_lut = np.array([bytes([x]).isdigit() for x in range(256)], dtype=np.int64)
+alpha_lut = np.array([bytes([x]).isalpha() for x in range(256)], dtype=np.int64)
+non_ascii_lut = np.array([x >= 128 for x in range(256)], dtype=np.int64)
+
+# arrays of the token stores a process has opened, by store path
+worker_stores = {}
+
+
+def vocab_tables(store):
+    """characters, digits, letters and `[newpage]` markers of each vocabulary entry of a token store, rows in that order. Counted with byte lookup tables over the whole vocabulary at once and kept in the store's directory
+    parameters:
+        :store: dict: token store from gen_token_store
+    output:
+        :np.ndarray: 4 x vocabulary size counts
+    """
+    table_path = f"{store['path']}vocab_tables.npy"
+    if os.path.exists(table_path):
+        return np.load(table_path)
+
+    blob = np.fromfile(f"{store['path']}vocab.bin", dtype=np.uint8)
+    offsets = np.load(f"{store['path']}vocab_offsets.npy")
+
+    def per_entry(lut):
+        totals = np.concatenate([[0], np.cumsum(lut[blob], dtype=np.int64)])
+        return totals[offsets[1:]] - totals[offsets[:-1]]
+
+    n_digits = per_entry(digit_lut)
+    n_alpha = per_entry(alpha_lut)
+    for i in np.flatnonzero(per_entry(non_ascii_lut)):
+        n_digits[i] = sum(c.isdigit() for c in store["vocab"][i])
+        n_alpha[i] = sum(c.isalpha() for c in store["vocab"][i])
+    n_newpage = np.fromiter(
+        (x.count("[newpage]") for x in store["vocab"]),
+        dtype=np.int64,
+        count=len(store["vocab"]),
+    )
+
+    tables = np.stack([store["token_lengths"], n_digits, n_alpha, n_newpage])
+    np.save(f"{table_path}.tmp{os.getpid()}.npy", tables)
+    os.replace(f"{table_path}.tmp{os.getpid()}.npy", table_path)
+    return tables
+
+
+def open_store_arrays(store_path):
+    "token ids, offsets and vocabulary tables of a token store, opened once per process and version of the store"
+    with open(f"{store_path}version.txt", "r") as f:
+        version = f.read()
+    if worker_stores.get(store_path, {}).get("version") != version:
+        doc_offsets = np.load(f"{store_path}doc_offsets.npy")
+        worker_stores[store_path] = {
+            "version": version,
+            "tokens": load_tokens(store_path, doc_offsets[-1]),
+            "doc_offsets": doc_offsets,
+            "sentence_offsets": np.load(f"{store_path}sentence_offsets.npy"),
+            "sentence_doc_offsets": np.load(f"{store_path}sentence_doc_offsets.npy"),
+            "tables": np.load(f"{store_path}vocab_tables.npy"),
+        }
+    return worker_stores[store_path]
+
+
+def zipf_table_path(store_path, language):
+    "file of the Zipf frequencies of a token store's vocabulary in a language"
+    return f"{store_path}zipf_{language}.npy"
+
+
+def zipf_cache_path(data_path, language):
+    "file of every Zipf frequency looked up in a language, by word"
+    path = f"{cache_path(data_path)}zipf/"
+    os.makedirs(path, exist_ok=True)
+    return f"{path}{language}.json"
+
+
+def word_frequencies(get_word_frequency, words, language):
+    "Zipf frequencies of a list of words"
+    return [get_word_frequency(x, language) for x in words]
+
+
+def iter_word_frequencies(get_word_frequency, words, language, parallel, max_workers):
+    "(start, frequencies) of batches of words, in this process or in worker processes, in the order the batches finish"
+    starts = range(0, len(words), zipf_batch_size)
+    if not parallel:
+        for start in starts:
+            yield start, word_frequencies(
+                get_word_frequency, words[start : start + zipf_batch_size], language
+            )
+        return
+
+    max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                word_frequencies,
+                get_word_frequency,
+                words[start : start + zipf_batch_size],
+                language,
+            ): start
+            for start in starts
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def gen_zipf_table(
+    processor, store, language, word_ids, parallel=False, max_workers=None
+):
+    """Zipf frequency of each vocabulary entry of a token store in a language, as an array indexed by token id and kept in the store's directory, NaN for entries not looked up. Only the entries of word_ids that are still NaN are looked up, and every lookup is also kept by word in the corpus's cache/zipf/ directory, so rebuilding the store does not look words up again
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+        :store: dict: token store of the original texts from gen_token_store
+        :language: str: language of the documents
+        :word_ids: np.ndarray: token ids that need a frequency
+        :parallel: bool: whether to look the words up in worker processes
+        :max_workers: int: number of worker processes, defaults to the number of CPUs
+    output:
+        :np.ndarray: Zipf frequency of each token id
+    """
+    table_path = zipf_table_path(store["path"], language)
+    cache_file = zipf_cache_path(processor.data_path, language)
+    cached = None
+
+    if os.path.exists(table_path):
+        table = np.load(table_path)
+    else:
+        cached = read_zipf_cache(cache_file)
+        table = np.fromiter(
+            (cached.get(x, np.nan) for x in store["vocab"]),
+            dtype=np.float64,
+            count=len(store["vocab"]),
+        )
+
+    missing = word_ids[np.isnan(table[word_ids])]
+    for start, frequencies in iter_word_frequencies(
+        processor.text_transformation.get_word_frequency,
+        list(store["vocab"][missing]),
+        language,
+        parallel,
+        max_workers,
+    ):
+        table[missing[start : start + len(frequencies)]] = frequencies
+
+    if (len(missing) > 0) or (cached is not None):
+        if len(missing) > 0:
+            cached = cached if cached is not None else read_zipf_cache(cache_file)
+            cached.update({store["vocab"][x]: float(table[x]) for x in missing})
+            write_zipf_cache(cache_file, cached)
+        np.save(f"{table_path}.tmp{os.getpid()}.npy", table)
+        os.replace(f"{table_path}.tmp{os.getpid()}.npy", table_path)
+
+    return table
+
+
+def read_zipf_cache(cache_file):
+    "Zipf frequencies looked up before, by word"
+    try:
+        with open(cache_file, "r", encoding="UTF-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_zipf_cache(cache_file, cached):
+    "store the Zipf frequencies looked up in a language, by word"
+    with open(f"{cache_file}.tmp", "w", encoding="UTF-8") as f:
+        json.dump(cached, f, ensure_ascii=False)
+    os.replace(f"{cache_file}.tmp", cache_file)
+
+
+def text_word_frequencies(processor, words, language, parallel=False, max_workers=None):
+    "Zipf frequencies of a set of words in a language by word, looked up at most once per word and kept in the corpus's cache/zipf/ directory like those of gen_zipf_table"
+    cache_file = zipf_cache_path(processor.data_path, language)
+    cached = read_zipf_cache(cache_file)
+    missing = [x for x in words if x not in cached]
+    for start, frequencies in iter_word_frequencies(
+        processor.text_transformation.get_word_frequency,
+        missing,
+        language,
+        parallel,
+        max_workers,
+    ):
+        cached.update(zip(missing[start : start + len(frequencies)], frequencies))
+    if len(missing) > 0:
+        write_zipf_cache(cache_file, cached)
+    return cached
+
+
+def read_text(file_path):
+    "a text file, empty if it does not exist"
+    try:
+        with open(file_path, "r", encoding="UTF-8") as file:
+            return file.read()
+    except FileNotFoundError:
+        return ""
+
+
+def text_document_stats(transformed_file, original_file, frequencies):
+    """summary statistics of a document read from its own texts, the same counts as document_stats gets from the token stores
+    parameters:
+        :transformed_file: str: path of the transformed text
+        :original_file: str: path of the original text
+        :frequencies: dict: Zipf frequency of every word of the original text in its language
+    output:
+        :dict: counts of the document
+    """
+    stringx = read_text(transformed_file)
+    original = read_text(original_file)
+    words = [x for x in stringx.split(" ") if len(x) > 1]
+    original_words = [x for x in original.split(" ") if len(x) > 1]
+    return {
+        "n_words": len(words),
+        "n_unique_words": len(set(words)),
+        "n_sentences": len([x for x in stringx.split("|") if len(x) > 2]),
+        "n_pages": original.count("[newpage]"),
+        "n_original_words": len(original_words),
+        "word_length_sum": sum(len(x) for x in original_words),
+        "word_incidence_sum": float(
+            np.sum([frequencies[x] for x in original_words], dtype=np.float64)
+        ),
+        "num_chars_numeric": sum(c.isdigit() for c in stringx),
+        "num_chars_alpha": sum(c.isalpha() for c in stringx),
+    }
+
+
+def document_stats(transformed_path, original_path, rows, languages):
+    """summary statistics of documents from their token ids, every statistic of a document from one slice of its tokens
+    parameters:
+        :transformed_path: str: directory of the token store of the transformed texts
+        :original_path: str: directory of the token store of the original texts
+        :rows: list[int]: rows of the documents in both token stores
+        :languages: list[str]: language of each document, its Zipf table from gen_zipf_table must cover the document's words
+    output:
+        :list[dict]: counts of each document
+    """
+    transformed = open_store_arrays(transformed_path)
+    original = open_store_arrays(original_path)
+    lengths, n_digits, n_alpha, _ = transformed["tables"]
+    original_lengths, _, _, n_newpage = original["tables"]
+
+    zipf_tables = {
+        x: np.load(zipf_table_path(original_path, x), mmap_mode="r")
+        for x in set(languages)
+    }
+
+    results = []
+    for i, language in zip(rows, languages):
+        # transformed text
+        tokens = np.asarray(
+            transformed["tokens"][
+                transformed["doc_offsets"][i] : transformed["doc_offsets"][i + 1]
+            ]
+        )
+        token_lengths = lengths[tokens]
+        words = tokens[token_lengths > 1]
+        n_chars = int(token_lengths.sum()) + max(len(tokens) - 1, 0)
+        pipes = transformed["sentence_offsets"][
+            transformed["sentence_doc_offsets"][i] : transformed[
+                "sentence_doc_offsets"
+            ][i + 1]
+        ]
+        sentence_lengths = np.diff(np.concatenate([[-1], pipes, [n_chars]])) - 1
+
+        # original text
+        original_tokens = np.asarray(
+            original["tokens"][
+                original["doc_offsets"][i] : original["doc_offsets"][i + 1]
+            ]
+        )
+        original_token_lengths = original_lengths[original_tokens]
+        original_words = original_tokens[original_token_lengths > 1]
+
+        results.append(
+            {
+                "n_words": len(words),
+                "n_unique_words": len(np.unique(words)),
+                "n_sentences": int((sentence_lengths > 2).sum()),
+                "n_pages": int(n_newpage[original_tokens].sum()),
+                "n_original_words": len(original_words),
+                "word_length_sum": int(original_lengths[original_words].sum()),
+                "word_incidence_sum": float(
+                    zipf_tables[language][original_words].sum()
+                ),
+                "num_chars_numeric": int(n_digits[tokens].sum()),
+                "num_chars_alpha": int(n_alpha[tokens].sum()),
+            }
+        )
+    return results
+
+
+def summary_store_path(data_path, path_prefix):
+    "file of the stored statistics and text fingerprints of every document"
+    return f"{cache_path(data_path)}{path_prefix}_summary_stats.npz"
+
+
+def gen_summary_stats_fused(
+    processor, text_ids, path_prefix, parallel=False, max_workers=None
+):
+    """summary statistics like nlp_pipeline's gen_summary_stats_csv, maintained incrementally. The statistics of every document are stored in the corpus's cache/ directory with the size, modification time and hash of its transformed and original texts. Only new documents and documents whose texts changed are calculated, documents that were deleted or lost their transformed text are removed, and the CSV is rewritten from the store
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+        :text_ids: list[int]: text ids to calculate statistics for
+        :path_prefix: str: prefix of the files in the transformed_txt_files/ directory
+        :parallel: bool: whether to calculate in worker processes
+        :max_workers: int: number of worker processes, defaults to the number of CPUs
+    """
+    csv_path = f"{processor.data_path}csv_outputs/{path_prefix}_summary_stats.csv"
+    store_path = summary_store_path(processor.data_path, path_prefix)
+    corpus_ids = list(processor.metadata.text_id.values)
+    text_paths = dict(
+        zip(corpus_ids, text_file_paths(processor.data_path, corpus_ids, path_prefix))
+    )
+    original_paths = dict(
+        zip(corpus_ids, text_file_paths(processor.data_path, corpus_ids, "original"))
+    )
+
+    # stored statistics of documents still in the corpus with a transformed text
+    stored = read_artifact(store_path)
+    entries = {}
+    if stored is not None:
+        for i, text_id in enumerate(stored["text_ids"].tolist()):
+            if (text_id in text_paths) and os.path.exists(text_paths[text_id]):
+                entries[text_id] = {
+                    "fingerprint": tuple(stored["fingerprints"][i].tolist()),
+                    "hashes": tuple(stored["hashes"][i].tolist()),
+                    "stats": stored["stats"][i],
+                }
+
+    # documents without stored statistics of their current texts
+    to_calculate = {}
+    for text_id in text_ids:
+        if (text_id not in text_paths) or not os.path.exists(text_paths[text_id]):
+            continue
+        fingerprint = file_fingerprint(text_paths[text_id]) + file_fingerprint(
+            original_paths[text_id]
+        )
+        entry = entries.get(text_id)
+        if (entry is not None) and (entry["fingerprint"] == fingerprint):
+            continue
+
+        hashes = (file_hash(text_paths[text_id]), file_hash(original_paths[text_id]))
+        if (entry is not None) and (entry["hashes"] == hashes):
+            entry["fingerprint"] = fingerprint
+        else:
+            to_calculate[text_id] = {"fingerprint": fingerprint, "hashes": hashes}
+
+    for text_id, stats in calculate_summary_stats(
+        processor, list(to_calculate), path_prefix, parallel, max_workers
+    ).items():
+        entries[text_id] = {**to_calculate[text_id], "stats": np.array(stats)}
+
+    # storing
+    store_ids = [x for x in corpus_ids if x in entries]
+    save_artifact(
+        store_path,
+        "summary_stats",
+        text_ids=np.array(store_ids),
+        fingerprints=np.array(
+            [entries[x]["fingerprint"] for x in store_ids], dtype=np.int64
+        ).reshape(-1, 4),
+        hashes=np.array([entries[x]["hashes"] for x in store_ids], dtype="U32").reshape(
+            -1, 2
+        ),
+        stats=np.array(
+            [entries[x]["stats"] for x in store_ids], dtype=np.float64
+        ).reshape(-1, len(summary_columns)),
+    )
+
+    # writing to CSV, counts as whole numbers and empty for documents without statistics
+    csv = pd.DataFrame({"text_id": corpus_ids})
+    for j, column in enumerate(summary_columns):
+        values = np.full(len(corpus_ids), None, dtype=object)
+        for i, text_id in enumerate(corpus_ids):
+            if text_id in entries:
+                value = entries[text_id]["stats"][j]
+                values[i] = int(value) if column in integer_columns else float(value)
+        csv[column] = values
+    csv.to_csv(csv_path, index=False)
+
+
+def calculate_summary_stats(processor, text_ids, path_prefix, parallel, max_workers):
+    """summary statistics of documents, from the corpus's shared token stores of the transformed and original texts. The vocabulary tables and Zipf tables are kept in the stores' directories, so they are reused by later runs until the texts change. If the stores are of older texts and only a few documents changed, the documents are read from their own texts instead of rebuilding the stores
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+        :text_ids: list[int]: text ids to calculate statistics for
+        :path_prefix: str: prefix of the files in the transformed_txt_files/ directory
+        :parallel: bool: whether to calculate in worker processes
+        :max_workers: int: number of worker processes, defaults to the number of CPUs
+    output:
+        :dict: statistics of each text id, in the order of summary_columns
+    """
+    results = {}
+    if len(text_ids) == 0:
+        return results
+
+    languages = {
+        text_id: str(language)
+        for text_id, language in zip(
+            processor.metadata.text_id, processor.metadata.detected_language
+        )
+    }
+
+    # both stores have the corpus's documents in the same order
+    corpus_ids = list(processor.metadata.text_id.values)
+    transformed = delta_token_store(
+        processor.data_path, corpus_ids, path_prefix, len(text_ids)
+    )
+    original = delta_token_store(
+        processor.data_path, corpus_ids, "original", len(text_ids)
+    )
+    if (transformed is None) or (original is None):
+        for text_id, x in iter_text_stats(
+            processor, text_ids, path_prefix, languages, parallel, max_workers
+        ):
+            results[text_id] = summary_row(x)
+            print(f"getting word and sentence count: {len(results)}/{len(text_ids)}")
+        return results
+
+    vocab_tables(transformed)
+    vocab_tables(original)
+    rows = doc_rows(transformed)
+
+    # Zipf frequencies of the words of each language's documents, looked up at most once per word
+    for language in set(languages[x] for x in text_ids):
+        used = np.zeros(len(original["vocab"]), dtype=bool)
+        for text_id in text_ids:
+            if languages[text_id] == language:
+                used[doc_tokens(original, rows[text_id])] = True
+        word_ids = np.flatnonzero(used & (original["token_lengths"] > 1))
+        gen_zipf_table(processor, original, language, word_ids, parallel, max_workers)
+
+    batches = [
+        text_ids[i : i + document_batch_size]
+        for i in range(0, len(text_ids), document_batch_size)
+    ]
+    for batch, stats in iter_document_stats(
+        transformed["path"],
+        original["path"],
+        [[rows[x] for x in batch] for batch in batches],
+        [[languages[x] for x in batch] for batch in batches],
+        batches,
+        parallel,
+        max_workers,
+    ):
+        for text_id, x in zip(batch, stats):
+            results[text_id] = summary_row(x)
+        print(f"getting word and sentence count: {len(results)}/{len(text_ids)}")
+
+    return results
+
+
+def iter_text_stats(processor, text_ids, path_prefix, languages, parallel, max_workers):
+    "(text id, text_document_stats) of each document, read from its own texts. The Zipf frequencies of the words of each language's documents are looked up first, at most once per word"
+    transformed_paths = dict(
+        zip(text_ids, text_file_paths(processor.data_path, text_ids, path_prefix))
+    )
+    original_paths = dict(
+        zip(text_ids, text_file_paths(processor.data_path, text_ids, "original"))
+    )
+
+    frequencies = {}
+    for language in set(languages[x] for x in text_ids):
+        words = set()
+        for text_id in text_ids:
+            if languages[text_id] == language:
+                words.update(
+                    x
+                    for x in read_text(original_paths[text_id]).split(" ")
+                    if len(x) > 1
+                )
+        frequencies[language] = text_word_frequencies(
+            processor, sorted(words), language, parallel, max_workers
+        )
+
+    for text_id in text_ids:
+        yield text_id, text_document_stats(
+            transformed_paths[text_id],
+            original_paths[text_id],
+            frequencies[languages[text_id]],
+        )
+
+
+def summary_row(x):
+    "the summary_columns of a document from its document_stats counts"
+    try:
+        avg_word_length = x["word_length_sum"] / x["n_original_words"]
+    except:
+        avg_word_length = 0
+    try:
+        avg_word_incidence = x["word_incidence_sum"] / x["n_original_words"]
+    except:
+        avg_word_incidence = 0
+
+    # at least one letter in the denominator, so documents without characters have a proportion of 0
+    return (
+        x["n_words"],
+        x["n_unique_words"],
+        x["n_sentences"],
+        x["n_pages"],
+        avg_word_length,
+        avg_word_incidence,
+        x["num_chars_numeric"],
+        x["num_chars_alpha"],
+        x["num_chars_numeric"]
+        / (x["num_chars_numeric"] + max(x["num_chars_alpha"], 1)),
+    )
+
+
+def iter_document_stats(
+    transformed_path,
+    original_path,
+    row_batches,
+    language_batches,
+    keys,
+    parallel,
+    max_workers,
+):
+    "(key, document_stats) of each batch of rows, in this process or in worker processes, in the order the batches finish"
+    if not parallel:
+        for key, rows, languages in zip(keys, row_batches, language_batches):
+            yield key, document_stats(transformed_path, original_path, rows, languages)
+        return
+
+    max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                document_stats, transformed_path, original_path, rows, languages
+            ): key
+            for key, rows, languages in zip(keys, row_batches, language_batches)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
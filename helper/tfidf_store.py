@@ -0,0 +1,208 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from helper.corpus_cache import (
+    cache_path,
+    corpus_version,
+    file_fingerprint,
+    file_hash,
+    read_artifact,
+    save_artifact,
+)
+
+
+def tfidf_store_path(data_path):
+    "file of the stored term counts and document frequencies of every document"
+    return f"{cache_path(data_path)}tfidf_counts.npz"
+
+
+def encode_terms(terms):
+    "terms as one UTF-8 byte array and offsets, long terms don't pad every entry like a fixed-width string array"
+    encoded = [x.encode("UTF-8") for x in terms]
+    return (
+        np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        np.concatenate([[0], np.cumsum([len(x) for x in encoded], dtype=np.int64)]),
+    )
+
+
+def decode_terms(blob, offsets):
+    "terms encoded by encode_terms"
+    blob = blob.tobytes()
+    return [
+        blob[start:end].decode("UTF-8") for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def read_text(file_path):
+    "an original text, empty if there is no text file, like the texts nlp_pipeline's gen_similarity vectorizes"
+    try:
+        with open(file_path, "r", encoding="UTF-8") as file:
+            return file.read()
+    except (FileNotFoundError, TypeError):
+        return ""
+
+
+def gen_tfidf_store(processor):
+    """term counts of the original text of every document in the corpus and the document frequency of every term, tokenized like nlp_pipeline's gen_similarity and stored in the corpus's cache/ directory. Only new documents and documents whose texts changed are tokenized, the counts of documents that were removed from the corpus are dropped and the document frequencies are updated from the counts
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+    output:
+        :dict: with entries:
+            :text_ids: np.ndarray: text id of each document
+            :terms: list[str]: the vocabulary, in alphabetical order
+            :counts: sparse.csr_matrix: document x term counts
+            :df: np.ndarray: number of documents each term appears in
+    """
+    store_path = tfidf_store_path(processor.data_path)
+    txt_paths = dict(
+        zip(
+            processor.metadata.text_id.values,
+            [str(x) for x in processor.metadata.local_txt_filepath.values],
+        )
+    )
+    corpus_ids = list(txt_paths)
+    version = corpus_version([txt_paths[x] for x in corpus_ids]) + str(corpus_ids)
+
+    stored = read_artifact(store_path)
+    if stored is not None:
+        terms = decode_terms(stored["terms"], stored["term_offsets"])
+        if str(stored["version"]) == version:
+            return {
+                "text_ids": stored["text_ids"],
+                "terms": terms,
+                "counts": sparse.csr_matrix(
+                    (stored["data"], stored["indices"], stored["indptr"]),
+                    shape=(len(stored["text_ids"]), len(terms)),
+                ),
+                "df": stored["df"],
+            }
+        stored_rows = {x: i for i, x in enumerate(stored["text_ids"].tolist())}
+    else:
+        terms = []
+        stored_rows = {}
+
+    # documents without stored counts of their current text
+    fingerprints, hashes, keep, to_tokenize = {}, {}, {}, []
+    for text_id in corpus_ids:
+        fingerprints[text_id] = file_fingerprint(txt_paths[text_id])
+        i = stored_rows.get(text_id)
+        if (i is not None) and (
+            tuple(stored["fingerprints"][i].tolist()) == fingerprints[text_id]
+        ):
+            hashes[text_id] = str(stored["hashes"][i])
+            keep[text_id] = i
+            continue
+
+        hashes[text_id] = file_hash(txt_paths[text_id])
+        if (i is not None) and (str(stored["hashes"][i]) == hashes[text_id]):
+            keep[text_id] = i
+        else:
+            to_tokenize.append(text_id)
+
+    # new vocabulary entries are appended, unused ones dropped when the store is sorted below
+    analyzer = TfidfVectorizer().build_analyzer()
+    term_index = {x: i for i, x in enumerate(terms)}
+    new_rows = {}
+    for counter, text_id in enumerate(to_tokenize, start=1):
+        print(f"tokenizing documents: {counter}/{len(to_tokenize)}")
+        term_counts = Counter(analyzer(read_text(txt_paths[text_id])))
+        new_rows[text_id] = (
+            np.array(
+                [term_index.setdefault(x, len(term_index)) for x in term_counts],
+                dtype=np.int64,
+            ),
+            np.array(list(term_counts.values()), dtype=np.int64),
+        )
+    terms = list(term_index)
+
+    # rows in corpus order, stored rows sliced out of the old counts
+    indices, data, lengths = [], [], []
+    for text_id in corpus_ids:
+        if text_id in keep:
+            start, end = stored["indptr"][keep[text_id] : keep[text_id] + 2]
+            row_indices = stored["indices"][start:end].astype(np.int64)
+            row_data = stored["data"][start:end]
+        else:
+            row_indices, row_data = new_rows[text_id]
+        indices.append(row_indices)
+        data.append(row_data)
+        lengths.append(len(row_indices))
+    indices = np.concatenate(indices or [[]]).astype(np.int64)
+    data = np.concatenate(data or [[]]).astype(np.int64)
+    indptr = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+
+    # vocabulary of the terms still in use in alphabetical order, the column order of TfidfVectorizer
+    df = np.bincount(indices, minlength=len(terms))
+    used = np.flatnonzero(df > 0)
+    used = used[np.argsort(np.array(terms, dtype=object)[used], kind="stable")]
+    remap = np.full(len(terms), -1, dtype=np.int64)
+    remap[used] = np.arange(len(used))
+    terms = [terms[x] for x in used]
+    counts = sparse.csr_matrix(
+        (data, remap[indices], indptr), shape=(len(corpus_ids), len(terms))
+    )
+    counts.sort_indices()
+    df = df[used]
+
+    term_blob, term_offsets = encode_terms(terms)
+    save_artifact(
+        store_path,
+        version,
+        text_ids=np.array(corpus_ids),
+        fingerprints=np.array(
+            [fingerprints[x] for x in corpus_ids], dtype=np.int64
+        ).reshape(-1, 2),
+        hashes=np.array([hashes[x] for x in corpus_ids], dtype="U32"),
+        terms=term_blob,
+        term_offsets=term_offsets,
+        indptr=counts.indptr,
+        indices=counts.indices,
+        data=counts.data,
+        df=df,
+    )
+    return {
+        "text_ids": np.array(corpus_ids),
+        "terms": terms,
+        "counts": counts,
+        "df": df,
+    }
+
+
+def tfidf_matrix(store, text_ids, return_terms=False):
+    """TF-IDF vectors of a selection of documents from their stored counts, the same as TfidfVectorizer fitted on the selection's texts. The IDF weights come from the document frequencies within the selection
+    parameters:
+        :store: dict: term counts from gen_tfidf_store
+        :text_ids: list[int]: text ids, one row each, text ids not in the store are empty documents
+        :return_terms: bool: whether to also return the term of each column
+    output:
+        :sparse.csr_matrix: document x term TF-IDF with unit length rows, terms used in the selection in alphabetical order
+        :list[str]: term of each column, if return_terms
+    """
+    rows = pd.Index(store["text_ids"]).get_indexer(list(text_ids))
+    found = np.flatnonzero(rows >= 0)
+    selection = sparse.csr_matrix(
+        (np.ones(len(found), dtype=np.int64), (found, rows[found])),
+        shape=(len(rows), len(store["text_ids"])),
+    )
+    counts = (selection @ store["counts"]).tocsr()
+
+    # the stored document frequencies are those of the whole corpus
+    if (len(rows) == len(store["text_ids"])) and (
+        np.array_equal(rows, np.arange(len(rows)))
+    ):
+        df = store["df"]
+    else:
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+
+    columns = np.flatnonzero(df > 0)
+    idf = np.log((1 + len(rows)) / (1 + df[columns])) + 1
+    tfidf = counts[:, columns].astype(np.float64) @ sparse.diags(idf)
+    tfidf = normalize(tfidf.tocsr())
+    if return_terms:
+        return tfidf, [store["terms"][x] for x in columns]
+    return tfidf
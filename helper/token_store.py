@@ -0,0 +1,233 @@
+import os
+import re
+import shutil
+
+import numpy as np
+
+from helper.corpus_cache import cache_path, corpus_version
+
+# share of a corpus's documents above which changed documents are worth rebuilding the token store for, fewer are read from their own texts
+store_rebuild_share = 0.1
+
+
+def text_file_paths(data_path, text_ids, source="transformed"):
+    "paths of the texts of a token store, `transformed` for transformed_txt_files/transformed_*.txt, `original` for txt_files/*.txt"
+    if source == "original":
+        return [f"{data_path}txt_files/{text_id}.txt" for text_id in text_ids]
+    return [
+        f"{data_path}transformed_txt_files/{source}_{text_id}.txt"
+        for text_id in text_ids
+    ]
+
+
+def tokenize_corpus(text_paths, store_path):
+    """tokenize texts once into a shared vocabulary and write the token store's arrays to store_path. Texts are split on single spaces like nlp_pipeline does everywhere, so joining a document's tokens with spaces gives back its exact text
+    parameters:
+        :text_paths: list[str]: texts to tokenize, missing files are empty documents
+        :store_path: str: directory to write the arrays to
+    """
+    vocab_index = {}
+    doc_offsets = [0]
+    sentence_offsets = []
+    sentence_doc_offsets = [0]
+
+    os.makedirs(store_path, exist_ok=True)
+    with open(f"{store_path}tokens.bin", "wb") as tokens_file:
+        for counter, text_path in enumerate(text_paths, start=1):
+            print(f"tokenizing documents: {counter}/{len(text_paths)}")
+
+            if os.path.exists(text_path):
+                with open(text_path, "r", encoding="UTF-8") as file:
+                    stringx = file.read()
+                ids = np.fromiter(
+                    (
+                        vocab_index.setdefault(x, len(vocab_index))
+                        for x in stringx.split(" ")
+                    ),
+                    dtype=np.int32,
+                )
+                sentence_offsets += [x.start() for x in re.finditer(r"\|", stringx)]
+            else:
+                ids = np.array([], dtype=np.int32)
+
+            tokens_file.write(ids.tobytes())
+            doc_offsets.append(doc_offsets[-1] + len(ids))
+            sentence_doc_offsets.append(len(sentence_offsets))
+
+    # vocabulary as one UTF-8 blob and offsets, long tokens don't pad every entry like a fixed-width string array
+    encoded = [x.encode("UTF-8") for x in vocab_index]
+    with open(f"{store_path}vocab.bin", "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(
+        f"{store_path}vocab_offsets.npy",
+        np.concatenate([[0], np.cumsum([len(x) for x in encoded], dtype=np.int64)]),
+    )
+    np.save(
+        f"{store_path}token_lengths.npy",
+        np.array([len(x) for x in vocab_index], dtype=np.int64),
+    )
+    np.save(f"{store_path}doc_offsets.npy", np.array(doc_offsets, dtype=np.int64))
+    np.save(
+        f"{store_path}sentence_offsets.npy", np.array(sentence_offsets, dtype=np.int64)
+    )
+    np.save(
+        f"{store_path}sentence_doc_offsets.npy",
+        np.array(sentence_doc_offsets, dtype=np.int64),
+    )
+
+
+def gen_token_store(data_path, text_ids, source="transformed"):
+    """the corpus's token store, tokenized once per version of the texts and stored in the cache/ directory. Token ids are memory-mapped rather than read into memory
+    parameters:
+        :data_path: str: processor.data_path of the corpus
+        :text_ids: list[int]: text ids of the corpus, one document each
+        :source: str: `transformed` (or another transformed_txt_files/ prefix) or `original`
+    output:
+        :dict: with entries:
+            :path: str: directory of the store, files derived from the store can be kept there and go away with it
+            :text_ids: np.ndarray: text id of each document
+            :vocab: np.ndarray: the vocabulary, as an object array of str
+            :token_lengths: np.ndarray: number of characters of each vocabulary entry
+            :tokens: np.ndarray: token ids of all documents one after the other
+            :doc_offsets: np.ndarray: tokens of document i are tokens[doc_offsets[i]:doc_offsets[i + 1]]
+            :sentence_offsets: np.ndarray: character offsets of the `|` sentence delimiters in each document
+            :sentence_doc_offsets: np.ndarray: delimiters of document i are sentence_offsets[sentence_doc_offsets[i]:sentence_doc_offsets[i + 1]]
+    """
+    store = current_token_store(data_path, text_ids, source)
+    if store is not None:
+        return store
+
+    # build next to the current store and swap it in, so readers never see half a store
+    text_paths = text_file_paths(data_path, text_ids, source)
+    store_path = f"{cache_path(data_path)}tokens_{source}/"
+    tmp_path = f"{cache_path(data_path)}tokens_{source}.tmp{os.getpid()}/"
+    build_token_store(text_paths, text_ids, corpus_version(text_paths), tmp_path)
+    old_path = f"{cache_path(data_path)}tokens_{source}.old{os.getpid()}/"
+    if os.path.exists(store_path):
+        os.replace(store_path, old_path)
+    os.replace(tmp_path, store_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+    return open_token_store(store_path)
+
+
+def current_token_store(data_path, text_ids, source="transformed"):
+    "the corpus's token store as gen_token_store returns it if it is of the current texts, None if it would have to be rebuilt"
+    store_path = f"{cache_path(data_path)}tokens_{source}/"
+    try:
+        with open(f"{store_path}version.txt", "r") as f:
+            current = f.read()
+    except FileNotFoundError:
+        return None
+    if current != corpus_version(text_file_paths(data_path, text_ids, source)):
+        return None
+    return open_token_store(store_path)
+
+
+def delta_token_store(data_path, text_ids, source, n_changed):
+    """the corpus's token store for working on n_changed new or changed documents. A store of older texts is only rebuilt if more than store_rebuild_share of the documents changed, so a few changed documents cost time in proportion to them rather than to the corpus
+    parameters:
+        :data_path: str: processor.data_path of the corpus
+        :text_ids: list[int]: text ids of the corpus, one document each
+        :source: str: `transformed` (or another transformed_txt_files/ prefix) or `original`
+        :n_changed: int: number of documents to work on
+    output:
+        :dict: the token store as gen_token_store returns it, None if the changed documents should be read from their own texts
+    """
+    store = current_token_store(data_path, text_ids, source)
+    if (store is None) and (n_changed > store_rebuild_share * len(text_ids)):
+        store = gen_token_store(data_path, text_ids, source)
+    return store
+
+
+def build_token_store(text_paths, text_ids, version, store_path):
+    "tokenize texts into a new token store in store_path"
+    shutil.rmtree(store_path, ignore_errors=True)
+    tokenize_corpus(text_paths, store_path)
+    np.save(f"{store_path}text_ids.npy", np.array(text_ids))
+    with open(f"{store_path}version.txt", "w") as f:
+        f.write(version)
+
+
+def open_token_store(store_path):
+    "the arrays of the token store in store_path, as returned by gen_token_store"
+    doc_offsets = np.load(f"{store_path}doc_offsets.npy")
+    return {
+        "path": store_path,
+        "text_ids": np.load(f"{store_path}text_ids.npy"),
+        "vocab": load_vocab(store_path),
+        "token_lengths": np.load(f"{store_path}token_lengths.npy"),
+        "tokens": load_tokens(store_path, doc_offsets[-1]),
+        "doc_offsets": doc_offsets,
+        "sentence_offsets": np.load(f"{store_path}sentence_offsets.npy"),
+        "sentence_doc_offsets": np.load(f"{store_path}sentence_doc_offsets.npy"),
+    }
+
+
+def load_tokens(store_path, n_tokens):
+    "memory-map the token ids of a token store"
+    if n_tokens == 0:
+        return np.array([], dtype=np.int32)
+    return np.memmap(
+        f"{store_path}tokens.bin", dtype=np.int32, mode="r", shape=(int(n_tokens),)
+    )
+
+
+def load_vocab(store_path):
+    "vocabulary of a token store"
+    with open(f"{store_path}vocab.bin", "rb") as f:
+        blob = f.read()
+    offsets = np.load(f"{store_path}vocab_offsets.npy")
+    vocab = np.empty(len(offsets) - 1, dtype=object)
+    vocab[:] = [
+        blob[start:end].decode("UTF-8") for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+    return vocab
+
+
+def doc_rows(store):
+    "row of each text id in the token store"
+    return {text_id: i for i, text_id in enumerate(store["text_ids"].tolist())}
+
+
+def doc_tokens(store, i):
+    "token ids of document i"
+    return store["tokens"][store["doc_offsets"][i] : store["doc_offsets"][i + 1]]
+
+
+def doc_token_starts(store, i):
+    "character offset of each token of document i in its text"
+    widths = store["token_lengths"][doc_tokens(store, i)] + 1
+    return np.cumsum(widths) - widths
+
+
+def doc_substrings(store, i, starts, ends):
+    "the text of character spans of document i, only the tokens a span covers are turned back into text"
+    tokens = doc_tokens(store, i)
+    token_starts = doc_token_starts(store, i)
+    first = np.maximum(np.searchsorted(token_starts, starts, side="right") - 1, 0)
+    last = np.searchsorted(token_starts, ends, side="left")
+    substrings = []
+    for start, end, a, b in zip(starts, ends, first, last):
+        if end <= start:
+            substrings.append("")
+            continue
+        # a span can end on the space after its last token
+        stringx = " ".join(store["vocab"][tokens[a:b]]) + (
+            " " if b < len(tokens) else ""
+        )
+        offset = token_starts[a]
+        substrings.append(stringx[start - offset : end - offset])
+    return substrings
+
+
+def doc_sentence_spans(store, i):
+    "(start, end) character offsets of the |-delimited sentences of document i, in the order of stringx.split('|')"
+    pipes = store["sentence_offsets"][
+        store["sentence_doc_offsets"][i] : store["sentence_doc_offsets"][i + 1]
+    ]
+    tokens = doc_tokens(store, i)
+    n_chars = int(store["token_lengths"][tokens].sum()) + max(len(tokens) - 1, 0)
+    starts = np.concatenate([[0], pipes + 1])
+    ends = np.concatenate([pipes, [n_chars]])
+    return starts, ends
@@ -0,0 +1,194 @@
+import os
+import pandas as pd
+import plotly.express as px
+import streamlit as st
+import sys
+
+from helper.phrase_counts import top_phrases
+from helper.near_duplicates import excluded_text_ids
+from helper.text_transformation import initialize_processor
+from helper.progress_bar import Logger
+from helper.token_store import doc_rows, gen_token_store
+
+
+# gen top phrases excel
+def gen_top_phrases():
+    st.markdown("### Top phrases")
+    st.markdown(
+        "Display the top n phrases of several words, e.g. 'climate finance', in the corpus."
+    )
+
+    st.session_state["n_top_phrases"] = st.number_input(
+        "Top n phrases",
+        min_value=1,
+        value=50,
+        help="How many top n phrases to return",
+    )
+
+    st.session_state["phrase_n_words"] = st.number_input(
+        "Number of words in a phrase",
+        min_value=2,
+        max_value=5,
+        value=2,
+        help="How many words long the phrases are. E.g., 2 for phrases like 'climate finance', 3 for phrases like 'least developed countries'. Phrases never run across the end of a sentence.",
+    )
+
+    st.session_state["top_phrases_text_ids"] = st.text_input(
+        "List of text ids to consider in the count",
+        value="",
+        help="A comma separated list of text ids to consider in the phrase count. E.g., input `1,4,6` to get the top phrase count for only these documents. Leave blank to calculate for all documents in the corpus.",
+    )
+
+    if "metadata" in st.session_state:
+        with st.spinner("Loading corpus..."):
+            processor = initialize_processor()
+
+        st.session_state["top_phrases_groups"] = st.selectbox(
+            "Metadata column grouping to consider in the count",
+            options=["NA"]
+            + [
+                x
+                for x in st.session_state["metadata"].columns
+                if x
+                not in ["local_raw_filepath", "local_txt_filepath", "detected_language"]
+            ],
+            index=0,
+            help="You can alternatively select a metadata column to group the top phrases by. Leave as `NA` to not group.",
+        )
+
+        # selection of text ids
+        # near-duplicates are left out of the default selection if excluded
+        excluded = excluded_text_ids(processor.data_path)
+        if st.session_state["top_phrases_text_ids"] == "":
+            text_ids = [
+                x for x in processor.metadata.text_id.values if x not in excluded
+            ]
+        else:
+            text_ids = eval("[" + st.session_state["top_phrases_text_ids"] + "]")
+            # text ids entered by hand are used as they are, in the groups too
+            excluded = []
+
+        # words excluded from the counts
+        try:
+            exclude_words = list(
+                pd.read_excel(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/transformation_parameters.xlsx",
+                    sheet_name="exclude",
+                ).iloc[:, 0]
+            )
+        except:
+            exclude_words = []
+
+        # run button
+        st.session_state["run_top_phrases_button"] = st.button(
+            "Generate top phrases",
+            help="Generate top phrases in the documents.",
+        )
+
+        if st.session_state["run_top_phrases_button"]:
+            with st.spinner("Counting phrases..."):
+                # intialize progress bar in case necessary
+                old_stdout = sys.stdout
+                sys.stdout = Logger(st.progress(0), st.empty())
+
+                # no grouping
+                if st.session_state["top_phrases_groups"] == "NA":
+                    groups = {"all": text_ids}
+                # grouping
+                else:
+                    groups = {
+                        group: list(
+                            st.session_state["metadata"].loc[
+                                lambda x: (
+                                    x[st.session_state["top_phrases_groups"]] == group
+                                )
+                                & ~x.text_id.isin(excluded),
+                                "text_id",
+                            ]
+                        )
+                        for group in st.session_state["metadata"][
+                            st.session_state["top_phrases_groups"]
+                        ]
+                        .dropna()
+                        .unique()
+                    }
+
+                store = gen_token_store(
+                    processor.data_path,
+                    list(st.session_state["metadata"].text_id.values),
+                    "transformed",
+                )
+                rows = doc_rows(store)
+
+                dfs = []
+                for group, group_text_ids in groups.items():
+                    phrases = top_phrases(
+                        store,
+                        [rows[x] for x in group_text_ids if x in rows],
+                        n=st.session_state["phrase_n_words"],
+                        n_phrases=st.session_state["n_top_phrases"],
+                        exclude_words=exclude_words,
+                        group_name=group,
+                    )
+                    tmp_df = pd.DataFrame(phrases, columns=["phrase", "count"])
+                    if st.session_state["top_phrases_groups"] != "NA":
+                        tmp_df.insert(0, st.session_state["top_phrases_groups"], group)
+                    dfs.append(tmp_df)
+                df = pd.concat(dfs, ignore_index=True)
+
+            st.info("Top phrases successfully calculated!")
+
+            # clear the progress bar
+            try:
+                sys.stdout = sys.stdout.clear()
+                sys.stdout = old_stdout
+            except:
+                pass
+
+            df.to_csv(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/top_phrases.csv",
+                index=False,
+            )
+
+        if os.path.exists(
+            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/top_phrases.csv"
+        ):
+            pd.read_csv(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/top_phrases.csv"
+            ).to_excel(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/top_phrases.xlsx",
+                index=False,
+            )
+
+            # download button
+            with open(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/top_phrases.xlsx",
+                "rb",
+            ) as template_file:
+                template_byte = template_file.read()
+
+            st.download_button(
+                "Download top phrases",
+                template_byte,
+                "top_phrases.xlsx",
+                "application/octet-stream",
+                help="Download the top phrases.",
+            )
+
+            # bar plot(s)
+            plot_df = pd.read_csv(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/top_phrases.csv",
+            )
+            fig = px.bar(
+                plot_df,
+                x="phrase",
+                y="count",
+                color=plot_df.columns[0] if len(plot_df.columns) > 2 else None,
+            )
+            fig.update_layout(
+                yaxis_title="Count",
+                xaxis_title="",
+                title=f"Top {st.session_state['n_top_phrases']} phrases",
+                xaxis_type="category",
+            )
+            st.plotly_chart(fig, height=450, use_container_width=True)
@@ -1,12 +1,81 @@
+import hashlib
+import matplotlib.pyplot as plt
 import os
 import pandas as pd
 import plotly.express as px
 import streamlit as st
 import sys
 
+from helper.corpus_cache import cache_path
+from helper.count_matrix import (
+    gen_word_count_matrix,
+    grouped_top_terms,
+    top_terms,
+    word_count_version,
+)
+from helper.near_duplicates import excluded_text_ids
 from helper.text_transformation import initialize_processor
 from helper.progress_bar import Logger
 
+# number of rendered word clouds kept per corpus
+word_cloud_cache_size = 50
+
+
+def word_cloud_image(processor, text_ids, n_words, exclude_words):
+    "path of a PNG of the word cloud of the top words, cached in the corpus's cache/word_clouds/ directory by the word counts' version and the options"
+    cache_dir = f"{cache_path(processor.data_path)}word_clouds/"
+    os.makedirs(cache_dir, exist_ok=True)
+
+    key = hashlib.md5(
+        str(
+            [
+                word_count_version(
+                    processor.data_path,
+                    list(processor.metadata.text_id.values),
+                    "transformed",
+                ),
+                n_words,
+                list(text_ids),
+                list(exclude_words),
+            ]
+        ).encode()
+    ).hexdigest()
+    png_path = f"{cache_dir}{key}.png"
+
+    if not os.path.exists(png_path):
+        matrix, vocab, row_text_ids = gen_word_count_matrix(
+            data_path=processor.data_path,
+            text_ids=list(processor.metadata.text_id.values),
+            path_prefix="transformed",
+        )
+        p, plot_df = processor.visualizations.word_cloud(
+            top_terms(
+                matrix,
+                vocab,
+                row_text_ids,
+                text_ids=text_ids,
+                n_words=n_words,
+                exclude_words=exclude_words,
+            ),
+            n_words,
+        )
+        p.savefig(f"{png_path}.tmp.png", bbox_inches="tight")
+        plt.close(p)
+        os.replace(f"{png_path}.tmp.png", png_path)
+
+        # keep the most recent word clouds only
+        try:
+            for file_name in sorted(
+                [x for x in os.listdir(cache_dir) if not x.endswith(".tmp.png")],
+                key=lambda x: os.path.getmtime(f"{cache_dir}{x}"),
+                reverse=True,
+            )[word_cloud_cache_size:]:
+                os.remove(f"{cache_dir}{file_name}")
+        except FileNotFoundError:
+            pass
+
+    return png_path
+
 
 # gen word count excel
 def gen_top_words():
@@ -44,13 +113,41 @@ def gen_top_words():
         )
 
         # selection of text ids
+        # near-duplicates are left out of the default selection if excluded
+        excluded = excluded_text_ids(processor.data_path)
         if st.session_state["top_words_text_ids"] == "":
-            text_ids = list(processor.metadata.text_id.values)
+            text_ids = [
+                x for x in processor.metadata.text_id.values if x not in excluded
+            ]
         else:
             text_ids = eval("[" + st.session_state["top_words_text_ids"] + "]")
+            # text ids entered by hand are used as they are, in the groups too
+            excluded = []
 
             # group by column
 
+        # words excluded from the counts
+        try:
+            if (
+                len(
+                    pd.read_excel(
+                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/transformation_parameters.xlsx",
+                        sheet_name="exclude",
+                    )
+                )
+                > 0
+            ):
+                exclude_words = list(
+                    pd.read_excel(
+                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/transformation_parameters.xlsx",
+                        sheet_name="exclude",
+                    ).iloc[:, 0]
+                )
+            else:
+                exclude_words = []
+        except:
+            exclude_words = []
+
         # run button
         st.session_state["run_top_words_button"] = st.button(
             "Generate top words",
@@ -58,89 +155,41 @@ def gen_top_words():
         )
 
         if st.session_state["run_top_words_button"]:
-            # generate the CSV first with all text ids regardless
-            try:
-                if (
-                    len(
-                        pd.read_excel(
-                            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/transformation_parameters.xlsx",
-                            sheet_name="exclude",
-                        )
-                    )
-                    > 0
-                ):
-                    exclude_words = list(
-                        pd.read_excel(
-                            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/transformation_parameters.xlsx",
-                            sheet_name="exclude",
-                        ).iloc[:, 0]
-                    )
-                else:
-                    exclude_words = []
-            except:
-                exclude_words = []
-
-            # remove an existing word count file
-            if os.path.exists(
-                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/transformed_word_counts.csv"
-            ):
-                os.remove(
-                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/transformed_word_counts.csv"
-                )
-
             # intialize progress bar in case necessary
             old_stdout = sys.stdout
             sys.stdout = Logger(st.progress(0), st.empty())
 
-            processor.gen_word_count_csv(
+            # word counts of every document, only recounted when the transformed texts change
+            matrix, vocab, row_text_ids = gen_word_count_matrix(
+                data_path=processor.data_path,
                 text_ids=list(processor.metadata.text_id.values),
                 path_prefix="transformed",
-                exclude_words=exclude_words,
             )
 
             # generate the CSV
             # no grouping
             if st.session_state["top_words_groups"] == "NA":
-                p, df = processor.bar_plot_word_count(
+                df = top_terms(
+                    matrix,
+                    vocab,
+                    row_text_ids,
                     text_ids=text_ids,
-                    path_prefix="transformed",
                     n_words=st.session_state["n_top_words"],
-                    title="",
+                    exclude_words=exclude_words,
                 )
-            # grouping
+            # grouping, all groups at once
             else:
-                groups = list(
-                    st.session_state["metadata"][
-                        st.session_state["top_words_groups"]
-                    ].unique()
+                df = grouped_top_terms(
+                    matrix,
+                    vocab,
+                    row_text_ids,
+                    metadata=st.session_state["metadata"].loc[
+                        lambda x: ~x.text_id.isin(excluded)
+                    ],
+                    group_column=st.session_state["top_words_groups"],
+                    n_words=st.session_state["n_top_words"],
+                    exclude_words=exclude_words,
                 )
-                for group in groups:
-                    tmp_ids = list(
-                        st.session_state["metadata"].loc[
-                            lambda x: x[st.session_state["top_words_groups"]] == group,
-                            "text_id",
-                        ]
-                    )
-                    p, tmp_df = processor.bar_plot_word_count(
-                        text_ids=tmp_ids,
-                        path_prefix="transformed",
-                        n_words=st.session_state["n_top_words"],
-                        title="",
-                    )
-                    tmp_df[st.session_state["top_words_groups"]] = group
-                    tmp_df = tmp_df.loc[
-                        :,
-                        [st.session_state["top_words_groups"]]
-                        + [
-                            x
-                            for x in tmp_df.columns
-                            if x != st.session_state["top_words_groups"]
-                        ],
-                    ]
-                    if group == groups[0]:
-                        df = tmp_df.copy()
-                    else:
-                        df = pd.concat([df, tmp_df], ignore_index=True)
 
             st.info("Top words successfully calculated!")
 
@@ -201,14 +250,15 @@ def gen_top_words():
 
             if st.session_state["top_words_groups"] == "NA":
                 st.markdown("### Word cloud")
-                # wordcloud
-                p, plot_df = processor.word_cloud(
-                    text_ids=text_ids,
-                    path_prefix="transformed",
-                    n_words=st.session_state["n_top_words"],
+                # wordcloud, only laid out again when the counts or options change
+                st.image(
+                    word_cloud_image(
+                        processor,
+                        text_ids=text_ids,
+                        n_words=st.session_state["n_top_words"],
+                        exclude_words=exclude_words,
+                    )
                 )
-
-                st.pyplot(p)
             else:
                 st.error(
                     "A word cloud can only be viewed if `Metadata column grouping to consider in the count` is set to `NA`."
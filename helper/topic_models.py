@@ -0,0 +1,244 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.decomposition import LatentDirichletAllocation, MiniBatchNMF
+
+from helper.corpus_cache import cache_path, file_fingerprint
+from helper.count_matrix import gen_word_count_matrix, transformed_paths
+
+# topic model methods
+topic_methods = ["LDA", "NMF"]
+
+# number of documents per minibatch
+topic_batch_size = 1024
+
+# passes over the corpus when a model is fitted from scratch, documents added later are one pass
+topic_passes = 5
+
+# most frequent words kept in a model's vocabulary, which bounds the size of the topics
+topic_max_words = 20000
+
+
+def topic_model_path(data_path, method, n_topics):
+    "file of a fitted topic model"
+    path = f"{cache_path(data_path)}topic_models/"
+    os.makedirs(path, exist_ok=True)
+    return f"{path}{method.lower()}_{n_topics}.pkl"
+
+
+def new_topic_model(method, n_topics, n_docs):
+    "an unfitted online topic model"
+    if method == "NMF":
+        # Kullback-Leibler divergence suits word counts
+        return MiniBatchNMF(
+            n_components=n_topics,
+            beta_loss="kullback-leibler",
+            batch_size=topic_batch_size,
+            random_state=42,
+        )
+    return LatentDirichletAllocation(
+        n_components=n_topics,
+        learning_method="online",
+        batch_size=topic_batch_size,
+        total_samples=max(n_docs, 1),
+        random_state=42,
+    )
+
+
+def model_counts(matrix, vocab, model_vocab):
+    "word counts restricted to the columns of a model's vocabulary, words the model does not know are dropped"
+    columns = pd.Index(vocab).get_indexer(model_vocab)
+    known = columns >= 0
+    selection = sparse.csr_matrix(
+        (
+            np.ones(known.sum()),
+            (columns[known], np.flatnonzero(known)),
+        ),
+        shape=(len(vocab), len(model_vocab)),
+    )
+    return (matrix @ selection).tocsr()
+
+
+def fit_batches(model, counts, rows, passes):
+    "partial_fit a topic model on minibatches of rows of the counts, so only one minibatch is densified at a time"
+    rows = np.asarray(rows)
+    rng = np.random.default_rng(42)
+    for n_pass in range(passes):
+        order = rng.permutation(rows)
+        for start in range(0, len(order), topic_batch_size):
+            print(
+                f"fitting topics: {n_pass * len(order) + min(start + topic_batch_size, len(order))}/{passes * len(order)}"
+            )
+            batch = counts[np.sort(order[start : start + topic_batch_size])]
+            if batch.nnz > 0:
+                model.partial_fit(batch)
+
+
+def document_topics(model, counts):
+    "topic proportions of each document, calculated a minibatch at a time. Documents without any words have none"
+    proportions = np.full((counts.shape[0], model.n_components), np.nan)
+    for start in range(0, counts.shape[0], topic_batch_size):
+        batch = counts[start : start + topic_batch_size]
+        weights = model.transform(batch)
+        totals = weights.sum(axis=1, keepdims=True)
+        has_words = (np.asarray(batch.sum(axis=1)).ravel() > 0) & (totals[:, 0] > 0)
+        proportions[start : start + topic_batch_size][has_words] = (
+            weights[has_words] / totals[has_words]
+        )
+    return proportions
+
+
+def gen_topic_model(
+    processor, method, n_topics, exclude_words=None, exclude_text_ids=None
+):
+    """online topic model of the transformed texts, fitted in minibatches on the corpus's cached word count matrix. Models are stored in the corpus's cache/topic_models/ directory per method and number of topics. If the only change since a model was fitted is documents added to the corpus, the model is updated with a pass over the new documents instead of fitted again
+    parameters:
+        :processor: nlp_processor: processor of the corpus
+        :method: str: `LDA` for online latent Dirichlet allocation or `NMF` for online non-negative matrix factorization
+        :n_topics: int: number of topics
+        :exclude_words: list[str]: words left out of the topics
+        :exclude_text_ids: list[int]: documents left out of the model, e.g. near-duplicates
+    output:
+        :dict: with entries:
+            :vocab: np.ndarray: word of each column of the topics
+            :topics: np.ndarray: n_topics x words, the weight of each word in each topic, summing to 1 per topic
+            :text_ids: np.ndarray: text id of each document
+            :document_topics: np.ndarray: documents x n_topics, the proportion of each topic in each document
+    """
+    exclude_words = sorted(set(exclude_words or []))
+    corpus_ids = list(processor.metadata.text_id.values)
+    matrix, vocab, row_text_ids = gen_word_count_matrix(
+        processor.data_path, corpus_ids, "transformed"
+    )
+
+    # excluded documents are dropped from the rows, so the stored model is updated or fitted again as if they were added to or removed from the corpus
+    rows = np.flatnonzero(~np.isin(row_text_ids, list(exclude_text_ids or [])))
+    matrix, row_text_ids = matrix[rows], np.asarray(row_text_ids)[rows]
+    corpus_ids = list(row_text_ids)
+    fingerprints = [
+        file_fingerprint(x)
+        for x in transformed_paths(processor.data_path, corpus_ids, "transformed")
+    ]
+    model_path = topic_model_path(processor.data_path, method, n_topics)
+
+    stored = None
+    if os.path.exists(model_path):
+        try:
+            with open(model_path, "rb") as f:
+                stored = pickle.load(f)
+        except:
+            stored = None
+    if (stored is not None) and (stored["exclude_words"] != exclude_words):
+        stored = None
+
+    if stored is not None:
+        stored_fingerprints = dict(zip(stored["text_ids"], stored["fingerprints"]))
+        current = dict(zip(corpus_ids, fingerprints))
+
+        # reuse as is, update with the new documents, or fit again if documents changed or were removed
+        if stored_fingerprints == current:
+            return stored
+        if all(current.get(x) == y for x, y in stored_fingerprints.items()):
+            model, model_vocab = stored["model"], stored["vocab"]
+            counts = model_counts(matrix, vocab, model_vocab)
+            new_rows = [
+                i for i, x in enumerate(corpus_ids) if x not in stored_fingerprints
+            ]
+            if method == "LDA":
+                model.total_samples = len(corpus_ids)
+            fit_batches(model, counts, new_rows, passes=1)
+        else:
+            stored = None
+
+    if stored is None:
+        # vocabulary of the most frequent words
+        keep = np.flatnonzero(~np.isin(vocab, exclude_words))
+        frequencies = np.asarray(matrix[:, keep].sum(axis=0)).ravel()
+        keep = np.sort(keep[np.argsort(-frequencies, kind="stable")[:topic_max_words]])
+        model_vocab = np.array(vocab)[keep]
+        counts = matrix[:, keep].tocsr()
+
+        model = new_topic_model(method, n_topics, len(corpus_ids))
+        fit_batches(model, counts, np.arange(len(corpus_ids)), passes=topic_passes)
+
+    topics = model.components_ / np.maximum(
+        model.components_.sum(axis=1, keepdims=True), np.finfo(float).tiny
+    )
+    result = {
+        "exclude_words": exclude_words,
+        "model": model,
+        "vocab": model_vocab,
+        "topics": topics,
+        "text_ids": np.array(row_text_ids),
+        "fingerprints": fingerprints,
+        "document_topics": document_topics(model, counts),
+    }
+
+    tmp_path = f"{model_path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(result, f)
+    os.replace(tmp_path, model_path)
+    return result
+
+
+def topic_columns(n_topics):
+    "names of the topic proportion columns"
+    return [f"topic_{i}" for i in range(1, n_topics + 1)]
+
+
+def topic_terms(topic_model, n_words):
+    """top words of each topic
+    parameters:
+        :topic_model: dict: fitted model from gen_topic_model
+        :n_words: int: number of words per topic
+    output:
+        :pd.DataFrame: with columns `topic`, `rank`, `word` and `weight`, the share of the topic the word accounts for
+    """
+    dfs = []
+    for i, weights in enumerate(topic_model["topics"], start=1):
+        top = np.argsort(-weights, kind="stable")[:n_words]
+        dfs.append(
+            pd.DataFrame(
+                {
+                    "topic": i,
+                    "rank": np.arange(1, len(top) + 1),
+                    "word": topic_model["vocab"][top],
+                    "weight": weights[top],
+                }
+            )
+        )
+    return pd.concat(dfs, ignore_index=True)
+
+
+def grouped_document_topics(topic_model, metadata, group_column=None):
+    """average topic proportions of the documents of each group
+    parameters:
+        :topic_model: dict: fitted model from gen_topic_model
+        :metadata: pd.DataFrame: metadata with `text_id` and the grouping column
+        :group_column: str: metadata column to group the documents by, None for all documents together
+    output:
+        :pd.DataFrame: the grouping column, `n_documents` and one column per topic, groups in order of first appearance in the metadata. Documents without any words are not counted
+    """
+    columns = topic_columns(topic_model["document_topics"].shape[1])
+    df = pd.DataFrame(topic_model["document_topics"], columns=columns)
+    if group_column is None:
+        group_column = "group"
+        df.insert(0, group_column, "all")
+    elif group_column == "text_id":
+        df.insert(0, group_column, topic_model["text_ids"])
+    else:
+        df.insert(
+            0,
+            group_column,
+            metadata.set_index("text_id")[group_column]
+            .reindex(topic_model["text_ids"])
+            .values,
+        )
+    df = df.dropna(subset=columns)
+
+    grouped = df.groupby(group_column, sort=False)[columns].mean()
+    grouped.insert(0, "n_documents", df.groupby(group_column, sort=False).size())
+    return grouped.reset_index()
@@ -0,0 +1,211 @@
+import os
+import pandas as pd
+import plotly.express as px
+import streamlit as st
+import sys
+
+from helper.near_duplicates import excluded_text_ids
+from helper.progress_bar import Logger
+from helper.text_transformation import initialize_processor
+from helper.topic_models import (
+    gen_topic_model,
+    grouped_document_topics,
+    topic_columns,
+    topic_methods,
+    topic_terms,
+)
+
+
+# gen topic model excel
+def gen_topics():
+    st.markdown("### Topic modelling")
+    st.markdown(
+        "Find the topics the documents are about with a [topic model](https://en.wikipedia.org/wiki/Topic_model). Each topic is a set of words that tend to occur together, and each document is a mix of topics."
+    )
+
+    st.session_state["topic_method"] = st.selectbox(
+        "Topic model",
+        options=topic_methods,
+        index=0,
+        help="`LDA` is [latent Dirichlet allocation](https://en.wikipedia.org/wiki/Latent_Dirichlet_allocation), `NMF` is [non-negative matrix factorization](https://en.wikipedia.org/wiki/Non-negative_matrix_factorization), which is often quicker and gives more distinct topics.",
+    )
+    st.session_state["n_topics"] = st.number_input(
+        "Number of topics",
+        min_value=2,
+        value=10,
+        help="How many topics to find in the corpus.",
+    )
+    st.session_state["n_topic_words"] = st.number_input(
+        "Top n words per topic",
+        min_value=1,
+        value=10,
+        help="How many of the most important words of each topic to list.",
+    )
+
+    if "metadata" in st.session_state:
+        with st.spinner("Loading corpus..."):
+            processor = initialize_processor()
+
+        st.session_state["topic_groups"] = st.selectbox(
+            "Metadata column grouping for the topic proportions",
+            options=["NA"]
+            + [
+                x
+                for x in st.session_state["metadata"].columns
+                if x
+                not in ["local_raw_filepath", "local_txt_filepath", "detected_language"]
+            ],
+            index=0,
+            help="You can alternatively select a metadata column to average the topic proportions of the documents by. Leave as `NA` to not group.",
+        )
+
+        # words excluded from the topics
+        try:
+            if (
+                len(
+                    pd.read_excel(
+                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/transformation_parameters.xlsx",
+                        sheet_name="exclude",
+                    )
+                )
+                > 0
+            ):
+                exclude_words = list(
+                    pd.read_excel(
+                        f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/transformation_parameters.xlsx",
+                        sheet_name="exclude",
+                    ).iloc[:, 0]
+                )
+            else:
+                exclude_words = []
+        except:
+            exclude_words = []
+
+        # run button
+        st.session_state["run_topics_button"] = st.button(
+            "Generate topics",
+            help="Fit the topic model and calculate the topics of the documents.",
+        )
+
+        if st.session_state["run_topics_button"]:
+            with st.spinner("Fitting topic model..."):
+                # intialize progress bar in case necessary
+                old_stdout = sys.stdout
+                sys.stdout = Logger(st.progress(0), st.empty())
+
+                # only fitted again when documents change, added documents update the stored model
+                topic_model = gen_topic_model(
+                    processor,
+                    method=st.session_state["topic_method"],
+                    n_topics=st.session_state["n_topics"],
+                    exclude_words=exclude_words,
+                    exclude_text_ids=excluded_text_ids(processor.data_path),
+                )
+
+                group_column = (
+                    None
+                    if st.session_state["topic_groups"] == "NA"
+                    else st.session_state["topic_groups"]
+                )
+                terms_df = topic_terms(topic_model, st.session_state["n_topic_words"])
+                grouped_df = grouped_document_topics(
+                    topic_model, st.session_state["metadata"], group_column
+                )
+                documents_df = pd.DataFrame(
+                    topic_model["document_topics"],
+                    columns=topic_columns(st.session_state["n_topics"]),
+                )
+                documents_df.insert(0, "text_id", topic_model["text_ids"])
+                if group_column not in [None, "text_id"]:
+                    documents_df.insert(
+                        1,
+                        group_column,
+                        st.session_state["metadata"]
+                        .set_index("text_id")[group_column]
+                        .reindex(topic_model["text_ids"])
+                        .values,
+                    )
+
+                terms_df.to_csv(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/topic_terms.csv",
+                    index=False,
+                )
+                grouped_df.to_csv(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/grouped_topics.csv",
+                    index=False,
+                )
+                with pd.ExcelWriter(
+                    f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/topics.xlsx"
+                ) as writer:
+                    terms_df.to_excel(writer, sheet_name="topic_terms", index=False)
+                    grouped_df.to_excel(
+                        writer, sheet_name="grouped_topics", index=False
+                    )
+                    documents_df.to_excel(
+                        writer, sheet_name="document_topics", index=False
+                    )
+
+                # clear the progress bar
+                try:
+                    sys.stdout = sys.stdout.clear()
+                    sys.stdout = old_stdout
+                except:
+                    pass
+
+            st.info("Topics successfully calculated!")
+
+        if os.path.exists(
+            f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/topics.xlsx"
+        ):
+            # download button
+            with open(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/topics.xlsx",
+                "rb",
+            ) as template_file:
+                template_byte = template_file.read()
+
+            st.download_button(
+                "Download topics",
+                template_byte,
+                "topics.xlsx",
+                "application/octet-stream",
+                help="Download the top words of each topic, the topic proportions of each group and of each document.",
+            )
+
+            # top words of each topic
+            terms_df = pd.read_csv(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/topic_terms.csv"
+            )
+            st.markdown("### Topics")
+            st.markdown(
+                "The most important words of each topic, by the share of the topic they account for."
+            )
+            st.dataframe(
+                terms_df.groupby("topic", sort=False)
+                .word.apply(lambda x: ", ".join(x.astype(str)))
+                .reset_index(),
+                hide_index=True,
+            )
+
+            # topic proportions by group
+            grouped_df = pd.read_csv(
+                f"corpora/{st.session_state['user_id']}_{st.session_state['selected_corpus']}/csv_outputs/grouped_topics.csv"
+            )
+            plot_df = grouped_df.melt(
+                id_vars=[grouped_df.columns[0], "n_documents"],
+                var_name="topic",
+                value_name="proportion",
+            )
+            fig = px.bar(
+                plot_df,
+                x=plot_df.columns[0],
+                y="proportion",
+                color="topic",
+            )
+            fig.update_layout(
+                yaxis_title="Average topic proportion",
+                xaxis_title="",
+                title="Topics by group",
+            )
+            fig.update_xaxes(type="category")
+            st.plotly_chart(fig, height=450, use_container_width=True)
@@ -0,0 +1,75 @@
+import os
+import random
+from collections import Counter
+
+import pytest
+
+import helper.phrase_counts as phrase_counts
+from helper.token_store import doc_rows, gen_token_store
+
+# few common words so that counts tie, many rare ones so the summary has to drop phrases
+fixture_words = ["trade", "war", "tariff", "of", "a", "12", "|", "end|start"] + [
+    f"w{i}" for i in range(60)
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    "token store of transformed texts in nlp_pipeline's format"
+    data_path = f"{tmp_path}/"
+    os.makedirs(f"{data_path}transformed_txt_files")
+    rng = random.Random(1)
+    for text_id in range(1, 21):
+        with open(
+            f"{data_path}transformed_txt_files/transformed_{text_id}.txt",
+            "w",
+            encoding="UTF-8",
+        ) as f:
+            f.write(
+                " ".join(
+                    rng.choice(
+                        fixture_words[:8] if rng.random() < 0.5 else fixture_words
+                    )
+                    for _ in range(rng.randint(0, 150))
+                )
+            )
+    return gen_token_store(data_path, list(range(1, 21)), "transformed")
+
+
+def reference_top_phrases(store, n, n_phrases, exclude_words):
+    "top phrases counted on the texts, breaking at words that aren't counted"
+    counts = Counter()
+    for i in range(len(store["text_ids"])):
+        words = list(
+            store["vocab"][
+                store["tokens"][store["doc_offsets"][i] : store["doc_offsets"][i + 1]]
+            ]
+        )
+        for j in range(len(words) - n + 1):
+            phrase = words[j : j + n]
+            if all(
+                len(x) > 1
+                and not x.isnumeric()
+                and "|" not in x
+                and x not in exclude_words
+                for x in phrase
+            ) and (" ".join(phrase) not in exclude_words):
+                counts[" ".join(phrase)] += 1
+    return sorted(counts.items(), key=lambda x: (-x[1], x[0]))[:n_phrases]
+
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+@pytest.mark.parametrize("capacity", [200000, 2])
+def test_top_phrases_exact(store, monkeypatch, n, capacity):
+    # a tiny summary forces the counts to be verified and then counted by partition
+    monkeypatch.setattr(phrase_counts, "phrase_capacity", capacity)
+    monkeypatch.setattr(phrase_counts, "phrase_batch_size", 100)
+    exclude_words = ["war", "trade of"]
+    for n_phrases in [1, 5]:
+        assert phrase_counts.top_phrases(
+            store,
+            list(doc_rows(store).values()),
+            n,
+            n_phrases,
+            exclude_words,
+        ) == reference_top_phrases(store, n, n_phrases, exclude_words)
@@ -0,0 +1,64 @@
+import os
+
+import pandas as pd
+import pytest
+
+from helper.search_index import (
+    alternates_pattern,
+    parse_near,
+    read_occurrence_offsets,
+    window_counts,
+)
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    "a transformed text with the search term `trade` and words at known distances from it"
+    data_path = f"{tmp_path}/"
+    os.makedirs(f"{data_path}transformed_txt_files")
+    with open(f"{data_path}transformed_txt_files/transformed_1.txt", "wb") as f:
+        f.write(b"| a tariff trade b c ship |")
+    return data_path
+
+
+def near_count(data_path, term):
+    "number of matches of a second-level term around the `trade` occurrence"
+    stringx = open(f"{data_path}transformed_txt_files/transformed_1.txt", "rb").read()
+    start = stringx.index(b" trade ")
+    offsets = pd.DataFrame(
+        {"text_id": [1], "term_id": [0], "start": [start], "end": [start + 7]}
+    )
+    near_tokens, alternates = parse_near(term)
+    return window_counts(
+        data_path, offsets, alternates_pattern(alternates), 100, near_tokens
+    )[0]
+
+
+@pytest.mark.parametrize(
+    "term, expected",
+    [
+        # adjacent words, on either side
+        ("NEAR/1 tariff", 1),
+        ("NEAR/1 b", 1),
+        # exactly k tokens away
+        ("NEAR/2 c", 1),
+        ("NEAR/3 ship", 1),
+        ("NEAR/2 a", 1),
+        # one token too far
+        ("NEAR/1 c", 0),
+        ("NEAR/2 ship", 0),
+        ("NEAR/1 a", 0),
+    ],
+)
+def test_near_windows_reach_k_tokens(data_path, term, expected):
+    assert near_count(data_path, term) == expected
+
+
+def test_occurrence_offsets_of_group(data_path):
+    os.makedirs(f"{data_path}csv_outputs")
+    pd.DataFrame({"text_id": [1], "term_id": [0], "start": [11], "end": [18]}).to_csv(
+        f"{data_path}csv_outputs/search_terms_group_a_occurrence_offsets.csv",
+        index=False,
+    )
+    assert read_occurrence_offsets(data_path) is None
+    assert read_occurrence_offsets(data_path, "group_a")["start"].tolist() == [11]
@@ -0,0 +1,140 @@
+import os
+import random
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import helper.sharded_search as sharded_search
+from helper.search_index import compact_occurrences, load_occurrences
+
+# words of the fixture texts, with search terms that repeat within sentences and span two words
+fixture_words = ["trade", "war", "tariff", "the", "of", "a", "port", "ship", "goods"]
+
+
+class FakeAnalyzer:
+    "deterministic stand-in for VADER, so the test does not need the lexicon"
+
+    def polarity_scores(self, stringx):
+        return {"compound": (sum(map(ord, stringx)) % 21 - 10) / 10}
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    "transformed texts in nlp_pipeline's `| sentence | sentence |` format, one without any search terms"
+    monkeypatch.setattr(sharded_search, "SentimentIntensityAnalyzer", FakeAnalyzer)
+
+    data_path = f"{tmp_path}/"
+    os.makedirs(f"{data_path}transformed_txt_files")
+    os.makedirs(f"{data_path}csv_outputs")
+
+    rng = random.Random(1)
+    texts = {
+        text_id: "| "
+        + " | ".join(
+            " ".join(rng.choice(fixture_words) for _ in range(rng.randint(1, 12)))
+            for _ in range(rng.randint(1, 30))
+        )
+        + " |"
+        for text_id in range(1, 9)
+    }
+    texts[9] = "| nothing to find here |"
+    for text_id, stringx in texts.items():
+        with open(
+            f"{data_path}transformed_txt_files/transformed_{text_id}.txt",
+            "w",
+            encoding="latin1",
+        ) as f:
+            f.write(stringx)
+
+    return SimpleNamespace(data_path=data_path, text_ids=list(texts))
+
+
+def search_terms(columns):
+    "search terms sheet with the given columns, the right-most one searched for"
+    terms = ["trade", "trade war", "tariff", "ship", "missing"]
+    df = pd.DataFrame({columns[-1]: terms})
+    for i, column in enumerate(columns[:-1]):
+        df.insert(i, column, [f"{column}_{j % (i + 2)}" for j in range(len(terms))])
+    return df
+
+
+def test_occurrence_offsets_line_up(corpus):
+    search_terms_df = search_terms(["grouping", "concept", "permutation"])
+    sharded_search.gen_search_terms_sharded(
+        SimpleNamespace(data_path=corpus.data_path),
+        "all",
+        corpus.text_ids,
+        search_terms_df,
+        "transformed",
+        character_buffer=20,
+        parallel=False,
+    )
+    occurrences = pd.read_csv(
+        f"{corpus.data_path}csv_outputs/search_terms_all_occurrences.csv"
+    )
+    offsets = pd.read_csv(
+        f"{corpus.data_path}csv_outputs/search_terms_all_occurrence_offsets.csv"
+    )
+
+    assert (offsets.text_id.values == occurrences.text_id.values).all()
+    assert (
+        search_terms_df.permutation.values[offsets.term_id.values]
+        == occurrences.permutation.values
+    ).all()
+    for text_id, start, end in zip(offsets.text_id, offsets.start, offsets.end):
+        with open(
+            f"{corpus.data_path}transformed_txt_files/transformed_{text_id}.txt",
+            "r",
+            encoding="latin1",
+        ) as f:
+            assert f.read()[start:end].strip() in search_terms_df.permutation.values
+
+    # contexts are dropped from the CSV and sliced back from the offsets
+    compact_occurrences(corpus.data_path, search_terms_df)
+    assert "character_buffer_context" not in pd.read_csv(
+        f"{corpus.data_path}csv_outputs/search_terms_all_occurrences.csv"
+    )
+    pd.testing.assert_frame_equal(
+        load_occurrences(corpus.data_path, 20), occurrences, check_dtype=False
+    )
+
+
+def test_compact_occurrences_checks_terms(corpus):
+    search_terms_df = search_terms(["grouping", "concept", "permutation"])
+    sharded_search.gen_search_terms_sharded(
+        SimpleNamespace(data_path=corpus.data_path),
+        "all",
+        corpus.text_ids,
+        search_terms_df,
+        "transformed",
+        character_buffer=20,
+        parallel=False,
+    )
+
+    # offsets of a different search terms sheet don't line up with the occurrences
+    reordered = search_terms_df.iloc[::-1].reset_index(drop=True)
+    compact_occurrences(corpus.data_path, reordered)
+    assert "character_buffer_context" in pd.read_csv(
+        f"{corpus.data_path}csv_outputs/search_terms_all_occurrences.csv"
+    )
+
+
+def test_sharded_search_without_occurrences(corpus):
+    search_terms_df = pd.DataFrame({"theme": ["a"], "term": ["missing"]})
+    sharded_search.gen_search_terms_sharded(
+        SimpleNamespace(data_path=corpus.data_path),
+        "all",
+        corpus.text_ids,
+        search_terms_df,
+        "transformed",
+        parallel=False,
+    )
+    for column in search_terms_df.columns:
+        counts = pd.read_csv(
+            f"{corpus.data_path}csv_outputs/search_terms_all_counts_by_{column}.csv"
+        )
+        assert len(counts) == 0
+        assert list(counts.columns[: len(search_terms_df.columns)]) == list(
+            search_terms_df.columns
+        )
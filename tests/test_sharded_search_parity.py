@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import helper.sharded_search as sharded_search
+from tests.test_sharded_search import FakeAnalyzer, corpus, search_terms
+
+library_search = pytest.importorskip("nlp_pipeline.search_terms")
+
+
+@pytest.fixture(autouse=True)
+def library_analyzer(monkeypatch):
+    "the library's search uses the same stand-in for VADER as the sharded search"
+    monkeypatch.setattr(library_search, "SentimentIntensityAnalyzer", FakeAnalyzer)
+
+
+def read_outputs(data_path, group_name, search_terms_df, aggregated):
+    "the CSVs written by a search"
+    files = [f"search_terms_{group_name}_occurrences.csv"] + [
+        f"search_terms_{group_name}_counts_by_{x}.csv" for x in search_terms_df.columns
+    ]
+    if aggregated:
+        files += [f"search_terms_grouped_by_{x}.csv" for x in search_terms_df.columns]
+    return {x: pd.read_csv(f"{data_path}csv_outputs/{x}") for x in files}
+
+
+def library_outputs(corpus, search_terms_df, match_exclusion):
+    processor = SimpleNamespace(data_path=corpus.data_path)
+    library_search.gen_search_terms(
+        processor,
+        "all",
+        corpus.text_ids,
+        search_terms_df,
+        "transformed",
+        character_buffer=20,
+        match_exclusion=match_exclusion,
+    )
+    library_search.gen_aggregated_search_terms(
+        processor,
+        corpus.text_ids,
+        [[x] for x in corpus.text_ids],
+        search_terms_df,
+        "transformed",
+        character_buffer=20,
+    )
+    return read_outputs(corpus.data_path, "all", search_terms_df, True)
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+@pytest.mark.parametrize("exclude", [False, True])
+@pytest.mark.parametrize(
+    "columns", [["grouping", "concept", "permutation"], ["theme", "term"]]
+)
+def test_sharded_search_matches_library(corpus, parallel, exclude, columns):
+    search_terms_df = search_terms(columns)
+    match_exclusion = (
+        pd.DataFrame(
+            {"permutation": ["trade", "ship"], "sentence_context": ["tariff", "port"]}
+        )
+        if exclude
+        else None
+    )
+    expected = library_outputs(corpus, search_terms_df, match_exclusion)
+
+    sharded_search.gen_search_terms_sharded(
+        SimpleNamespace(data_path=corpus.data_path),
+        "all",
+        corpus.text_ids,
+        search_terms_df,
+        "transformed",
+        character_buffer=20,
+        match_exclusion=match_exclusion,
+        aggregate_by_text_id=True,
+        parallel=parallel,
+        max_workers=2,
+    )
+    result = read_outputs(corpus.data_path, "all", search_terms_df, True)
+
+    for file_name, df in expected.items():
+        pd.testing.assert_frame_equal(result[file_name], df, obj=file_name)
@@ -0,0 +1,178 @@
+import os
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import helper.token_store as token_store
+from helper.summary_stats import gen_summary_stats_fused, summary_columns
+
+# tokens covering the edge cases of the statistics: single characters, numbers, non-ASCII letters and digits, page markers and sentence delimiters inside words
+fixture_words = [
+    "trade",
+    "the",
+    "a",
+    "ökonomie",
+    "ÉCU",
+    "12",
+    "3.5",
+    "x",
+    "[newpage]",
+    "٣٤",
+    "ab|cd",
+    "|",
+    "Ⅻ",
+    "naïve",
+    "42abc",
+    "of",
+]
+
+
+def word_frequency(word, language):
+    "deterministic stand-in for nlp_pipeline's get_word_frequency"
+    return (sum(map(ord, word)) % 50) / 7 + (0.5 if language == "de" else 0)
+
+
+def reference_stats(data_path, text_id, language):
+    "statistics of a document computed like nlp_pipeline's gen_summary_stats_csv, except num_chars_alpha is the real count"
+    with open(
+        f"{data_path}transformed_txt_files/transformed_{text_id}.txt",
+        "r",
+        encoding="UTF-8",
+    ) as file:
+        stringx = file.read()
+    try:
+        with open(f"{data_path}txt_files/{text_id}.txt", "r", encoding="UTF-8") as file:
+            orig_stringx = file.read()
+    except FileNotFoundError:
+        orig_stringx = ""
+
+    word_lengths = [len(x) for x in orig_stringx.split(" ") if len(x) > 1]
+    incidences = [
+        word_frequency(x, language) for x in orig_stringx.split(" ") if len(x) > 1
+    ]
+    num_chars_numeric = sum(c.isdigit() for c in stringx)
+    num_chars_alpha = sum(c.isalpha() for c in stringx)
+    return [
+        len([x for x in stringx.split(" ") if len(x) > 1]),
+        len(set([x for x in stringx.split(" ") if len(x) > 1])),
+        len([x for x in stringx.split("|") if len(x) > 2]),
+        orig_stringx.count("[newpage]"),
+        sum(word_lengths) / len(word_lengths) if len(word_lengths) > 0 else 0,
+        sum(incidences) / len(incidences) if len(incidences) > 0 else 0,
+        num_chars_numeric,
+        num_chars_alpha,
+        num_chars_numeric / (num_chars_numeric + max(num_chars_alpha, 1)),
+    ]
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    "small corpus with an empty document, a document without letters and a document without an original text"
+    data_path = f"{tmp_path}/"
+    os.makedirs(f"{data_path}txt_files")
+    os.makedirs(f"{data_path}transformed_txt_files")
+    os.makedirs(f"{data_path}csv_outputs")
+
+    rng = random.Random(1)
+    texts = {
+        text_id: " ".join(rng.choice(fixture_words) for _ in range(rng.randint(1, 400)))
+        for text_id in range(1, 13)
+    }
+    texts[13] = ""
+    texts[14] = "12 34 | 5"
+    for text_id, stringx in texts.items():
+        with open(f"{data_path}txt_files/{text_id}.txt", "w", encoding="UTF-8") as f:
+            f.write(stringx + "\n\nend  two")
+        with open(
+            f"{data_path}transformed_txt_files/transformed_{text_id}.txt",
+            "w",
+            encoding="UTF-8",
+        ) as f:
+            f.write(stringx.lower())
+    with open(
+        f"{data_path}transformed_txt_files/transformed_15.txt", "w", encoding="UTF-8"
+    ) as f:
+        f.write("no original text")
+
+    text_ids = list(range(1, 17))
+    return SimpleNamespace(
+        data_path=data_path,
+        metadata=pd.DataFrame(
+            {
+                "text_id": text_ids,
+                "local_txt_filepath": [
+                    f"{data_path}txt_files/{x}.txt" for x in text_ids
+                ],
+                "detected_language": ["de" if x % 2 else "en" for x in text_ids],
+            }
+        ),
+        text_transformation=SimpleNamespace(get_word_frequency=word_frequency),
+    )
+
+
+def check_against_reference(processor):
+    csv = pd.read_csv(
+        f"{processor.data_path}csv_outputs/transformed_summary_stats.csv"
+    ).set_index("text_id")
+    for text_id, language in zip(
+        processor.metadata.text_id, processor.metadata.detected_language
+    ):
+        if not os.path.exists(
+            f"{processor.data_path}transformed_txt_files/transformed_{text_id}.txt"
+        ):
+            assert csv.loc[text_id, summary_columns].isna().all()
+            continue
+        np.testing.assert_allclose(
+            csv.loc[text_id, summary_columns].astype(float).values,
+            reference_stats(processor.data_path, text_id, language),
+            rtol=1e-12,
+        )
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_summary_stats_match_reference(corpus, parallel):
+    gen_summary_stats_fused(
+        corpus,
+        list(corpus.metadata.text_id),
+        "transformed",
+        parallel=parallel,
+        max_workers=2,
+    )
+    check_against_reference(corpus)
+
+
+def test_summary_stats_real_alpha_count(corpus):
+    gen_summary_stats_fused(corpus, list(corpus.metadata.text_id), "transformed")
+    csv = pd.read_csv(
+        f"{corpus.data_path}csv_outputs/transformed_summary_stats.csv"
+    ).set_index("text_id")
+    assert csv.loc[13, "num_chars_alpha"] == 0
+    assert csv.loc[14, "num_chars_alpha"] == 0
+    assert csv.loc[14, "numeric_proportion"] == pytest.approx(5 / 6)
+
+
+# changed documents from rebuilt token stores, and from their own texts
+@pytest.mark.parametrize("rebuild_share", [0.0, 1.0])
+def test_summary_stats_update_changed_documents(corpus, monkeypatch, rebuild_share):
+    monkeypatch.setattr(token_store, "store_rebuild_share", rebuild_share)
+    text_ids = list(corpus.metadata.text_id)
+    gen_summary_stats_fused(corpus, text_ids, "transformed")
+
+    with open(
+        f"{corpus.data_path}transformed_txt_files/transformed_3.txt",
+        "a",
+        encoding="UTF-8",
+    ) as f:
+        f.write(" newword 77 | x")
+    with open(f"{corpus.data_path}txt_files/4.txt", "a", encoding="UTF-8") as f:
+        f.write(" brandneu [newpage]")
+    os.remove(f"{corpus.data_path}transformed_txt_files/transformed_5.txt")
+
+    gen_summary_stats_fused(corpus, text_ids, "transformed")
+    check_against_reference(corpus)
+    assert (token_store.current_token_store(corpus.data_path, text_ids) is None) == (
+        rebuild_share == 1.0
+    )